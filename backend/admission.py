@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_request_context, jsonify, request
+
+import config
+
+# Load shedding in front of the routes, so a burst of heavy reads can't
+# take the threads and connections the sell counter needs.
+#
+# Every route belongs to a priority class. A class runs at most `limit`
+# requests at once per worker, some routes have a cap of their own, and
+# all classes together run at most ADMISSION_MAX_ACTIVE, of which
+# ADMISSION_RESERVED are kept for the critical class. A request that can't
+# start waits in its class's bounded queue; when a slot frees up, waiting
+# critical requests go before standard ones and those before reports. A
+# full queue, or a wait longer than the class allows, gets a 503 with
+# Retry-After.
+#
+# Each class (and some routes) also gets a MySQL max_execution_time, set on
+# the connections it takes from the pools, so a runaway report query is
+# cancelled on the server instead of holding its connection.
+CLASSES = ('critical', 'standard', 'reporting')
+
+ROUTE_CLASSES = {
+    'api.sell_product': 'critical',
+    'api.checkout': 'critical',
+    'api.replay': 'critical',
+    'api.add_product_entry': 'critical',
+    'api.add_product_entries': 'critical',
+    'api.get_product_history': 'reporting',
+    'api.get_sale_history': 'reporting',
+    'api.sales_report': 'reporting',
+    'api.sales_export': 'reporting',
+    'api.product_analytics': 'reporting',
+}
+
+# Long-lived streams have their own cap (EVENTS_MAX_SUBSCRIBERS), and
+# monitoring must answer when everything else is being turned away
+EXEMPT = {'api.event_stream', 'api.pool_stats', 'metrics.metrics_endpoint'}
+
+# Per-route caps; ADMISSION_ROUTE_LIMITS adds to or overrides these
+ROUTE_LIMITS = {
+    'api.sales_export': 1,
+    'api.product_analytics': 1,
+}
+
+# Per-route statement timeouts in ms, overriding the class's
+ROUTE_STATEMENT_MS = {
+    # Streams for as long as the client keeps reading
+    'api.sales_export': 0,
+}
+
+# Routes that stream every row when called without ?limit=. A timeout
+# would cut such a response off partway through its 200 body, so only
+# their pages get one.
+STREAMED_WITHOUT_LIMIT = {'api.get_product_history', 'api.get_sale_history'}
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AdmissionController:
+    def __init__(self, settings):
+        self.max_active = settings['max_active']
+        self.reserved = settings['reserved']
+        self.classes = settings['classes']
+        self.route_limits = dict(ROUTE_LIMITS, **settings['route_limits'])
+        self._cond = threading.Condition()
+        self._active = Counter()
+        self._route_active = Counter()
+        self._waiting = Counter()
+        self.admitted = Counter()
+        self.queued = Counter()
+        self.shed = Counter()
+
+    def _can_start(self, name, endpoint):
+        if self._active[name] >= self.classes[name]['limit']:
+            return False
+        limit = self.route_limits.get(endpoint)
+        if limit is not None and self._route_active[endpoint] >= limit:
+            return False
+        # Everything but the critical class shares what isn't reserved
+        if name != CLASSES[0] and self._non_critical() >= self.max_active - self.reserved:
+            return False
+        # Free slots go to waiting requests of higher classes first
+        higher = sum(self._waiting[other] for other in CLASSES[:CLASSES.index(name)])
+        return sum(self._active.values()) + higher < self.max_active
+
+    def _non_critical(self):
+        return sum(self._active[name] for name in CLASSES[1:])
+
+    def acquire(self, name, endpoint):
+        settings = self.classes[name]
+        with self._cond:
+            if not self._can_start(name, endpoint):
+                if self._waiting[name] >= settings['queue']:
+                    self.shed[name] += 1
+                    raise Overloaded()
+                self._waiting[name] += 1
+                self.queued[name] += 1
+                deadline = time.monotonic() + settings['wait']
+                try:
+                    while not self._can_start(name, endpoint):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.shed[name] += 1
+                            raise Overloaded()
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting[name] -= 1
+                    # A request leaving the queue may unblock lower classes
+                    self._cond.notify_all()
+            self._active[name] += 1
+            self._route_active[endpoint] += 1
+            self.admitted[name] += 1
+
+    def release(self, name, endpoint):
+        with self._cond:
+            self._active[name] -= 1
+            self._route_active[endpoint] -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_active': self.max_active,
+                'reserved': self.reserved,
+                'classes': {name: {'limit': self.classes[name]['limit'], 'active': self._active[name],
+                                   'waiting': self._waiting[name], 'admitted': self.admitted[name],
+                                   'queued': self.queued[name], 'shed': self.shed[name]}
+                            for name in CLASSES},
+                'routes': {endpoint: {'limit': limit, 'active': self._route_active[endpoint]}
+                           for endpoint, limit in sorted(self.route_limits.items())},
+            }
+
+
+controller = AdmissionController(config.ADMISSION_CONFIG)
+
+
+def route_class(endpoint):
+    return ROUTE_CLASSES.get(endpoint, 'standard')
+
+
+# The current request's statement timeout; background jobs run without one
+def statement_timeout_ms():
+    if not has_request_context():
+        return 0
+    return g.get('statement_ms', 0)
+
+
+def _set_statement_timeout(conn):
+    conn.set_session('max_execution_time', statement_timeout_ms())
+
+
+def _admit():
+    endpoint = request.endpoint
+    if request.method == 'OPTIONS' or endpoint is None or endpoint in EXEMPT:
+        return None
+    name = route_class(endpoint)
+    try:
+        controller.acquire(name, endpoint)
+    except Overloaded:
+        response = jsonify({'message': 'Server busy, try again shortly'})
+        response.headers['Retry-After'] = str(config.ADMISSION_CONFIG['retry_after'])
+        return response, 503
+    g.admission = (name, endpoint)
+    if endpoint in STREAMED_WITHOUT_LIMIT and request.args.get('limit') is None:
+        g.statement_ms = 0
+    else:
+        g.statement_ms = ROUTE_STATEMENT_MS.get(endpoint, config.ADMISSION_CONFIG['classes'][name]['statement_ms'])
+    return None
+
+
+# Holds the slot until the body has been sent, so a streamed export counts
+# for as long as it runs
+def _release_on_close(response):
+    admission = g.pop('admission', None)
+    if admission is not None:
+        response.call_on_close(lambda: controller.release(*admission))
+    return response
+
+
+# For requests that never got as far as a response
+def _release(exc):
+    admission = g.pop('admission', None)
+    if admission is not None:
+        controller.release(*admission)
+
+
+def init_app(app):
+    if not config.ADMISSION_CONFIG['enabled']:
+        return
+    # SQLite has no per-session statement timeout
+    if config.DB_ENGINE != 'sqlite':
+        config.CHECKOUT_HOOK = _set_statement_timeout
+        config.get_pool().checkout_hook = _set_statement_timeout
+    app.before_request(_admit)
+    app.after_request(_release_on_close)
+    app.teardown_request(_release)
@@ -0,0 +1,312 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import numpy as np
+
+import archive
+import config
+from routing import get_read_connection
+from schema import day_range
+
+# Per-product margins over a date range, computed from the raw sale lines
+# and stock loads rather than the daily totals of the Profit & Loss page.
+#
+# Both tables are read as NumPy columns (day number, product code, quantity,
+# value) one month at a time. Closed months never change, so each worker
+# keeps them in an LRU cache and a repeated or widened range only reads
+# today's rows from MySQL; archived months come from their .npz files. The
+# per-product sums are then a bincount per column.
+#
+# Figures per product, for stock that was on hand during the range:
+#   available   opening stock (the previous day's leftover) plus loads
+#   unit_cost   available value / available quantity, the weighted average
+#               cost of that stock
+#   revenue     sum of sales.total_price, what customers were charged
+#   cost_basis  sold quantity at unit_cost
+#   margin      revenue - cost_basis
+#   sell_through  sold / available quantity
+#   wastage     available - sold - closing stock (what neither sold nor
+#               carried forward), valued at unit_cost
+#   net         margin - wastage value
+#
+# Opening and closing stock come from product_entries, which the day close
+# job trims after DAY_CLOSE_KEEP_DAYS; for older days they count as zero.
+
+# Per table: timestamp column and the value column summed with quantity
+TABLES = {
+    'sales': ('sale_date', 'total_price'),
+    'product_entry_history': ('created_at', 'price'),
+}
+
+FETCH_SIZE = 5000
+
+EPOCH = date(1970, 1, 1)
+
+
+def day_number(day):
+    return (day - EPOCH).days
+
+
+class ProductIndex:
+    # Dense integer codes for (category, product) pairs, shared by every
+    # cached chunk of this process so their columns can be summed together.
+    # Codes are only ever added.
+    def __init__(self):
+        self._codes = {}
+        self._keys = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def code(self, key):
+        code = self._codes.get(key)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(key)
+                if code is None:
+                    code = len(self._keys)
+                    self._keys.append(key)
+                    self._codes[key] = code
+        return code
+
+    def codes(self, keys):
+        codes = list(map(self._codes.get, keys))
+        if None in codes:
+            codes = [self.code(key) for key in keys]
+        return codes
+
+    def keys(self, count=None):
+        return self._keys[:count]
+
+
+product_index = ProductIndex()
+
+
+def _chunk(days, codes, quantities, values):
+    return {
+        'day': np.asarray(days, dtype=np.int32),
+        'code': np.asarray(codes, dtype=np.int32),
+        'quantity': np.asarray(quantities, dtype=np.float64),
+        'value': np.asarray(values, dtype=np.float64),
+    }
+
+
+# Reads [first_day, end_day) of a live table. Numbers are cast to DOUBLE and
+# timestamps to day numbers in SQL, which keeps the connector from building
+# a Decimal and a datetime per value.
+def _load_live(table, first_day, end_day):
+    ts_column, value_column = TABLES[table]
+    days, codes, quantities, values = [], [], [], []
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT DATEDIFF(%(ts)s, '1970-01-01'), category, product, quantity + 0E0, %(value)s + 0E0
+            FROM %(table)s WHERE %(ts)s >= %%s AND %(ts)s < %%s
+        """ % {'ts': ts_column, 'value': value_column, 'table': table},
+                       (day_range(first_day)[0], day_range(end_day)[0]))
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            days.extend(columns[0])
+            codes.extend(product_index.codes(list(zip(columns[1], columns[2]))))
+            quantities.extend(columns[3])
+            values.extend(columns[4])
+        cursor.close()
+    return _chunk(days, codes, quantities, values)
+
+
+# Archived months are already columnar; only the dictionary codes of the
+# file are mapped onto the process-wide ones, once per distinct pair.
+def _load_archived(table, path):
+    arrays = archive.load_month(path)
+    products = arrays['products']
+    pairs, inverse = np.unique(arrays['category_codes'].astype(np.int64) * len(products) + arrays['product_codes'],
+                               return_inverse=True)
+    categories = arrays['categories']
+    mapping = np.array([product_index.code((str(categories[pair // len(products)]),
+                                            str(products[pair % len(products)])))
+                        for pair in pairs.tolist()], dtype=np.int32)
+    _, value_column = TABLES[table]
+    return _chunk(arrays['ts'].astype('datetime64[D]').astype(np.int64), mapping[inverse.ravel()],
+                  arrays['quantity'], arrays[value_column])
+
+
+class ChunkCache:
+    def __init__(self, size):
+        self.size = size
+        self._chunks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        with self._lock:
+            chunk = self._chunks.get(key)
+            if chunk is not None:
+                self._chunks.move_to_end(key)
+                return chunk
+        # Loaded outside the lock; two threads missing at once both load
+        chunk = load()
+        with self._lock:
+            self._chunks[key] = chunk
+            while len(self._chunks) > self.size:
+                self._chunks.popitem(last=False)
+        return chunk
+
+    def clear(self):
+        with self._lock:
+            self._chunks.clear()
+
+
+chunk_cache = ChunkCache(config.ANALYTICS_CONFIG['cache_chunks'])
+
+
+# The chunks covering [first_day, last_day]: a file per archived month, a
+# cached read per closed live month (or the closed part of this month,
+# keyed by today so it is read again tomorrow) and today's rows uncached.
+def load_chunks(table, first_day, last_day, today=None):
+    today = today or date.today()
+    archived = dict(archive.archived_months(table))
+    chunks = []
+    month = archive.month_start(first_day)
+    while month <= last_day and month <= today:
+        next_month = archive.add_months(month, 1)
+        if month in archived:
+            path = archived[month]
+            chunks.append(chunk_cache.get(('archive', table, path), lambda: _load_archived(table, path)))
+        elif next_month <= today:
+            chunks.append(chunk_cache.get(('live', table, month),
+                                          lambda: _load_live(table, month, next_month)))
+        else:
+            if month < today:
+                chunks.append(chunk_cache.get(('live', table, month, today),
+                                              lambda: _load_live(table, month, today)))
+            chunks.append(_load_live(table, today, today + timedelta(days=1)))
+        month = next_month
+    return chunks
+
+
+# Leftover stock per product at the end of `day`, as a chunk
+def stock_on(day):
+    day_start, day_end = day_range(day)
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT category, product, quantity + 0E0, price + 0E0 FROM product_entries
+            WHERE purchase_date >= %s AND purchase_date < %s
+        """, (day_start, day_end))
+        rows = cursor.fetchall()
+        cursor.close()
+    return _chunk([day_number(day)] * len(rows), [product_index.code(row[:2]) for row in rows],
+                  [row[2] for row in rows], [row[3] for row in rows])
+
+
+# Per-product (quantities, values) of the chunks' rows within [first, last]
+def sum_by_product(chunks, count, first=None, last=None):
+    quantities = np.zeros(count)
+    values = np.zeros(count)
+    for chunk in chunks:
+        days, codes, quantity, value = chunk['day'], chunk['code'], chunk['quantity'], chunk['value']
+        if first is not None and len(days) and (days.min() < first or days.max() > last):
+            keep = (days >= first) & (days <= last)
+            codes, quantity, value = codes[keep], quantity[keep], value[keep]
+        quantities += np.bincount(codes, quantity, minlength=count)
+        values += np.bincount(codes, value, minlength=count)
+    return quantities, values
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator != 0, numerator / denominator, np.nan)
+
+
+# The vectorized part: every argument is an array indexed by product code
+def compute(opening, loaded, sold, closing):
+    opening_qty, opening_value = opening
+    loaded_qty, loaded_value = loaded
+    sold_qty, revenue = sold
+    closing_qty, _ = closing
+    available_qty = opening_qty + loaded_qty
+    unit_cost = _ratio(opening_value + loaded_value, available_qty)
+    cost_basis = sold_qty * np.nan_to_num(unit_cost)
+    margin = revenue - cost_basis
+    wastage_qty = np.maximum(available_qty - sold_qty - closing_qty, 0)
+    wastage_value = wastage_qty * np.nan_to_num(unit_cost)
+    return {
+        'opening_quantity': opening_qty,
+        'loaded_quantity': loaded_qty,
+        'loaded_value': loaded_value,
+        'sold_quantity': sold_qty,
+        'closing_quantity': closing_qty,
+        'unit_cost': unit_cost,
+        'revenue': revenue,
+        'cost_basis': cost_basis,
+        'margin': margin,
+        'margin_pct': _ratio(margin * 100, revenue),
+        'sell_through': _ratio(sold_qty, available_qty),
+        'wastage_quantity': wastage_qty,
+        'wastage_value': wastage_value,
+        'net': margin - wastage_value,
+    }
+
+
+DIGITS = {'sell_through': 4, 'unit_cost': 4, 'opening_quantity': 3, 'loaded_quantity': 3,
+          'sold_quantity': 3, 'closing_quantity': 3, 'wastage_quantity': 3}
+
+
+def _values(array, digits):
+    # NaN (nothing to divide by) becomes null
+    return [None if value != value else value for value in np.round(array, digits).tolist()]
+
+
+# Returns {'from', 'to', 'totals', 'products'}, products being one dict per
+# product that had stock or sales in the range, best net first.
+def product_margins(first_day, last_day, category=None):
+    today = date.today()
+    first, last = day_number(first_day), day_number(last_day)
+    loads = load_chunks('product_entry_history', first_day, last_day, today)
+    sales = load_chunks('sales', first_day, last_day, today)
+    opening = stock_on(first_day - timedelta(days=1))
+    closing = stock_on(min(last_day, today))
+    # Every code used above exists by now
+    count = len(product_index)
+    figures = compute(sum_by_product([opening], count), sum_by_product(loads, count, first, last),
+                      sum_by_product(sales, count, first, last), sum_by_product([closing], count))
+
+    keys = product_index.keys(count)
+    active = (figures['opening_quantity'] != 0) | (figures['loaded_quantity'] != 0) | (figures['sold_quantity'] != 0)
+    if category:
+        active &= np.array([key[0] == category for key in keys], dtype=bool)
+    positions = np.nonzero(active)[0]
+    positions = positions[np.argsort(-figures['net'][positions], kind='stable')]
+
+    columns = {name: _values(values[positions], DIGITS.get(name, 2)) for name, values in figures.items()}
+    products = []
+    for row, position in enumerate(positions.tolist()):
+        product = {'category': keys[position][0], 'product': keys[position][1]}
+        for name, values in columns.items():
+            product[name] = values[row]
+        products.append(product)
+
+    totals = {name: round(float(figures[name][positions].sum()), 2)
+              for name in ('loaded_value', 'revenue', 'cost_basis', 'margin', 'wastage_value', 'net')}
+    return {'from': first_day.isoformat(), 'to': last_day.isoformat(), 'totals': totals, 'products': products}
+
+
+if __name__ == '__main__':
+    # python analytics.py FROM_DAY TO_DAY  -- print the ten best and worst products
+    if len(sys.argv) != 3:
+        print("usage: python analytics.py FROM_DAY TO_DAY")
+        sys.exit(2)
+    for attempt in ('cold', 'warm'):
+        started = time.perf_counter()
+        result = product_margins(date.fromisoformat(sys.argv[1]), date.fromisoformat(sys.argv[2]))
+        print("%s: %d products in %.3fs" % (attempt, len(result['products']), time.perf_counter() - started))
+    print(result['totals'])
+    for product in result['products'][:10] + result['products'][-10:]:
+        print("%-20s %-30s net %12.2f  margin %12.2f  sell-through %s" % (
+            product['category'], product['product'], product['net'], product['margin'], product['sell_through']))
@@ -1,15 +1,36 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from config import get_db_connection
-from datetime import date
-import traceback 
+import config
+from config import get_db_connection, get_pool
+from catalog_cache import catalog_cache
+from pagination import (MAX_PAGE_SIZE, PaginationError, encode_cursor, history_filters, parse_day, parse_format,
+                        parse_history_args, parse_limit)
+from responses import (FastJSONProvider, fetch_in_batches, list_response, stream_csv, stream_json_array,
+                       to_columnar)
+from schema import day_range
+import rollups
+import changelog
+import archive
+import analytics
+import idempotency
+import dayclose
+import metrics
+from metrics import log
+import admission
+import auth
+import compression
+from inventory_index import inventory_index
+import repository
+import routing
+from routing import get_read_connection
+from events import event_hub, format_event
+from datetime import date, datetime, timedelta
 import json
 
-app = Flask(__name__)
-CORS(app)
+api = Blueprint('api', __name__)
 
 #Login
-@app.route('/login', methods=['POST'])
+@api.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
     username = data.get("username")
@@ -19,34 +40,35 @@ def login():
         return jsonify({"success": False, "message": "Username and password required"}), 400
  
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE username = %s AND password = %s", (username, password))
-        result = cursor.fetchone()
-        cursor.close()
+        user = auth.authenticate(username, password)
  
-        if result:
-            # You can return more user info if needed (like role, designation, etc.)
-            return jsonify({"success": True, "message": "Login successful"})
+        if user:
+            # The token goes in "Authorization: Bearer <token>" on later requests
+            return jsonify({"success": True, "message": "Login successful",
+                            "token": auth.issue_token(user), "user": user})
         else:
             return jsonify({"success": False, "message": "Invalid credentials"}), 401
  
-    except Exception as e:
-        print("Login error:", str(e))
+    except auth.HashingBusy:
+        return jsonify({"success": False, "message": "Too many logins in progress, try again"}), 503
+    except Exception:
+        log.exception("Login error")
         return jsonify({"success": False, "message": "Server error"}), 500
 
 #AddCategoryproduct page
 # Fetch all categories
-@app.route('/categories', methods=['GET'])
+@api.route('/categories', methods=['GET'])
 def get_categories():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM categories")
-    categories = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return jsonify({"categories": categories}), 200
-
-@app.route('/addCategory', methods=['POST'])
+    return catalog_cache.response('categories', load_categories)
+
+def load_categories():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM categories")
+        categories = [row[0] for row in cursor.fetchall()]
+    return {"categories": categories}
+
+@api.route('/addCategory', methods=['POST'])
 def add_category():
     data = request.json
     category = data.get('category', '').strip()
@@ -54,20 +76,19 @@ def add_category():
     if not category:
         return jsonify({"error": "Category is required"}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_db_connection() as conn:
+        if repository.category_id(conn, category) is not None:
+            return jsonify({"message": "Category already exists"}), 409
 
-    cursor.execute("SELECT * FROM categories WHERE name = %s", (category,))
-    if cursor.fetchone():
-        return jsonify({"message": "Category already exists"}), 409
-
-    cursor.execute("INSERT INTO categories (name) VALUES (%s)", (category,))
-    conn.commit()
-    conn.close()
+        category_id = repository.insert_category(conn, category)
+        changelog.record(conn.cursor(), 'categories', [category_id])
+        conn.commit()
+    catalog_cache.invalidate()
+    repository.invalidate()
 
     return jsonify({"message": "Category added successfully"}), 201
 
-@app.route('/addProduct', methods=['POST'])
+@api.route('/addProduct', methods=['POST'])
 def add_product():
     data = request.json
     category = data.get('category', '').strip()
@@ -76,24 +97,20 @@ def add_product():
     if not category or not product:
         return jsonify({"error": "Both category and product are required"}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT id FROM categories WHERE name  = %s", (category,))
-    category_row = cursor.fetchone()
+    with get_db_connection() as conn:
+        category_id, product_id = repository.catalog_ids(conn, category, product)
 
-    if not category_row:
-        return jsonify({"error": "Category does not exist"}), 404
+        if category_id is None:
+            return jsonify({"error": "Category does not exist"}), 404
 
-    category_id = category_row[0]
+        if product_id is not None:
+            return jsonify({"message": "Product already exists in category"}), 409
 
-    cursor.execute("SELECT * FROM products WHERE product_name    = %s AND category_id = %s", (product, category_id))
-    if cursor.fetchone():
-        return jsonify({"message": "Product already exists in category"}), 409
-
-    cursor.execute("INSERT INTO products (product_name   , category_id, name) VALUES (%s, %s, %s)", (product, category_id, category))
-    conn.commit()
-    conn.close()
+        product_id = repository.insert_product(conn, category, category_id, product)
+        changelog.record(conn.cursor(), 'products', [product_id])
+        conn.commit()
+    catalog_cache.invalidate()
+    repository.invalidate()
 
     return jsonify({
         "message": "Product added successfully",
@@ -103,21 +120,23 @@ def add_product():
         }]
     }), 201
 
-@app.route('/getAllProducts', methods=['GET'])
+@api.route('/getAllProducts', methods=['GET'])
 def get_all_products():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT c.name, p.product_name FROM products p JOIN categories c ON p.category_id = c.id")
-    rows = cursor.fetchall()
-    conn.close()
+    return catalog_cache.response('products', load_products_by_category)
+
+def load_products_by_category():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT c.name, p.product_name FROM products p JOIN categories c ON p.category_id = c.id")
+        rows = cursor.fetchall()
 
     products_by_category = {}
     for category, product in rows:
         products_by_category.setdefault(category, []).append(product)
 
-    return jsonify({"products": products_by_category}), 200
+    return {"products": products_by_category}
 
-@app.route('/setPrice', methods=['POST'])
+@api.route('/setPrice', methods=['POST'])
 def set_product_price():
     data = request.json
     category = data.get('category', '').strip()
@@ -132,42 +151,32 @@ def set_product_price():
     except ValueError:
         return jsonify({"error": "Invalid price format"}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT id FROM categories WHERE name = %s", (category,))
-    category_row = cursor.fetchone()
-    if not category_row:
-        return jsonify({"error": "Category not found"}), 404
-
-    category_id = category_row[0]
+    with get_db_connection() as conn:
+        # Usually answered from the lookup cache without a query
+        category_id, product_id = repository.catalog_ids(conn, category, product)
+        if category_id is None:
+            return jsonify({"error": "Category not found"}), 404
 
-    cursor.execute(
-        "SELECT id FROM products WHERE product_name = %s AND category_id = %s",
-        (product, category_id)
-    )
-    product_row = cursor.fetchone()
-    if not product_row:
-        return jsonify({"error": "Product not found in category"}), 404
+        if product_id is None:
+            return jsonify({"error": "Product not found in category"}), 404
 
-    product_id = product_row[0]
-
-    cursor.execute(
-        "UPDATE products SET price_per_kg = %s WHERE id = %s",
-        (price, product_id)
-    )
-    conn.commit()
-    conn.close()
+        repository.set_price(conn, product_id, price)
+        changelog.record(conn.cursor(), 'products', [product_id])
+        conn.commit()
+    catalog_cache.invalidate()
 
     return jsonify({"message": f"Price set to ₹{price:.2f} for {product} added successfully"}), 200
 
 # AddPurchased Page
-@app.route('/fetchAllProducts', methods=['GET'])
+@api.route('/fetchAllProducts', methods=['GET'])
 def fetch_all_products():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT name AS category, product_name AS product, price_per_kg FROM products")
-    rows = cursor.fetchall()
+    return catalog_cache.response('prices', load_product_prices)
+
+def load_product_prices():
+    with get_db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT name AS category, product_name AS product, price_per_kg FROM products")
+        rows = cursor.fetchall()
 
     data = {}
     for row in rows:
@@ -178,119 +187,253 @@ def fetch_all_products():
             "name": row['product'],
             "price_per_kg": row['price_per_kg']
         })
-    conn.commit()
-    conn.close()
-    return jsonify(data), 200
+    return data
 
-@app.route('/addProductEntry', methods=['POST'])
-def add_product_entry():
-    data = request.get_json()
+MAX_BATCH_ENTRIES = 1000
+
+def parse_entry(data):
     category = data.get('category')
     product = data.get('product')
     quantity = data.get('quantity')
     price = data.get('price')
 
     if not all([category, product, quantity, price]):
-        return jsonify({'message': 'Missing fields'}), 400
+        raise ValueError('Missing fields')
 
     try:
         quantity = float(quantity)
         price = float(price)
-        price_per_unit = price / quantity if quantity != 0 else 0
-    except ValueError:
-        return jsonify({'message': 'Invalid quantity or price'}), 400
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    purchase_date = date.today()
-    # Check if entry exists
-    cursor.execute("""
-        SELECT id, quantity, price FROM product_entries
-        WHERE category = %s AND product = %s AND DATE(purchase_date) = %s
-    """, (category, product, purchase_date))
-    existing = cursor.fetchone()
- 
-    if existing:
-        existing_id = existing[0]
-        existing_quantity = existing[1]
-        existing_price = existing[2]
-
-        new_quantity = existing_quantity + quantity
-        new_price = existing_price + price
-        new_price_per_unit = new_price / new_quantity if new_quantity != 0 else 0
-
-        cursor.execute("""
-            UPDATE product_entries 
-            SET quantity = %s, price = %s, price_per_unit = %s 
-            WHERE id = %s
-        """, (new_quantity, new_price, new_price_per_unit, existing_id))
-    else:
-        cursor.execute("""
-            INSERT INTO product_entries (category, product, quantity, price, price_per_unit) 
-            VALUES (%s, %s, %s, %s, %s)
-        """, (category, product, quantity, price, price_per_unit))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid quantity or price')
+    return category, product, quantity, price
+
+# Adds stock for today. product_entries has a unique key on
+# (category, product, purchase_day), so one multi-row upsert merges every
+# entry into today's rows, however many there are.
+def load_entries(cursor, entries):
+    # Whole seconds, as the DATETIME columns store them: MySQL would round
+    # 23:59:59.5 up into tomorrow while the rollups used today's date
+    now = datetime.now().replace(microsecond=0)
+    rows = [(category, product, quantity, price, price / quantity if quantity != 0 else 0)
+            for category, product, quantity, price in entries]
+
+    # price_per_unit comes first and only reads the old row: MySQL applies
+    # the assignments left to right, SQLite all against the old row.
+    cursor.executemany("""
+        INSERT INTO product_entries (category, product, quantity, price, price_per_unit, purchase_date)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            price_per_unit = IF(quantity + VALUES(quantity) = 0, 0,
+                                (price + VALUES(price)) / (quantity + VALUES(quantity))),
+            quantity = quantity + VALUES(quantity),
+            price = price + VALUES(price)
+    """, [row + (now,) for row in rows])
 
     # Always insert into product_entry_history
-    cursor.execute("""
-        INSERT INTO product_entry_history (category, product, quantity, price, price_per_unit) 
-        VALUES (%s, %s, %s, %s, %s)
-    """, (category, product, quantity, price, price_per_unit))
+    cursor.executemany("""
+        INSERT INTO product_entry_history (category, product, quantity, price, price_per_unit, created_at) 
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, [row + (now,) for row in rows])
+
+    rollups.record_loads(cursor, now.date(), [row[:4] for row in rows])
+    changelog.record_entries(cursor, 'loads', now.date(), {row[:2] for row in rows})
+
+@api.route('/addProductEntry', methods=['POST'])
+def add_product_entry():
+    data = request.get_json()
+    try:
+        entry = parse_entry(data)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        load_entries(cursor, [entry])
+        conn.commit()
+    inventory_index.apply_load(*entry)
     return jsonify({'message': 'Product entry added successfully'}), 201
 
+# Truck unload: every product on the vehicle in one request and one transaction
+@api.route('/addProductEntries', methods=['POST'])
+def add_product_entries():
+    data = request.get_json()
+    items = data.get('entries') if isinstance(data, dict) else None
+    if not items or not isinstance(items, list):
+        return jsonify({'message': 'entries must be a non-empty list'}), 400
+    if len(items) > MAX_BATCH_ENTRIES:
+        return jsonify({'message': f'At most {MAX_BATCH_ENTRIES} entries per request'}), 400
+
+    entries = []
+    for index, item in enumerate(items):
+        try:
+            entries.append(parse_entry(item if isinstance(item, dict) else {}))
+        except ValueError as e:
+            return jsonify({'message': str(e), 'index': index}), 400
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        load_entries(cursor, entries)
+        conn.commit()
+    for entry in entries:
+        inventory_index.apply_load(*entry)
+    return jsonify({'message': 'Product entries added successfully', 'count': len(entries)}), 201
+
+# Runs a query on an unbuffered cursor, so MySQL streams the result set,
+# and yields it in fetchmany() batches. The connection is held only while
+# the generator is being consumed and returned when it finishes or is closed.
+# Only used for reads, so it runs on a replica when one is configured.
+def query_batches(query, params, dictionary=True):
+    with get_read_connection() as conn:
+        cursor = conn.cursor(dictionary=dictionary)
+        cursor.execute(query, params)
+        yield from fetch_in_batches(cursor)
+        cursor.close()
+
 #List screen(History page)
-@app.route('/getProductHistory', methods=['GET'])
+# Without ?limit the whole history is streamed; with it a single page is
+# returned and X-Next-Cursor holds the value to pass as ?before= next time.
+# `archived` returns the matching rows from archived months, which are all
+# older than the live table, so they simply follow the live rows.
+def history_response(query, params, limit, ts_key, transform=None, columnar=False, archived=None):
+    if limit is None:
+        def batches():
+            yield from query_batches(query, params)
+            if archived is not None:
+                yield from archived()
+        return stream_json_array(batches(), transform, columnar)
+
+    with get_read_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(query + " LIMIT %s", params + [limit + 1])
+        rows = cursor.fetchall()
+        cursor.close()
+
+    if archived is not None and len(rows) <= limit:
+        for batch in archived():
+            rows.extend(batch)
+            if len(rows) > limit:
+                break
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    response = list_response([transform(row) for row in rows] if transform else rows, columnar)
+    if has_more:
+        response.headers['X-Next-Cursor'] = encode_cursor(rows[-1][ts_key], rows[-1]['id'])
+    return response, 200
+
+@api.route('/getProductHistory', methods=['GET'])
 def get_product_history():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM product_entry_history ORDER BY created_at DESC")
-    history = cursor.fetchall()
-    conn.commit()
-    conn.close()
-    return jsonify(history), 200
+    try:
+        limit = parse_limit(request.args)
+        columnar = parse_format(request.args)
+        filters = parse_history_args(request.args)
+        where, params = history_filters(filters, 'created_at')
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    query = "SELECT * FROM product_entry_history" + where + " ORDER BY created_at DESC, id DESC"
+    return history_response(query, params, limit, 'created_at', columnar=columnar,
+                            archived=lambda: archive.archived_batches('product_entry_history', filters))
 
 #Inventory Page
-@app.route('/getProductInventory',methods=['GET'])
-def get_product_inventory():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    # purchase_date = request.args.get('purchase_date')
-    # if not purchase_date:
-    #     return jsonify({'error':'purchase_date parameter is required'}), 400
-    # cursor.execute("SELECT * FROM product_entries WHERE DATE(purchase_date) = %s",(purchase_date,))
-    cursor.execute("""SELECT * FROM product_entries WHERE DATE(purchase_date) = CURDATE()""")
-    inventory = cursor.fetchall()
-    conn.commit()
-    conn.close()
-    return jsonify(inventory), 200
+# What the endpoint has always returned; the index also keeps purchase_day
+# and updated_at for itself
+PRODUCT_INVENTORY_COLUMNS = ('id', 'category', 'product', 'quantity', 'price', 'price_per_unit', 'purchase_date')
 
+@api.route('/getProductInventory',methods=['GET'])
+def get_product_inventory():
+    # Served from the in-memory index of today's product_entries rows
+    try:
+        columnar = parse_format(request.args)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    return list_response([{column: row[column] for column in PRODUCT_INVENTORY_COLUMNS}
+                          for row in inventory_index.rows()], columnar), 200
     
 
 #Sell page
-@app.route('/getInventory', methods=['GET'])
+@api.route('/getInventory', methods=['GET'])
 def get_inventory():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        columnar = parse_format(request.args)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    return list_response(inventory_snapshot(), columnar), 200
+
+def inventory_snapshot():
+    return [{
+        'category': row['category'],
+        'product': row['product'],
+        'quantity': row['quantity'],
+        'price': row['price'],
+        'price_per_unit': row['price_per_unit']
+    } for row in inventory_index.rows()]
+
+class SaleError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+# Sells from today's inventory row inside the caller's transaction. The row
+# is locked with FOR UPDATE, so concurrent counters selling the same product
+# queue up on it instead of both reading the old quantity and overselling.
+# MySQL has no UPDATE ... RETURNING, hence the locked read rather than a bare
+# conditional UPDATE.
+def sell_line(cursor, category, product, quantity):
+    if quantity <= 0:
+        raise SaleError('Invalid quantity', 400)
+
+    day_start, day_end = day_range()
+    cursor.execute("""
+        SELECT id, quantity, price, price_per_unit
+        FROM product_entries
+        WHERE category = %s AND product = %s AND purchase_date >= %s AND purchase_date < %s
+        ORDER BY id DESC LIMIT 1
+        FOR UPDATE
+    """, (category, product, day_start, day_end))
+    item = cursor.fetchone()
+
+    if not item:
+        raise SaleError('Product not found', 404)
+
+    entry_id = item[0]
+    current_qty, current_price, price_per_unit = (float(value) for value in item[1:])
+
+    if quantity > current_qty:
+        raise SaleError('Insufficient stock', 400)
 
+    total_price = quantity * price_per_unit
+    new_qty = current_qty - quantity
+    new_total_price = current_price - total_price
+    new_price_per_unit = new_total_price / new_qty if new_qty > 0 else 0
+
+    cursor.execute("""
+        UPDATE product_entries
+        SET quantity = %s, price = %s, price_per_unit = %s
+        WHERE id = %s
+    """, (new_qty, new_total_price, new_price_per_unit, entry_id))
+
+    now = datetime.now().replace(microsecond=0)
     cursor.execute("""
-        SELECT category, product, quantity, price, price_per_unit 
-        FROM product_entries WHERE DATE(purchase_date) = CURDATE()
-    """)
-    rows = cursor.fetchall()
-
-    inventory = [{
-        'category': row[0],
-        'product': row[1],
-        'quantity': row[2],
-        'price': row[3],
-        'price_per_unit': row[4]
-    } for row in rows]
-
-    conn.close()
-    return jsonify(inventory), 200
-@app.route('/sellProduct', methods=['POST'])
+        INSERT INTO sales (category, product, quantity, total_price, sale_date)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (category, product, quantity, total_price, now))
+    sale_id = cursor.lastrowid
+    rollups.record_sale(cursor, now.date(), category, product, quantity, total_price)
+
+    threshold_qty = 0.2 * (current_qty + quantity)  # original qty before sale
+    stock_alert = new_qty <= threshold_qty
+    changelog.record(cursor, 'sales', [sale_id])
+    changelog.record(cursor, 'low_stock' if stock_alert else 'inventory', [entry_id])
+    return {
+        'total_price': total_price,
+        'stock_alert': stock_alert,
+        'remaining_quantity': new_qty,
+        'remaining_price': new_total_price
+    }
+
+@api.route('/sellProduct', methods=['POST'])
 def sell_product():
     try:
         data = request.get_json()
@@ -309,114 +452,248 @@ def sell_product():
         except (ValueError, TypeError):
             return jsonify({'message': 'Invalid quantity'}), 400
  
-        conn = get_db_connection()
-        cursor = conn.cursor(buffered=True)
- 
-        # Fetch from inventory
-        cursor.execute("""
-            SELECT quantity, price, price_per_unit
-            FROM product_entries
-            WHERE category = %s AND product = %s
-        """, (category, product))
-        item = cursor.fetchone()
- 
-        if not item:
-            return jsonify({'message': 'Product not found'}), 404
- 
-        current_qty, current_price, price_per_unit = item
- 
-        if quantity > current_qty:
-            return jsonify({'message': 'Insufficient stock'}), 400
- 
-        total_price = quantity * price_per_unit
+        with get_db_connection() as conn:
+            cursor = conn.cursor(buffered=True)
+            try:
+                sale = sell_line(cursor, category, product, quantity)
+            except SaleError as e:
+                conn.rollback()
+                return jsonify({'message': e.message}), e.status
+            conn.commit()
+        inventory_index.apply_sale(category, product, sale['remaining_quantity'], sale['remaining_price'])
  
-        # Insert into sales table
-        cursor.execute("""
-            INSERT INTO sales (category, product, quantity, total_price)
-            VALUES (%s, %s, %s, %s)
-        """, (category, product, quantity, total_price))
- 
-        # Update inventory
-        new_qty = current_qty - quantity
-        new_total_price = current_price - total_price
-        new_price_per_unit = new_total_price / new_qty if new_qty > 0 else 0
- 
-        cursor.execute("""
-            UPDATE product_entries
-            SET quantity = %s, price = %s, price_per_unit = %s
-            WHERE category = %s AND product = %s
-        """, (new_qty, new_total_price, new_price_per_unit, category, product))
- 
-        stock_alert = False
-        threshold_qty = 0.2 * (current_qty + quantity)  # original qty before sale
-        if new_qty <= threshold_qty:
-            stock_alert = True
- 
-        conn.commit()
-        conn.close()
+        return jsonify({'message': 'Product sold successfully', **sale}), 200
  
+    except Exception:
+        log.exception("Error in /sellProduct")
+        return jsonify({'message': 'Internal server error'}), 500
+  
+MAX_CART_LINES = 200
+
+# A whole bill in one request: every line is sold in a single transaction,
+# so either all of them go through or none do, and the response carries
+# the updated inventory the sell screen would otherwise refetch.
+@api.route('/checkout', methods=['POST'])
+def checkout():
+    try:
+        data = request.get_json()
+        items = data.get('lines') if isinstance(data, dict) else None
+        if not items or not isinstance(items, list):
+            return jsonify({'message': 'lines must be a non-empty list'}), 400
+        if len(items) > MAX_CART_LINES:
+            return jsonify({'message': f'At most {MAX_CART_LINES} lines per checkout'}), 400
+
+        lines = []
+        for index, item in enumerate(items):
+            item = item if isinstance(item, dict) else {}
+            category = item.get('category')
+            product = item.get('product')
+            quantity = item.get('quantity')
+            if not all([category, product, quantity]):
+                return jsonify({'message': 'Missing fields', 'index': index}), 400
+            # They are sorted on below, which needs them all the same type
+            if not isinstance(category, str) or not isinstance(product, str):
+                return jsonify({'message': 'category and product must be strings', 'index': index}), 400
+            try:
+                quantity = float(quantity)
+            except (ValueError, TypeError):
+                return jsonify({'message': 'Invalid quantity', 'index': index}), 400
+            lines.append((index, category, product, quantity))
+
+        results = [None] * len(lines)
+        with get_db_connection() as conn:
+            cursor = conn.cursor(buffered=True)
+            # Lock rows in a fixed order so two carts sharing products can't deadlock
+            for index, category, product, quantity in sorted(lines, key=lambda line: line[1:3]):
+                try:
+                    sale = sell_line(cursor, category, product, quantity)
+                except SaleError as e:
+                    conn.rollback()
+                    return jsonify({'message': e.message, 'index': index,
+                                    'category': category, 'product': product}), e.status
+                results[index] = {'category': category, 'product': product, 'quantity': quantity, **sale}
+            conn.commit()
+
+        # Apply in lock order, so a product sold on two lines ends up with
+        # the remaining quantity of the line that was sold last.
+        for index, category, product, quantity in sorted(lines, key=lambda line: line[1:3]):
+            line = results[index]
+            inventory_index.apply_sale(category, product, line['remaining_quantity'], line['remaining_price'])
+        inventory = inventory_snapshot()
+
         return jsonify({
-            'message': 'Product sold successfully',
-            'total_price': total_price,
-            'stock_alert': stock_alert,
-            'remaining_quantity': new_qty
+            'message': 'Checkout completed successfully',
+            'lines': results,
+            'total_price': sum(line['total_price'] for line in results),
+            'stock_alerts': [line for line in results if line['stock_alert']],
+            'inventory': inventory
         }), 200
- 
-    except Exception as e:
-        print("Error in /sellProduct:", str(e))
-        traceback.print_exc()
+
+    except Exception:
+        log.exception("Error in /checkout")
         return jsonify({'message': 'Internal server error'}), 500
-  
-#Sale History page
-@app.route('/getSaleHistory', methods=['GET'])
-def get_sale_history():
+
+#Offline queue
+# Counters that lose connectivity queue their sales and stock loads, each
+# with a client-generated key, and flush them here in order:
+#   {"operations": [{"key": "c1-000123", "op": "sell", "category": ..., "product": ..., "quantity": ...},
+#                   {"key": "c1-000124", "op": "load", "category": ..., "product": ..., "quantity": ...,
+#                    "price": ...}]}
+# Every operation is applied at most once, however often the batch is sent.
+# Results come back in the same order, each with a status:
+#   applied    done now
+#   duplicate  done before; the result is the one stored that time
+#   failed     rejected, e.g. insufficient stock; stored like any result
+#   retry      not applied because a database error stopped the batch
+# Sales are dated when they are replayed, as stock is kept per day.
+def replay_sell(cursor, operation):
+    category = operation.get('category')
+    product = operation.get('product')
+    quantity = operation.get('quantity')
+    if not all([category, product, quantity]):
+        raise SaleError('Missing fields', 400)
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT product, category, quantity, total_price, sale_date FROM sales ORDER BY sale_date DESC")
-        rows = cursor.fetchall()
+        quantity = float(quantity)
+    except (ValueError, TypeError):
+        raise SaleError('Invalid quantity', 400)
+    sale = sell_line(cursor, category, product, quantity)
+    return 200, {'message': 'Product sold successfully', **sale}, \
+        lambda: inventory_index.apply_sale(category, product, sale['remaining_quantity'], sale['remaining_price'])
 
-        if not rows:
-            print("No sales found.")
-            return jsonify([]), 200
+def replay_load(cursor, operation):
+    try:
+        entry = parse_entry(operation)
+    except ValueError as e:
+        raise SaleError(str(e), 400)
+    load_entries(cursor, [entry])
+    return 201, {'message': 'Product entry added successfully'}, lambda: inventory_index.apply_load(*entry)
+
+REPLAY_OPERATIONS = {
+    'sell': replay_sell,
+    'load': replay_load,
+}
+
+# Applies operations[start:end] in one transaction. Each operation claims
+# its key first; a rejected one is rolled back to its savepoint and only
+# its result is kept. Duplicates are answered after the commit, when the
+# transaction that first claimed the key is sure to be visible.
+def replay_chunk(operations, start, end, results):
+    after_commit = []
+    duplicates = []
+    with get_db_connection() as conn:
+        cursor = conn.cursor(buffered=True)
+        for index in range(start, end):
+            operation = operations[index]
+            key = operation['key']
+            cursor.execute("SAVEPOINT replay_op")
+            if not idempotency.claim(cursor, key):
+                duplicates.append(index)
+                continue
+            try:
+                status_code, result, apply = REPLAY_OPERATIONS[operation['op']](cursor, operation)
+                after_commit.append(apply)
+                status = 'applied'
+            except SaleError as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT replay_op")
+                idempotency.claim(cursor, key)
+                status_code, result, status = e.status, {'message': e.message}, 'failed'
+            idempotency.finish(cursor, key, status_code, result)
+            results[index] = {'key': key, 'status': status, 'status_code': status_code, **result}
+        conn.commit()
+        stored = idempotency.stored_results(cursor, {operations[index]['key'] for index in duplicates})
+        cursor.close()
 
-        sales = []
-        for row in rows:
-            sales.append({
-                'name': row['product'],
-                'category': row['category'],
-                'quantity': float(row['quantity']),
-                'price': float(row['total_price']),
-                'created_at': row['sale_date'].strftime('%Y-%m-%d %H:%M:%S')
-            })
+    for apply in after_commit:
+        apply()
+    for index in duplicates:
+        key = operations[index]['key']
+        status_code, result = stored.get(key, (409, {'message': 'Already applied'}))
+        results[index] = {'key': key, 'status': 'duplicate', 'status_code': status_code, **result}
+
+@api.route('/replay', methods=['POST'])
+def replay():
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not operations or not isinstance(operations, list):
+        return jsonify({'message': 'operations must be a non-empty list'}), 400
+    max_ops = config.REPLAY_CONFIG['max_ops']
+    if len(operations) > max_ops:
+        return jsonify({'message': f'At most {max_ops} operations per replay'}), 400
+    for index, operation in enumerate(operations):
+        key = operation.get('key') if isinstance(operation, dict) else None
+        if not isinstance(key, str) or not key or len(key) > idempotency.MAX_KEY_LENGTH:
+            return jsonify({'message': f'key must be a string of 1 to {idempotency.MAX_KEY_LENGTH} characters',
+                            'index': index}), 400
+        if operation.get('op') not in REPLAY_OPERATIONS:
+            return jsonify({'message': 'op must be one of ' + ', '.join(REPLAY_OPERATIONS), 'index': index}), 400
+
+    results = [None] * len(operations)
+    size = config.REPLAY_CONFIG['ops_per_transaction']
+    for start in range(0, len(operations), size):
+        try:
+            replay_chunk(operations, start, min(start + size, len(operations)), results)
+        except Exception:
+            # Earlier chunks are committed; this one was rolled back
+            log.exception("Error in /replay")
+            for index in range(start, len(operations)):
+                results[index] = {'key': operations[index]['key'], 'status': 'retry', 'status_code': 503,
+                                  'message': 'Not applied, send it again'}
+            break
+
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return jsonify({'results': results, 'counts': counts}), 200
 
-        # print("Fetched sales:", sales)
-        return jsonify(sales), 200
+#Sale History page
+def sale_history_row(row):
+    return {
+        'name': row['product'],
+        'category': row['category'],
+        'quantity': float(row['quantity']),
+        'price': float(row['total_price']),
+        'created_at': row['sale_date'].strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+@api.route('/getSaleHistory', methods=['GET'])
+def get_sale_history():
+    try:
+        limit = parse_limit(request.args)
+        columnar = parse_format(request.args)
+        filters = parse_history_args(request.args)
+        where, params = history_filters(filters, 'sale_date')
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
 
-    except Exception as e:
-        print("Error in /getSaleHistory:", str(e))
-        traceback.print_exc()  # This will print full traceback in your terminal
+    try:
+        query = ("SELECT id, product, category, quantity, total_price, sale_date FROM sales"
+                 + where + " ORDER BY sale_date DESC, id DESC")
+        return history_response(query, params, limit, 'sale_date', sale_history_row, columnar,
+                                lambda: archive.archived_batches('sales', filters))
+
+    except Exception:
+        log.exception("Error in /getSaleHistory")
         return jsonify({'message': 'Failed to retrieve sale history.'}), 500
     
 #Reportspage
-@app.route('/api/sales-report', methods=['GET'])
+@api.route('/api/sales-report', methods=['GET'])
 def sales_report():
     from_date = request.args.get('from_date')
     to_date = request.args.get('to_date')
 
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-
-    # Fix for inclusive date range
-    query = """
-        SELECT product, category, SUM(quantity) AS quantity, SUM(total_price) AS total_price
-        FROM sales
-        WHERE sale_date >= %s AND sale_date < DATE_ADD(%s, INTERVAL 1 DAY)
-        GROUP BY category, product
-    """
-    cursor.execute(query, (from_date, to_date))
-    results = cursor.fetchall()
-    print(f"From date: {from_date}, To date: {to_date}")
+    with get_read_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+
+        # Answered from the per-day rollups; both ends of the range are inclusive
+        query = """
+            SELECT product, category, SUM(quantity) AS quantity, SUM(total_price) AS total_price
+            FROM daily_sales_rollup
+            WHERE day >= %s AND day <= %s
+            GROUP BY category, product
+        """
+        cursor.execute(query, (from_date, to_date))
+        results = cursor.fetchall()
+        cursor.close()
     sanitized_sales = []
     for row in results:
         if row['quantity'] is not None and row['total_price'] is not None:
@@ -427,43 +704,106 @@ def sales_report():
                 'total_price': float(row['total_price']),
             })
 
-    cursor.close()
-    conn.close()
     return jsonify(sanitized_sales)
 
-#Profit&Loss page
-@app.route("/api/profitloss/today", methods=["GET"])
-def get_today_data():
-    today = date.today().isoformat()
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+EXPORTS = {
+    # Every sale line in the range
+    'line': (
+        ['id', 'sale_date', 'category', 'product', 'quantity', 'total_price'],
+        """SELECT id, sale_date, category, product, quantity, total_price FROM sales
+           WHERE sale_date >= %s AND sale_date < %s ORDER BY sale_date, id"""),
+    # Per product totals, the same figures as /api/sales-report
+    'product': (
+        ['category', 'product', 'quantity', 'total_price', 'sale_count'],
+        """SELECT category, product, SUM(quantity), SUM(total_price), SUM(sale_count) FROM daily_sales_rollup
+           WHERE day >= %s AND day < %s GROUP BY category, product ORDER BY category, product"""),
+    # Per day and product totals
+    'day': (
+        ['day', 'category', 'product', 'quantity', 'total_price', 'sale_count'],
+        """SELECT day, category, product, quantity, total_price, sale_count FROM daily_sales_rollup
+           WHERE day >= %s AND day < %s ORDER BY day, category, product"""),
+}
+
+@api.route('/api/sales-export', methods=['GET'])
+def sales_export():
+    try:
+        from_day = parse_day(request.args.get('from_date', ''), 'from_date')
+        to_day = parse_day(request.args.get('to_date', ''), 'to_date')
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    group = request.args.get('group', 'line')
+    if group not in EXPORTS:
+        return jsonify({'error': 'group must be one of ' + ', '.join(EXPORTS)}), 400
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'csv.gz'):
+        return jsonify({'error': 'format must be csv or csv.gz'}), 400
+
+    header, query = EXPORTS[group]
+    params = [from_day, to_day + timedelta(days=1)]
+    filename = 'sales-%s-%s-to-%s.csv' % (group, from_day.date().isoformat(), to_day.date().isoformat())
+
+    def batches():
+        if group == 'line':
+            # Archived months come first, being older than any live row
+            yield from archive.archived_batches('sales', {'from': params[0], 'to': params[1]},
+                                                descending=False, columns=header)
+            yield from query_batches(query, params, dictionary=False)
+        else:
+            yield from query_batches(query, [day.date() for day in params], dictionary=False)
+
+    return stream_csv(header, batches(), filename, compress=export_format == 'csv.gz')
 
+# Per-product margins, sell-through and wastage; both ends of the range are
+# inclusive and default to the last year
+@api.route('/api/analytics/products', methods=['GET'])
+def product_analytics():
     try:
-        # Total sale today
-        cursor.execute("SELECT COALESCE(SUM(total_price), 0) AS total_sale FROM sales WHERE DATE(sale_date) = %s", (today,))
-        sale_result = cursor.fetchone()
-        print("Sales result:", sale_result)
+        to_day = parse_day(request.args['to_date'], 'to_date').date() if request.args.get('to_date') else date.today()
+        from_day = (parse_day(request.args['from_date'], 'from_date').date() if request.args.get('from_date')
+                    else to_day - timedelta(days=364))
+        columnar = parse_format(request.args)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    if from_day > to_day:
+        return jsonify({'error': 'from_date must not be after to_date'}), 400
+
+    result = analytics.product_margins(from_day, to_day, request.args.get('category') or None)
+    if columnar:
+        result['products'] = to_columnar(result['products'])
+    return jsonify(result)
 
-        # Total loaded stock today
-        cursor.execute("SELECT COALESCE(SUM(price), 0) AS loaded_stock FROM product_entry_history WHERE DATE(created_at) = %s", (today,))
-        loaded_result = cursor.fetchone()
-        print("Loaded stock result:", loaded_result)
+#Profit&Loss page
+@api.route("/api/profitloss/today", methods=["GET"])
+def get_today_data():
+    day_start, day_end = day_range()
 
-        # Remaining stock in inventory (total value)
-        cursor.execute("SELECT COALESCE(SUM(price), 0) AS remaining_stock FROM product_entries WHERE DATE(purchase_date) = %s",(today,))
-        remaining_result = cursor.fetchone()
-        print("Remaining stock result:", remaining_result)
+    try:
+        with get_read_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+
+            # Sales and loads come from today's rollup rows; remaining stock
+            # is today's inventory, which is one row per product anyway.
+            cursor.execute("""
+                SELECT
+                    (SELECT COALESCE(SUM(total_price), 0) FROM daily_sales_rollup WHERE day = %s) AS total_sale,
+                    (SELECT COALESCE(SUM(loaded_value), 0) FROM daily_stock_rollup WHERE day = %s) AS loaded_stock,
+                    (SELECT COALESCE(SUM(price), 0) FROM product_entries
+                     WHERE purchase_date >= %s AND purchase_date < %s) AS remaining_stock
+            """, (day_start.date(), day_start.date(), day_start, day_end))
+            result = cursor.fetchone()
+            cursor.close()
 
         response = {
-            'total_sale': float(sale_result['total_sale']),
-            'loaded_stock': float(loaded_result['loaded_stock']),
-            'remaining_stock': float(remaining_result['remaining_stock'])
+            'total_sale': float(result['total_sale']),
+            'loaded_stock': float(result['loaded_stock']),
+            'remaining_stock': float(result['remaining_stock'])
         }
 
         return jsonify(response)
 
     except Exception as e:
-        print("Error in /api/profitloss/today:", str(e))
+        log.exception("Error in /api/profitloss/today")
         return jsonify({
             'total_sale': 0.0,
             'loaded_stock': 0.0,
@@ -471,59 +811,52 @@ def get_today_data():
             'error': str(e)
         }), 500
 
-    finally:
-        cursor.close()
-        conn.close()
-
-@app.route('/api/profitloss/save', methods=['POST'])
+# Only the day's expense comes from the client; the totals and the result
+# are computed here, and recomputed by the day close job after midnight.
+@api.route('/api/profitloss/save', methods=['POST'])
 def save_profit_loss():
-    data = request.json
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-
-    cursor.execute("""
-        INSERT INTO profit_loss 
-        (date, total_sale, loaded_stock, remaining_stock, daily_expense, profit_or_loss)
-        VALUES (%s, %s, %s, %s, %s, %s)
-    """, (
-        data['date'],
-        data['total_sale'],
-        data['loaded_stock'],
-        data['remaining_stock'],
-        data['daily_expense'],
-        data['profit_or_loss']
-    ))
-
-    conn.commit()
-    cursor.close()
-    conn.close()
+    data = request.get_json(silent=True) or {}
+    try:
+        day = parse_day(data.get('date') or date.today().isoformat(), 'date').date()
+        daily_expense = float(data.get('daily_expense') or 0)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    except (ValueError, TypeError):
+        return jsonify({'error': 'daily_expense must be a number'}), 400
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        row = dayclose.save_profit_loss(cursor, day, daily_expense)
+        conn.commit()
+        cursor.close()
 
-    return jsonify({'message': 'Profit or loss saved successfully'}), 201
+    return jsonify({'message': 'Profit or loss saved successfully', 'profit_loss': row}), 201
 
 #-----------------------------------------------------------
 
-@app.route('/add-account', methods=['POST'])
+@api.route('/add-account', methods=['POST'])
 def add_account():
     data = request.json
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    try:
-        cursor.execute("""
-            INSERT INTO seller_details (sellerName, phoneNumber, vehicleId, driverName)
-            VALUES (%s, %s, %s, %s)
-        """, (data['sellerName'], data['phoneNumber'], data['vehicleId'], data['driverName']))
-        conn.commit()
-        return jsonify({"message": "Account saved successfully"}), 201
-    except Exception as e:
-        conn.rollback()
-        return jsonify({"error": str(e)}), 500
+    with get_db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("""
+                INSERT INTO seller_details (sellerName, phoneNumber, vehicleId, driverName)
+                VALUES (%s, %s, %s, %s)
+            """, (data['sellerName'], data['phoneNumber'], data['vehicleId'], data['driverName']))
+            changelog.record(cursor, 'accounts', [cursor.lastrowid])
+            conn.commit()
+            return jsonify({"message": "Account saved successfully"}), 201
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"error": str(e)}), 500
  
-@app.route('/get-accounts', methods=['GET'])
+@api.route('/get-accounts', methods=['GET'])
 def get_accounts():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM seller_accounts")
-    rows = cursor.fetchall()
+    with get_db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM seller_accounts")
+        rows = cursor.fetchall()
     accounts = []
     for row in rows:
         accounts.append({
@@ -536,42 +869,48 @@ def get_accounts():
     return jsonify(accounts)
 # ---------------------------------------------------
 
-@app.route('/add-entry', methods=['POST'])
+@api.route('/add-entry', methods=['POST'])
 def add_entry():
     data = request.json
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
     vehicle = data.get('vehicle', {})
     driver = data.get('driver', {})
  
-    try:
-        cursor.execute("""
-            INSERT INTO vehicle_driver (
-                vehicleID, vehicleName, vehicleCapacity,
-                driverName, driverPhone, driverLicense, dailyWages
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (
-            vehicle.get('vehicleID'),
-            vehicle.get('vehicleName'),
-            int(vehicle.get('vehicleCapacity')),
-            driver.get('driverName'),
-            driver.get('driverPhone'),
-            driver.get('driverLicense'),
-            float(driver.get('dailyWages'))
-        ))
-        conn.commit()
-        return jsonify({'message': 'Entry added successfully'}), 201
-    except Exception as e:
-        conn.rollback()
-        return jsonify({'error': str(e)}), 500
+    with get_db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("""
+                INSERT INTO vehicle_driver (
+                    vehicleID, vehicleName, vehicleCapacity,
+                    driverName, driverPhone, driverLicense, dailyWages
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (
+                vehicle.get('vehicleID'),
+                vehicle.get('vehicleName'),
+                int(vehicle.get('vehicleCapacity')),
+                driver.get('driverName'),
+                driver.get('driverPhone'),
+                driver.get('driverLicense'),
+                float(driver.get('dailyWages'))
+            ))
+            changelog.record(cursor, 'vehicles', [cursor.lastrowid])
+            conn.commit()
+            return jsonify({'message': 'Entry added successfully'}), 201
+        except Exception as e:
+            conn.rollback()
+            return jsonify({'error': str(e)}), 500
  
-@app.route('/get-entries', methods=['GET'])
+@api.route('/get-entries', methods=['GET'])
 def get_entries():
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM vehicle_driver")
-        rows = cursor.fetchall()
+        columnar = parse_format(request.args)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM vehicle_driver")
+            rows = cursor.fetchall()
 
         entries = []
         for row in rows:
@@ -591,59 +930,146 @@ def get_entries():
             }
             entries.append(entry)
 
-        return jsonify(entries), 200
+        return list_response(entries, columnar), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/delete-entry/<int:id>', methods=['DELETE'])
+@api.route('/delete-entry/<int:id>', methods=['DELETE'])
 def remove_Entry(id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute("delete from giri_bazar.vehicle_driver where id =  %s",(id,))
-        conn.commit()
-        return jsonify({"message": f"Entry with id {id} deleted successfully"}), 200
-    except Exception as e:
-        return jsonify({"error":str(e)}),500
-    finally:
-        cursor.close()
-        conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
 
-@app.route('/update-entry/<int:id>', methods=['PUT'])
+        try:
+            cursor.execute("delete from vehicle_driver where id =  %s",(id,))
+            changelog.record(cursor, 'vehicles', [id], 'delete')
+            conn.commit()
+            return jsonify({"message": f"Entry with id {id} deleted successfully"}), 200
+        except Exception as e:
+            return jsonify({"error":str(e)}),500
+        finally:
+            cursor.close()
+
+@api.route('/update-entry/<int:id>', methods=['PUT'])
 def update_Entry(id):
     data = request.json
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
 
+        try:
+            vehicle = data.get('vehicle', {})
+            driver = data.get('driver', {})
+
+            vehicle_id = vehicle.get('vehicleID')
+            vehicle_name = vehicle.get('vehicleName')
+            vehicle_capacity = vehicle.get('vehicleCapacity')
+
+            driver_name = driver.get('driverName')
+            driver_phone = driver.get('driverPhone')
+            driver_license = driver.get('driverLicense')
+            daily_wages = driver.get('dailyWages')
+            if not driver_phone or not driver_phone.isdigit() or len(driver_phone) != 10:
+                return jsonify({"error": "Invalid phone number. Must be exactly 10 digits."}), 400
+            query = """UPDATE vehicle_driver SET vehicleID = %s, vehicleName = %s,
+                              vehicleCapacity = %s, driverName = %s, driverPhone = %s,
+                              driverLicense = %s, dailyWages = %s WHERE id = %s"""
+            values = (vehicle_id, vehicle_name, vehicle_capacity,
+                      driver_name, driver_phone, driver_license,
+                      daily_wages, id)
+            cursor.execute(query, values)
+            changelog.record(cursor, 'vehicles', [id])
+            conn.commit()
+            return jsonify({"message": f"Entry with id {id} Updated successfully"}), 200
+        except Exception as e:
+            return jsonify({"error":str(e)}),500
+        finally:
+            cursor.close()
+
+#Sync
+# Delta sync for the app's local copy of the catalog, today's inventory and
+# sales, vehicles and accounts. Pass the "version" from the previous reply
+# as ?since=; without one (or on a new day) a full snapshot comes back with
+# "reset": true. While "has_more" is true, call again straight away.
+@api.route('/sync', methods=['GET'])
+def sync():
+    since = request.args.get('since', '0')
     try:
-        vehicle = data.get('vehicle', {})
-        driver = data.get('driver', {})
-
-        vehicle_id = vehicle.get('vehicleID')
-        vehicle_name = vehicle.get('vehicleName')
-        vehicle_capacity = vehicle.get('vehicleCapacity')
-
-        driver_name = driver.get('driverName')
-        driver_phone = driver.get('driverPhone')
-        driver_license = driver.get('driverLicense')
-        daily_wages = driver.get('dailyWages')
-        if not driver_phone or not driver_phone.isdigit() or len(driver_phone) != 10:
-            return jsonify({"error": "Invalid phone number. Must be exactly 10 digits."}), 400
-        query = """UPDATE vehicle_driver SET vehicleID = %s, vehicleName = %s,
-                          vehicleCapacity = %s, driverName = %s, driverPhone = %s,
-                          driverLicense = %s, dailyWages = %s WHERE id = %s"""
-        values = (vehicle_id, vehicle_name, vehicle_capacity,
-                  driver_name, driver_phone, driver_license,
-                  daily_wages, id)
-        cursor.execute(query, values)
-        conn.commit()
-        return jsonify({"message": f"Entry with id {id} Updated successfully"}), 200
-    except Exception as e:
-        return jsonify({"error":str(e)}),500
-    finally:
-        cursor.close()
-        conn.close()
+        since = int(since)
+        if since < 0:
+            raise ValueError
+        limit = parse_limit(request.args) or MAX_PAGE_SIZE
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    except ValueError:
+        return jsonify({'error': 'since must be a non-negative integer'}), 400
 
+    try:
+        return jsonify(changelog.changes_since(since, limit)), 200
+    except Exception:
+        log.exception("Error in /sync")
+        return jsonify({'message': 'Sync failed'}), 500
+
+# Live stock changes for every open sell/inventory screen: "stock" when a
+# row changes, "low_stock" when a sale leaves 20% or less, "load" for new
+# stock. Each event's id is a /sync version to resume from after a drop.
+@api.route('/events', methods=['GET'])
+def event_stream():
+    subscription = event_hub.subscribe()
+    if subscription is None:
+        response = jsonify({'message': 'Too many open event streams, poll /sync instead'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    keepalive = config.EVENTS_CONFIG['keepalive']
+
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while not subscription.overflowed:
+                event = subscription.get(keepalive)
+                if event is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield format_event(*event)
+        finally:
+            event_hub.unsubscribe(subscription)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+#Jobs
+@api.route('/api/jobs/day-close', methods=['GET'])
+def day_close_status():
+    return jsonify({'scheduler': dayclose.scheduler.status(), 'jobs': dayclose.recent_jobs()}), 200
+
+# Closes any unclosed past days now, on the scheduler's thread
+@api.route('/api/jobs/day-close', methods=['POST'])
+def run_day_close():
+    if not dayclose.scheduler.trigger():
+        return jsonify({'message': 'Day close is disabled (DAY_CLOSE_ENABLED=0)'}), 409
+    return jsonify({'message': 'Day close started'}), 202
+
+#Monitoring
+@api.route('/api/pool/stats', methods=['GET'])
+def pool_stats():
+    return jsonify({**get_pool().stats(), 'reads': routing.router.stats(),
+                    'admission': admission.controller.stats()}), 200
+
+def create_app():
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    CORS(app, expose_headers=['X-Next-Cursor', routing.LAST_WRITE])
+    metrics.init_app(app)
+    # Before auth, so a shed request never touches the database
+    admission.init_app(app)
+    auth.init_app(app)
+    compression.init_app(app)
+    routing.init_app(app)
+    app.register_blueprint(api)
+    return app
+
+app = create_app()
+
+# Development server only; use serve.py for real traffic
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    dayclose.start_quietly()
+    app.run(host='0.0.0.0', port=5000, debug=config.DEBUG)
+
@@ -0,0 +1,346 @@
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+
+import config
+import storage
+from config import get_db_connection
+from metrics import log
+
+# sales and product_entry_history are partitioned by month on their
+# timestamp, so date-range queries only touch the months they ask for.
+# Months older than ARCHIVE_KEEP_MONTHS are written to one compressed
+# column-per-array .npz file each and their partition is dropped; the
+# history endpoints and the line export read those files when a range
+# reaches back that far. Daily rollups are never archived, so reports
+# built on them are unaffected.
+#
+# Per table: timestamp column, then its DECIMAL columns with their scale
+TABLES = {
+    'sales': ('sale_date', [('quantity', 3), ('total_price', 2)]),
+    'product_entry_history': ('created_at', [('quantity', 3), ('price', 2), ('price_per_unit', 4)]),
+}
+
+FETCH_SIZE = 500
+
+# Other workers notice a newly archived month within this long; until then
+# that month (long past the retention window) is missing from their reads
+MONTHS_CACHE_TTL = 60.0
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return 'p%04d%02d' % (month.year, month.month)
+
+
+def _partition_clause(month):
+    return "PARTITION %s VALUES LESS THAN ('%s')" % (partition_name(month), add_months(month, 1).isoformat())
+
+
+# Partitions ------------------------------------------------------------------
+
+def create_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS archived_months (
+            table_name VARCHAR(64) NOT NULL,
+            month DATE NOT NULL,
+            status VARCHAR(16) NOT NULL,
+            row_count INT NOT NULL,
+            path VARCHAR(255) NOT NULL,
+            archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (table_name, month)
+        )
+    """)
+
+
+def _partitions(cursor, table):
+    # SQLite has no partitions; every month stays in the live tables
+    if config.DB_ENGINE == 'sqlite':
+        return []
+    cursor.execute("""
+        SELECT partition_name FROM information_schema.partitions
+        WHERE table_schema = DATABASE() AND table_name = %s AND partition_name IS NOT NULL
+        ORDER BY partition_ordinal_position
+    """, (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _month_of(name):
+    return date(int(name[1:5]), int(name[5:7]), 1)
+
+
+# One-off conversion run by the schema migration. MySQL requires the
+# partitioning column in every unique key, so the primary key becomes
+# (id, ts); ids stay unique through AUTO_INCREMENT. The table is copied.
+def partition_table(cursor, table):
+    if _partitions(cursor, table):
+        return
+    ts_column = TABLES[table][0]
+    cursor.execute("SELECT MIN(%s) FROM %s" % (ts_column, table))
+    first = cursor.fetchone()[0]
+    first = month_start(first or date.today())
+    last = add_months(month_start(date.today()), config.ARCHIVE_CONFIG['months_ahead'])
+    months = []
+    while first <= last:
+        months.append(first)
+        first = add_months(first, 1)
+    cursor.execute("ALTER TABLE %s DROP PRIMARY KEY, ADD PRIMARY KEY (id, %s)" % (table, ts_column))
+    cursor.execute("ALTER TABLE %s PARTITION BY RANGE COLUMNS(%s) (%s, PARTITION pmax VALUES LESS THAN (MAXVALUE))"
+                   % (table, ts_column, ', '.join(_partition_clause(month) for month in months)))
+
+
+# Splits empty months off the catch-all pmax partition ahead of time
+def ensure_future_partitions(cursor, table):
+    names = [name for name in _partitions(cursor, table) if name != 'pmax']
+    if not names:
+        return []
+    wanted = add_months(month_start(date.today()), config.ARCHIVE_CONFIG['months_ahead'])
+    month = add_months(_month_of(names[-1]), 1)
+    added = []
+    while month <= wanted:
+        added.append(month)
+        month = add_months(month, 1)
+    if added:
+        cursor.execute("ALTER TABLE %s REORGANIZE PARTITION pmax INTO (%s, PARTITION pmax VALUES LESS THAN (MAXVALUE))"
+                       % (table, ', '.join(_partition_clause(month) for month in added)))
+    return [partition_name(month) for month in added]
+
+
+# Archive files ---------------------------------------------------------------
+
+def archive_path(table, month):
+    return os.path.join(config.ARCHIVE_CONFIG['dir'], table, '%04d-%02d.npz' % (month.year, month.month))
+
+
+def _write_month(cursor, table, month, path):
+    ts_column, numeric = TABLES[table]
+    columns = ['id', 'category', 'product', ts_column] + [name for name, _ in numeric]
+    cursor.execute("SELECT %s FROM %s PARTITION (%s) ORDER BY %s, id"
+                   % (', '.join(columns), table, partition_name(month), ts_column))
+    values = [[] for _ in columns]
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            for column, value in zip(values, row):
+                column.append(value)
+
+    # Names are dictionary-encoded: a few hundred distinct strings plus one
+    # small integer per row
+    categories, category_codes = np.unique(np.array(values[1], dtype=str), return_inverse=True)
+    products, product_codes = np.unique(np.array(values[2], dtype=str), return_inverse=True)
+    arrays = {
+        'id': np.array(values[0], dtype=np.int64),
+        'categories': categories,
+        'category_codes': category_codes.astype(np.int32),
+        'products': products,
+        'product_codes': product_codes.astype(np.int32),
+        'ts': np.array(values[3], dtype='datetime64[us]'),
+    }
+    for (name, _), column in zip(numeric, values[4:]):
+        arrays[name] = np.array(column, dtype=np.float64)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + '.partial'
+    with open(partial, 'wb') as handle:
+        np.savez_compressed(handle, **arrays)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(partial, path)
+    return len(arrays['id'])
+
+
+# Writes one month to its file, checks it reads back complete, then drops
+# the partition. The archived_months row goes from 'pending' to 'done' only
+# after the drop, so readers never see a month both live and archived.
+def archive_month(table, month):
+    path = archive_path(table, month)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        name = partition_name(month)
+        if name in _partitions(cursor, table):
+            row_count = _write_month(cursor, table, month, path)
+            cursor.execute("SELECT COUNT(*) FROM %s PARTITION (%s)" % (table, name))
+            if cursor.fetchone()[0] != row_count or len(load_month(path)['id']) != row_count:
+                raise RuntimeError("archive of %s %s does not match the table" % (table, month))
+            cursor.execute("""
+                INSERT INTO archived_months (table_name, month, status, row_count, path)
+                VALUES (%s, %s, 'pending', %s, %s)
+                ON DUPLICATE KEY UPDATE status = 'pending', row_count = VALUES(row_count), path = VALUES(path)
+            """, (table, month, row_count, path))
+            conn.commit()
+            cursor.execute("ALTER TABLE %s DROP PARTITION %s" % (table, name))
+        cursor.execute("UPDATE archived_months SET status = 'done' WHERE table_name = %s AND month = %s",
+                       (table, month))
+        conn.commit()
+        cursor.close()
+    with _months_lock:
+        _months_cache.clear()
+
+
+# Archives every month before the retention window and adds partitions for
+# the coming months. Called by the day close job; cheap when there's
+# nothing to do.
+def maintain():
+    cutoff = add_months(month_start(date.today()), -config.ARCHIVE_CONFIG['keep_months'])
+    result = {'archived': [], 'added': []}
+    for table in TABLES:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            names = _partitions(cursor, table)
+            if not names:
+                cursor.close()
+                continue
+            result['added'].extend('%s.%s' % (table, name) for name in ensure_future_partitions(cursor, table))
+            cursor.execute("SELECT month FROM archived_months WHERE table_name = %s AND status = 'pending'",
+                           (table,))
+            months = {row[0] for row in cursor.fetchall()}
+            cursor.close()
+        months.update(_month_of(name) for name in names if name != 'pmax' and _month_of(name) < cutoff)
+        for month in sorted(months):
+            archive_month(table, month)
+            result['archived'].append('%s.%s' % (table, partition_name(month)))
+    return result
+
+
+# Reading ---------------------------------------------------------------------
+
+# The first day still held in the live tables, or None if nothing has been
+# archived (or the archive table doesn't exist yet, during early migrations)
+def first_live_day():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if not storage.table_exists(cursor, 'archived_months'):
+            cursor.close()
+            return None
+        cursor.execute("SELECT MAX(month) FROM archived_months")
+        latest = cursor.fetchone()[0]
+        cursor.close()
+    return add_months(latest, 1) if latest else None
+
+
+_months_cache = {}
+_months_lock = threading.Lock()
+_file_cache = {}
+_file_cache_lock = threading.Lock()
+FILE_CACHE_SIZE = 4
+
+
+def archived_months(table):
+    with _months_lock:
+        cached = _months_cache.get(table)
+        if cached and time.monotonic() - cached[0] < MONTHS_CACHE_TTL:
+            return cached[1]
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT month, path FROM archived_months
+            WHERE table_name = %s AND status = 'done' ORDER BY month
+        """, (table,))
+        months = cursor.fetchall()
+        cursor.close()
+    with _months_lock:
+        _months_cache[table] = (time.monotonic(), months)
+    return months
+
+
+def load_month(path):
+    mtime = os.path.getmtime(path)
+    with _file_cache_lock:
+        cached = _file_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files}
+    with _file_cache_lock:
+        _file_cache[path] = (mtime, arrays)
+        while len(_file_cache) > FILE_CACHE_SIZE:
+            _file_cache.pop(next(iter(_file_cache)))
+    return arrays
+
+
+def _mask(arrays, filters):
+    mask = np.ones(len(arrays['id']), dtype=bool)
+    ts = arrays['ts']
+    if filters.get('from'):
+        mask &= ts >= np.datetime64(filters['from'], 'us')
+    if filters.get('to'):
+        mask &= ts < np.datetime64(filters['to'], 'us')
+    for name, codes, names in (('category', 'category_codes', 'categories'),
+                               ('product', 'product_codes', 'products')):
+        if filters.get(name):
+            matches = np.nonzero(arrays[names] == filters[name])[0]
+            mask &= np.isin(arrays[codes], matches)
+    if filters.get('before'):
+        before_ts = np.datetime64(filters['before'][0], 'us')
+        mask &= (ts < before_ts) | ((ts == before_ts) & (arrays['id'] < filters['before'][1]))
+    return mask
+
+
+def _rows(table, arrays, positions):
+    ts_column, numeric = TABLES[table]
+    rows = []
+    for position in positions:
+        # Same column order and Decimal values as the live table
+        row = {
+            'id': int(arrays['id'][position]),
+            'category': str(arrays['categories'][arrays['category_codes'][position]]),
+            'product': str(arrays['products'][arrays['product_codes'][position]]),
+        }
+        for name, scale in numeric:
+            row[name] = Decimal('%.*f' % (scale, arrays[name][position]))
+        row[ts_column] = arrays['ts'][position].astype(datetime)
+        rows.append(row)
+    return rows
+
+
+# Yields batches of archived rows matching parse_history_args()-style
+# filters, newest first like the history endpoints (or oldest first). With
+# `columns`, rows come back as tuples in that order instead of dicts.
+def archived_batches(table, filters, descending=True, columns=None, size=FETCH_SIZE):
+    months = [(month, path) for month, path in archived_months(table)
+              if (not filters.get('to') or month < filters['to'].date())
+              and (not filters.get('from') or add_months(month, 1) > filters['from'].date())]
+    if descending:
+        months.reverse()
+    for month, path in months:
+        try:
+            arrays = load_month(path)
+        except OSError:
+            log.exception("Archived month is missing", extra={'table': table, 'path': path})
+            continue
+        positions = np.nonzero(_mask(arrays, filters))[0]
+        if descending:
+            positions = positions[::-1]
+        for start in range(0, len(positions), size):
+            rows = _rows(table, arrays, positions[start:start + size])
+            if columns:
+                rows = [tuple(row[name] for name in columns) for row in rows]
+            yield rows
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'run'
+    if command == 'run':
+        print(maintain())
+    elif command == 'list':
+        for table in TABLES:
+            for month, path in archived_months(table):
+                print("%s %s %s" % (table, month.strftime('%Y-%m'), path))
+    else:
+        print("usage: python archive.py [run|list]")
+        sys.exit(2)
@@ -0,0 +1,232 @@
+import base64
+import getpass
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g, jsonify, request
+
+import config
+from config import get_db_connection
+from metrics import log
+
+HASH_SCHEME = 'pbkdf2_sha256'
+
+# Routes reachable without a token
+PUBLIC_ENDPOINTS = {'api.login', 'metrics.metrics_endpoint'}
+
+
+class HashingBusy(Exception):
+    pass
+
+
+# Passwords -----------------------------------------------------------------
+
+def hash_password(password, iterations=None):
+    iterations = iterations or config.AUTH_CONFIG['hash_iterations']
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return '%s$%d$%s$%s' % (HASH_SCHEME, iterations, _b64(salt), _b64(digest))
+
+
+# Returns (matches, needs_rehash). Rows from before hashing was introduced
+# still hold the plain password; they match once and are then rehashed.
+def check_password(password, stored):
+    parts = stored.split('$')
+    if len(parts) != 4 or parts[0] != HASH_SCHEME:
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8')), True
+    iterations = int(parts[1])
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), _unb64(parts[2]), iterations)
+    matches = hmac.compare_digest(digest, _unb64(parts[3]))
+    return matches, iterations < config.AUTH_CONFIG['hash_iterations']
+
+
+class PasswordHasher:
+    # Runs the deliberately slow hash on a small dedicated pool. hashlib
+    # releases the GIL while hashing, so request threads keep serving other
+    # routes; past `max_pending` queued checks, logins are turned away
+    # instead of piling up behind each other.
+    def __init__(self, workers, max_pending, timeout):
+        self.timeout = timeout
+        self._executor = None
+        self._executor_pid = None
+        self._workers = workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _pool(self):
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self._workers, thread_name_prefix='password-hash')
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            return self._pool().submit(function, *args).result(self.timeout)
+        finally:
+            self._slots.release()
+
+
+# Tokens --------------------------------------------------------------------
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(payload):
+    return hmac.new(config.AUTH_CONFIG['secret'], payload.encode('ascii'), hashlib.sha256).digest()
+
+
+def issue_token(user):
+    now = int(time.time())
+    claims = {'sub': user['id'], 'usr': user['username'], 'iat': now,
+              'exp': now + config.AUTH_CONFIG['token_ttl']}
+    payload = _b64(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+    return '%s.%s' % (payload, _b64(_sign(payload)))
+
+
+# Returns the token's claims, or None if it is malformed, forged or expired
+def verify_token(token):
+    payload, _, signature = token.partition('.')
+    try:
+        if not hmac.compare_digest(_unb64(signature), _sign(payload)):
+            return None
+        claims = json.loads(_unb64(payload))
+    except (ValueError, TypeError):
+        return None
+    if claims.get('exp', 0) < time.time():
+        return None
+    return claims
+
+
+class UserCache:
+    # Small LRU of user records so authenticated requests need no DB lookup
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+
+    def get(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is not None:
+                self._users.move_to_end(user_id)
+            return user
+
+    def put(self, user):
+        with self._lock:
+            self._users[user['id']] = user
+            self._users.move_to_end(user['id'])
+            while len(self._users) > self.size:
+                self._users.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+
+hasher = PasswordHasher(config.AUTH_CONFIG['hash_workers'], config.AUTH_CONFIG['hash_queue'],
+                        config.AUTH_CONFIG['hash_timeout'])
+user_cache = UserCache(config.AUTH_CONFIG['user_cache_size'])
+
+
+def public_user(row):
+    return {'id': row['id'], 'username': row['username']}
+
+
+# Checks a login and returns the user record, or None for bad credentials
+def authenticate(username, password):
+    with get_db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT id, username, password FROM users WHERE username = %s", (username,))
+        row = cursor.fetchone()
+        cursor.close()
+
+    if row is None:
+        # Burn the same time as a real check so usernames can't be probed
+        hasher.run(hash_password, password)
+        return None
+
+    matches, needs_rehash = hasher.run(check_password, password, row['password'])
+    if not matches:
+        return None
+    if needs_rehash:
+        new_hash = hasher.run(hash_password, password)
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE users SET password = %s WHERE id = %s", (new_hash, row['id']))
+            conn.commit()
+            cursor.close()
+
+    user = public_user(row)
+    user_cache.put(user)
+    return user
+
+
+def load_user(user_id):
+    user = user_cache.get(user_id)
+    if user is None:
+        # First request this worker sees for the user (e.g. logged in on
+        # another worker); one lookup, then it's cached.
+        with get_db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT id, username FROM users WHERE id = %s", (user_id,))
+            row = cursor.fetchone()
+            cursor.close()
+        if row is None:
+            return None
+        user = public_user(row)
+        user_cache.put(user)
+    return user
+
+
+def _authenticate_request():
+    g.user = None
+    if request.method == 'OPTIONS' or request.endpoint in PUBLIC_ENDPOINTS:
+        return None
+
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        claims = verify_token(header[7:].strip())
+        user = load_user(claims['sub']) if claims else None
+        if user is None:
+            return jsonify({'message': 'Invalid or expired token'}), 401
+        g.user = user
+    elif config.AUTH_CONFIG['required']:
+        return jsonify({'message': 'Authentication required'}), 401
+    return None
+
+
+def init_app(app):
+    if not os.environ.get('AUTH_SECRET'):
+        log.warning("AUTH_SECRET is not set; tokens use a per-process key and stop working on restart")
+    app.before_request(_authenticate_request)
+
+
+if __name__ == '__main__':
+    # python auth.py set-password USERNAME  -- creates or updates a user
+    if len(sys.argv) != 3 or sys.argv[1] != 'set-password':
+        print("usage: python auth.py set-password USERNAME")
+        sys.exit(2)
+    username = sys.argv[2]
+    password = getpass.getpass("New password for %s: " % username)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO users (username, password) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE password = VALUES(password)
+        """, (username, hash_password(password)))
+        conn.commit()
+        cursor.close()
+    print("Password updated for %s" % username)
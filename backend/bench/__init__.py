@@ -0,0 +1,7 @@
+# Benchmark suite for the backend. Run from the backend directory:
+#
+#   python -m bench seed --database giri_bazar_bench
+#   python serve.py            (with DB_NAME=giri_bazar_bench)
+#   python -m bench run --url http://127.0.0.1:5000 --concurrency 16 --duration 60
+#   python -m bench compare before.json after.json
+#   python -m bench payload --rows 2000 [--url http://127.0.0.1:5000]
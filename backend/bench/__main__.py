@@ -0,0 +1,83 @@
+import argparse
+import sys
+
+from bench import report
+
+
+def parse_mix(value):
+    from bench.load import DEFAULT_MIX
+    if not value:
+        return None
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError('unknown operation %r, expected one of %s' % (name, ', '.join(DEFAULT_MIX)))
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_cmd = commands.add_parser('seed', help='fill a database with a synthetic shop')
+    seed_cmd.add_argument('--database', required=True, help='database to (re)create, or the file with DB_ENGINE=sqlite; its tables are emptied')
+    seed_cmd.add_argument('--products', type=int, default=2000)
+    seed_cmd.add_argument('--days', type=int, default=365)
+    seed_cmd.add_argument('--sales', type=int, default=2000000)
+    seed_cmd.add_argument('--loads-per-day', type=int)
+    seed_cmd.add_argument('--seed', type=int, default=42)
+
+    run_cmd = commands.add_parser('run', help='drive mixed traffic against a running server')
+    run_cmd.add_argument('--url', default='http://127.0.0.1:5000')
+    run_cmd.add_argument('--concurrency', type=int, default=8)
+    run_cmd.add_argument('--duration', type=float, default=30.0)
+    run_cmd.add_argument('--warmup', type=float, default=5.0)
+    run_cmd.add_argument('--mix', type=parse_mix,
+                         help='comma separated name=weight pairs, e.g. sellProduct=1 to bench one route')
+    run_cmd.add_argument('--seed', type=int, default=1)
+    run_cmd.add_argument('--output', help='write the results as JSON to this file')
+
+    payload_cmd = commands.add_parser('payload', help='measure response sizes and JSON encode times')
+    payload_cmd.add_argument('--rows', type=int, default=2000, help='rows per endpoint for the in-process run')
+    payload_cmd.add_argument('--url', help='also fetch the endpoints from this running server')
+    payload_cmd.add_argument('--limit', type=int, default=1000, help='page size for the history endpoints')
+
+    compare_cmd = commands.add_parser('compare', help='compare two saved runs')
+    compare_cmd.add_argument('before')
+    compare_cmd.add_argument('after')
+    compare_cmd.add_argument('--threshold', type=float, default=0.10)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'seed':
+        from bench.seed import seed
+        seed(args.database, products=args.products, days=args.days, sales=args.sales,
+             loads_per_day=args.loads_per_day, seed_value=args.seed)
+        return 0
+
+    if args.command == 'run':
+        from bench.load import run_load
+        result = run_load(args.url, concurrency=args.concurrency, duration=args.duration,
+                          warmup=args.warmup, mix=args.mix, seed_value=args.seed)
+        print(report.format_table(result))
+        if args.output:
+            report.save(result, args.output)
+        return 0
+
+    if args.command == 'payload':
+        from bench import payload
+        print(payload.format_encoding_table(payload.measure_encoding(args.rows)))
+        if args.url:
+            print()
+            print(payload.format_wire_table(payload.measure_wire(args.url, args.limit)))
+        return 0
+
+    table, regressions = report.compare(report.load(args.before), report.load(args.after), args.threshold)
+    print(table)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import http.client
+import json
+import random
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import urlencode, urlsplit
+
+from bench.report import summarize
+
+# Relative weights of each operation in the mixed workload. Browsing and
+# selling dominate, like a real trading day; reports are rare but heavy.
+DEFAULT_MIX = {
+    'categories': 10,
+    'getAllProducts': 8,
+    'fetchAllProducts': 8,
+    'getInventory': 15,
+    'getProductInventory': 6,
+    'sellProduct': 20,
+    'checkout': 4,
+    'addProductEntry': 4,
+    'addProductEntries': 1,
+    'getSaleHistory': 4,
+    'getProductHistory': 4,
+    'salesReport': 3,
+    'profitLossToday': 4,
+    'getEntries': 2,
+    'getAccounts': 1,
+}
+
+
+class Client:
+    # One keep-alive HTTP connection per worker thread
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, payload, headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                return response.status, data
+            except (http.client.HTTPException, ConnectionError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+
+class Workload:
+    def __init__(self, client, rng, report_days):
+        self.client = client
+        self.rng = rng
+        self.report_days = report_days
+        self.catalog = []
+        self.inventory = []
+
+    def prepare(self):
+        status, body = self.client.request('GET', '/fetchAllProducts')
+        if status != 200:
+            raise RuntimeError('GET /fetchAllProducts returned %d' % status)
+        for category, products in json.loads(body).items():
+            for product in products:
+                self.catalog.append((category, product['name']))
+        status, body = self.client.request('GET', '/getInventory')
+        self.inventory = [(row['category'], row['product']) for row in json.loads(body)] if status == 200 else []
+        if not self.catalog or not self.inventory:
+            raise RuntimeError('The target has no catalog or no stock for today; seed it first')
+
+    def _line(self):
+        category, product = self.rng.choice(self.inventory)
+        return {'category': category, 'product': product, 'quantity': round(self.rng.uniform(0.25, 3), 2)}
+
+    def _load(self):
+        category, product = self.rng.choice(self.catalog)
+        quantity = round(self.rng.uniform(20, 200), 1)
+        return {'category': category, 'product': product, 'quantity': quantity,
+                'price': round(quantity * self.rng.uniform(10, 200), 2)}
+
+    def _range(self):
+        days = self.rng.choice(self.report_days)
+        to_day = date.today() - timedelta(days=self.rng.randrange(30))
+        return {'from_date': (to_day - timedelta(days=days - 1)).isoformat(), 'to_date': to_day.isoformat()}
+
+    def run(self, name):
+        if name == 'categories':
+            return self.client.request('GET', '/categories')
+        if name == 'getAllProducts':
+            return self.client.request('GET', '/getAllProducts')
+        if name == 'fetchAllProducts':
+            return self.client.request('GET', '/fetchAllProducts')
+        if name == 'getInventory':
+            return self.client.request('GET', '/getInventory')
+        if name == 'getProductInventory':
+            return self.client.request('GET', '/getProductInventory')
+        if name == 'sellProduct':
+            return self.client.request('POST', '/sellProduct', self._line())
+        if name == 'checkout':
+            lines = [self._line() for _ in range(self.rng.randint(2, 10))]
+            return self.client.request('POST', '/checkout', {'lines': lines})
+        if name == 'addProductEntry':
+            return self.client.request('POST', '/addProductEntry', self._load())
+        if name == 'addProductEntries':
+            entries = [self._load() for _ in range(self.rng.randint(50, 200))]
+            return self.client.request('POST', '/addProductEntries', {'entries': entries})
+        if name == 'getSaleHistory':
+            return self.client.request('GET', '/getSaleHistory?' + urlencode({'limit': 50}))
+        if name == 'getProductHistory':
+            return self.client.request('GET', '/getProductHistory?' + urlencode({'limit': 50}))
+        if name == 'salesReport':
+            return self.client.request('GET', '/api/sales-report?' + urlencode(self._range()))
+        if name == 'profitLossToday':
+            return self.client.request('GET', '/api/profitloss/today')
+        if name == 'getEntries':
+            return self.client.request('GET', '/get-entries')
+        if name == 'getAccounts':
+            return self.client.request('GET', '/get-accounts')
+        raise ValueError('Unknown operation %r' % name)
+
+
+# Drives `concurrency` threads of mixed traffic against `base_url` for
+# `duration` seconds (after `warmup` seconds that are not recorded) and
+# returns the per-endpoint summary.
+def run_load(base_url, concurrency=8, duration=30.0, warmup=5.0, mix=None, seed_value=1,
+             report_days=(1, 7, 30, 365), timeout=30.0):
+    mix = dict(mix or DEFAULT_MIX)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    started = time.monotonic()
+    record_from = started + warmup
+    stop_at = record_from + duration
+
+    prototype = Workload(Client(base_url, timeout), random.Random(seed_value), report_days)
+    prototype.prepare()
+
+    def worker(index):
+        workload = Workload(Client(base_url, timeout), random.Random(seed_value + index + 1), report_days)
+        workload.catalog = prototype.catalog
+        workload.inventory = prototype.inventory
+        local = {name: [] for name in names}
+        local_errors = {name: 0 for name in names}
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                break
+            name = workload.rng.choices(names, weights)[0]
+            begin = time.perf_counter()
+            try:
+                status, _ = workload.run(name)
+                ok = status < 400
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - begin
+            if now >= record_from:
+                local[name].append(elapsed)
+                if not ok:
+                    local_errors[name] += 1
+        with lock:
+            for name in names:
+                samples[name].extend(local[name])
+                errors[name] += local_errors[name]
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return summarize(samples, errors, duration, {
+        'url': base_url,
+        'concurrency': concurrency,
+        'duration': duration,
+        'warmup': warmup,
+        'mix': mix,
+        'seed': seed_value,
+    })
@@ -0,0 +1,142 @@
+import http.client
+import random
+import time
+import zlib
+from datetime import datetime, timedelta
+from decimal import Decimal
+from urllib.parse import urlsplit
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from compression import brotli
+from responses import FastJSONProvider, to_columnar
+
+ENDPOINTS = ('getProductHistory', 'getSaleHistory', 'getInventory', 'getEntries')
+PATHS = {
+    'getProductHistory': '/getProductHistory?limit=%d',
+    'getSaleHistory': '/getSaleHistory?limit=%d',
+    'getInventory': '/getInventory',
+    'getEntries': '/get-entries',
+}
+
+
+# Rows shaped like each endpoint's response, with the same column types the
+# MySQL connector hands back (Decimal quantities and prices, datetimes).
+def sample_rows(endpoint, count, rng):
+    started = datetime(2025, 6, 1, 6, 0, 0)
+    rows = []
+    for i in range(count):
+        category = 'Category %d' % rng.randrange(20)
+        product = 'Product %d' % rng.randrange(2000)
+        quantity = Decimal(rng.randrange(1, 5000)) / 100
+        price = Decimal(rng.randrange(100, 500000)) / 100
+        at = started + timedelta(seconds=37 * i)
+        if endpoint == 'getProductHistory':
+            rows.append({'id': i + 1, 'category': category, 'product': product, 'quantity': quantity,
+                         'price': price, 'price_per_unit': price / quantity, 'created_at': at})
+        elif endpoint == 'getSaleHistory':
+            rows.append({'name': product, 'category': category, 'quantity': float(quantity),
+                         'price': float(price), 'created_at': at.strftime('%Y-%m-%d %H:%M:%S')})
+        elif endpoint == 'getInventory':
+            rows.append({'category': category, 'product': product, 'quantity': quantity,
+                         'price': price, 'price_per_unit': price / quantity})
+        else:
+            rows.append({'id': i + 1,
+                         'driver': {'driverName': 'Driver %d' % rng.randrange(50),
+                                    'driverPhone': '98%08d' % rng.randrange(10 ** 8),
+                                    'driverLicense': 'TN%011d' % rng.randrange(10 ** 11),
+                                    'dailyWages': Decimal(rng.randrange(500, 1500))},
+                         'vehicle': {'vehicleID': 'TN %02d AB %04d' % (rng.randrange(99), rng.randrange(10 ** 4)),
+                                     'vehicleName': 'Vehicle %d' % rng.randrange(30),
+                                     'vehicleCapacity': rng.randrange(1, 20)}})
+    return rows
+
+
+def _gzip(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# Encodes synthetic rows in-process: the old row-of-objects layout with
+# Flask's standard encoder against the new encoder in both layouts, and the
+# body size of each with no, gzip and brotli compression.
+def measure_encoding(rows_per_endpoint=2000, repeat=5, seed_value=1):
+    app = Flask(__name__)
+    standard = DefaultJSONProvider(app)
+    fast = FastJSONProvider(app)
+    rng = random.Random(seed_value)
+    results = []
+    for endpoint in ENDPOINTS:
+        rows = sample_rows(endpoint, rows_per_endpoint, rng)
+        variants = (
+            ('rows/stdlib', standard, lambda: rows),
+            ('rows/fast', fast, lambda: rows),
+            ('columnar/fast', fast, lambda: to_columnar(rows)),
+        )
+        for name, provider, build in variants:
+            body = provider.dumps(build()).encode('utf-8')
+            results.append({
+                'endpoint': endpoint,
+                'variant': name,
+                'encode_ms': round(_best_time(lambda: provider.dumps(build()), repeat) * 1000, 3),
+                'identity': len(body),
+                'gzip': len(_gzip(body)),
+                'br': len(brotli.compress(body, quality=5)) if brotli is not None else None,
+            })
+    return results
+
+
+# Fetches the real endpoints from a running server and records the bytes
+# that actually crossed the wire for each format and Accept-Encoding.
+def measure_wire(base_url, limit=1000):
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+    results = []
+    try:
+        for endpoint in ENDPOINTS:
+            path = PATHS[endpoint] % limit if '%d' in PATHS[endpoint] else PATHS[endpoint]
+            for layout in ('rows', 'columnar'):
+                full_path = path + ('&' if '?' in path else '?') + 'format=' + layout
+                for encoding in ('identity', 'gzip', 'br'):
+                    started = time.perf_counter()
+                    conn.request('GET', full_path, headers={'Accept-Encoding': encoding})
+                    response = conn.getresponse()
+                    body = response.read()
+                    results.append({
+                        'endpoint': endpoint,
+                        'variant': '%s/%s' % (layout, response.getheader('Content-Encoding', 'identity')),
+                        'status': response.status,
+                        'bytes': len(body),
+                        'ms': round((time.perf_counter() - started) * 1000, 3),
+                    })
+    finally:
+        conn.close()
+    return results
+
+
+def format_encoding_table(results):
+    lines = ['%-18s %-14s %10s %10s %10s %10s' % ('endpoint', 'variant', 'encode ms', 'bytes', 'gzip', 'br')]
+    for row in results:
+        lines.append('%-18s %-14s %10s %10d %10d %10s' % (
+            row['endpoint'], row['variant'], row['encode_ms'], row['identity'], row['gzip'],
+            row['br'] if row['br'] is not None else '-'))
+    return '\n'.join(lines)
+
+
+def format_wire_table(results):
+    lines = ['%-18s %-18s %7s %10s %10s' % ('endpoint', 'variant', 'status', 'bytes', 'ms')]
+    for row in results:
+        lines.append('%-18s %-18s %7d %10d %10s' % (
+            row['endpoint'], row['variant'], row['status'], row['bytes'], row['ms']))
+    return '\n'.join(lines)
@@ -0,0 +1,97 @@
+import json
+import math
+import platform
+import subprocess
+import time
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile over an already sorted list
+    if not sorted_values:
+        return None
+    # The rounding keeps float error like 0.07 * 100 = 7.000000000000001
+    # from pushing the rank up by one
+    rank = max(1, math.ceil(round(fraction * len(sorted_values), 9)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _stats(latencies, error_count, duration):
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        'count': count,
+        'errors': error_count,
+        'rps': round(count / duration, 2) if duration else None,
+        'mean_ms': ms(sum(latencies) / count) if count else None,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'max_ms': ms(latencies[-1]) if count else None,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(samples, errors, duration, meta):
+    everything = [latency for latencies in samples.values() for latency in latencies]
+    return {
+        'meta': dict(meta, finished_at=time.strftime('%Y-%m-%dT%H:%M:%S'), commit=_git_commit(),
+                     python=platform.python_version(), machine=platform.machine()),
+        'endpoints': {name: _stats(latencies, errors[name], duration)
+                      for name, latencies in sorted(samples.items()) if latencies},
+        'total': _stats(everything, sum(errors.values()), duration),
+    }
+
+
+def save(result, path):
+    with open(path, 'w') as handle:
+        json.dump(result, handle, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def format_table(result):
+    lines = ['%-20s %8s %7s %9s %9s %9s %9s' % ('endpoint', 'count', 'errors', 'rps', 'p50 ms', 'p95 ms', 'p99 ms')]
+    rows = list(result['endpoints'].items()) + [('TOTAL', result['total'])]
+    for name, stats in rows:
+        lines.append('%-20s %8d %7d %9s %9s %9s %9s' % (
+            name, stats['count'], stats['errors'], stats['rps'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms']))
+    return '\n'.join(lines)
+
+
+# Compares two saved runs endpoint by endpoint. A latency percentile that
+# grew, or throughput that dropped, by more than `threshold` (a fraction)
+# is reported as a regression.
+def compare(before, after, threshold=0.10):
+    lines = ['%-20s %-8s %10s %10s %8s' % ('endpoint', 'metric', 'before', 'after', 'change')]
+    regressions = []
+    names = sorted(set(before['endpoints']) | set(after['endpoints']))
+    for name in names + ['TOTAL']:
+        old = before['total'] if name == 'TOTAL' else before['endpoints'].get(name)
+        new = after['total'] if name == 'TOTAL' else after['endpoints'].get(name)
+        if not old or not new:
+            lines.append('%-20s only in %s' % (name, 'after' if new else 'before'))
+            continue
+        for metric, higher_is_worse in (('rps', False), ('p50_ms', True), ('p95_ms', True), ('p99_ms', True)):
+            if not old[metric] or new[metric] is None:
+                continue
+            change = (new[metric] - old[metric]) / old[metric]
+            worse = change > threshold if higher_is_worse else change < -threshold
+            lines.append('%-20s %-8s %10s %10s %+7.1f%%%s' % (
+                name, metric, old[metric], new[metric], change * 100, '  REGRESSION' if worse else ''))
+            if worse:
+                regressions.append((name, metric, change))
+    return '\n'.join(lines), regressions
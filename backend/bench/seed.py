@@ -0,0 +1,135 @@
+import random
+import time
+from datetime import date, datetime, timedelta
+
+import mysql.connector
+
+import config
+
+BATCH_SIZE = 5000
+
+CATEGORY_NAMES = [
+    'Vegetables', 'Fruits', 'Leafy Greens', 'Roots', 'Gourds', 'Beans', 'Chillies', 'Herbs',
+    'Onions', 'Potatoes', 'Tomatoes', 'Exotic', 'Organic', 'Flowers', 'Grains', 'Pulses',
+    'Spices', 'Dry Fruits', 'Coconuts', 'Mushrooms',
+]
+
+
+def create_database(name):
+    server = dict(config.DB_CONFIG)
+    server.pop('database', None)
+    conn = mysql.connector.connect(**server)
+    cursor = conn.cursor()
+    cursor.execute("CREATE DATABASE IF NOT EXISTS `%s`" % name.replace('`', ''))
+    cursor.close()
+    conn.close()
+
+
+def _insert_batches(cursor, conn, query, rows):
+    batch = []
+    count = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            cursor.executemany(query, batch)
+            conn.commit()
+            count += len(batch)
+            batch = []
+    if batch:
+        cursor.executemany(query, batch)
+        conn.commit()
+        count += len(batch)
+    return count
+
+
+# Builds a synthetic shop: a catalog of `products` items, `days` of stock
+# loads and `sales` sale lines spread over them, plus a well stocked
+# inventory for today so the sell traffic of a run doesn't run dry.
+def seed(database, products=2000, days=365, sales=2000000, loads_per_day=None, seed_value=42, log=print):
+    rng = random.Random(seed_value)
+    if config.DB_ENGINE == 'sqlite':
+        config.SQLITE_CONFIG['database'] = database
+    else:
+        create_database(database)
+        config.DB_CONFIG['database'] = database
+    config.reset_pool()
+
+    from schema import migrate
+    import rollups
+    migrate()
+
+    catalog = []
+    for index in range(products):
+        category = CATEGORY_NAMES[index % len(CATEGORY_NAMES)]
+        catalog.append((category, 'Product %05d' % index, round(rng.uniform(10, 400), 2)))
+
+    today = date.today()
+    first_day = today - timedelta(days=days - 1)
+    loads_per_day = loads_per_day or max(1, products // 2)
+
+    started = time.monotonic()
+    with config.get_db_connection() as conn:
+        cursor = conn.cursor()
+        for table in ('sales', 'product_entry_history', 'product_entries', 'products', 'categories',
+                      'daily_sales_rollup', 'daily_stock_rollup'):
+            cursor.execute("DELETE FROM %s" % table)
+        conn.commit()
+
+        cursor.executemany("INSERT INTO categories (name) VALUES (%s)", [(name,) for name in CATEGORY_NAMES])
+        cursor.execute("SELECT id, name FROM categories")
+        category_ids = {name: category_id for category_id, name in cursor.fetchall()}
+        cursor.executemany(
+            "INSERT INTO products (product_name, category_id, name, price_per_kg) VALUES (%s, %s, %s, %s)",
+            [(product, category_ids[category], category, price) for category, product, price in catalog])
+        conn.commit()
+        log("catalog: %d categories, %d products" % (len(category_ids), len(catalog)))
+
+        loads = []
+        for offset in range(days - 1):
+            day = first_day + timedelta(days=offset)
+            for category, product, price in rng.sample(catalog, min(loads_per_day, len(catalog))):
+                quantity = round(rng.uniform(20, 500), 1)
+                cost = round(quantity * price * rng.uniform(0.5, 0.8), 2)
+                loaded_at = datetime.combine(day, datetime.min.time()) + timedelta(seconds=rng.randint(14400, 36000))
+                loads.append((category, product, quantity, cost, cost / quantity, loaded_at))
+        # Today every product is loaded in bulk so a run's sells never run dry
+        loaded_at = datetime.combine(today, datetime.min.time()) + timedelta(hours=5)
+        for category, product, price in catalog:
+            cost = round(100000 * price * 0.6, 2)
+            loads.append((category, product, 100000.0, cost, cost / 100000, loaded_at))
+
+        count = _insert_batches(cursor, conn, """
+            INSERT INTO product_entry_history (category, product, quantity, price, price_per_unit, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, loads)
+        log("product_entry_history: %d rows" % count)
+
+        count = _insert_batches(cursor, conn, """
+            INSERT INTO product_entries (category, product, quantity, price, price_per_unit, purchase_date)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                price_per_unit = IF(quantity + VALUES(quantity) = 0, 0,
+                                    (price + VALUES(price)) / (quantity + VALUES(quantity))),
+                quantity = quantity + VALUES(quantity),
+                price = price + VALUES(price)
+        """, loads)
+        log("product_entries: %d rows" % count)
+
+        def sale_rows():
+            for _ in range(sales):
+                category, product, price = catalog[rng.randrange(len(catalog))]
+                quantity = round(rng.uniform(0.25, 10), 2)
+                day = first_day + timedelta(days=rng.randrange(days))
+                sold_at = datetime.combine(day, datetime.min.time()) + timedelta(seconds=rng.randint(21600, 75600))
+                yield category, product, quantity, round(quantity * price, 2), sold_at
+
+        count = _insert_batches(cursor, conn, """
+            INSERT INTO sales (category, product, quantity, total_price, sale_date)
+            VALUES (%s, %s, %s, %s, %s)
+        """, sale_rows())
+        log("sales: %d rows" % count)
+        cursor.close()
+
+    sales_rows, stock_rows = rollups.rebuild(first_day, today)
+    log("rollups: %d sales, %d stock rows" % (sales_rows, stock_rows))
+    log("seeded %s in %.1fs" % (database, time.monotonic() - started))
@@ -0,0 +1,62 @@
+import hashlib
+import threading
+import time
+
+from flask import Response, json, request
+
+# Other workers only learn about catalog writes through this TTL, so keep it
+# short enough that a new product shows up everywhere within a screen load.
+CATALOG_CACHE_TTL = 30.0
+
+
+class _Entry:
+    def __init__(self, body, version):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+
+class CatalogCache:
+    def __init__(self, ttl=CATALOG_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._version = 0
+        self._entries = {}
+
+    @property
+    def version(self):
+        return self._version
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def _get(self, key, loader):
+        with self._lock:
+            entry = self._entries.get(key)
+            version = self._version
+        if entry is not None and time.monotonic() - entry.loaded_at < self.ttl:
+            return entry
+
+        entry = _Entry(json.dumps(loader()).encode('utf-8'), version)
+        with self._lock:
+            # A write landed while we were loading; serve what we have but
+            # don't cache it, the next request reloads.
+            if self._version == version:
+                self._entries[key] = entry
+        return entry
+
+    # Serves the cached payload for `key`, calling `loader` (which hits the
+    # database and returns a JSON-able object) only on a miss. A matching
+    # If-None-Match becomes a bodiless 304.
+    def response(self, key, loader):
+        entry = self._get(key, loader)
+        response = Response(entry.body, mimetype='application/json')
+        response.set_etag(entry.etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,179 @@
+import sys
+from datetime import timedelta
+
+import schema
+from config import get_db_connection
+
+# Every write route appends (entity, id, op) rows here in the same
+# transaction as the change itself. The auto-increment `version` is what
+# /sync clients remember, so catching up is a primary key range scan
+# followed by id lookups for the rows that actually changed.
+
+# Versions are handed out at insert time but become visible at commit, so
+# a slow transaction can commit a version lower than one a client has
+# already seen. Rows that changed this close to the client's version are
+# sent again; applying an upsert twice is harmless.
+LATE_COMMIT_WINDOW = timedelta(seconds=5)
+
+# entity -> (select, id column, filter used for a full snapshot)
+ENTITIES = {
+    'categories': ("SELECT id, name FROM categories", 'id', None),
+    'products': ("SELECT p.id, c.name AS category, p.product_name AS product, p.price_per_kg"
+                 " FROM products p JOIN categories c ON c.id = p.category_id", 'p.id', None),
+    'inventory': ("SELECT id, category, product, quantity, price, price_per_unit, purchase_date, updated_at"
+                  " FROM product_entries", 'id', "purchase_date >= %s AND purchase_date < %s"),
+    'sales': ("SELECT id, category, product, quantity, total_price, sale_date FROM sales",
+              'id', "sale_date >= %s AND sale_date < %s"),
+    'vehicles': ("SELECT * FROM vehicle_driver", 'id', None),
+    'accounts': ("SELECT * FROM seller_details", 'id', None),
+}
+
+# Finer-grained kinds of change, for the /events stream; /sync reports them
+# as plain changes to the entity they alias.
+ENTITY_ALIASES = {
+    'loads': 'inventory',
+    'low_stock': 'inventory',
+}
+
+
+def create_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            version BIGINT AUTO_INCREMENT PRIMARY KEY,
+            entity VARCHAR(32) NOT NULL,
+            entity_id INT NOT NULL,
+            op ENUM('upsert', 'delete') NOT NULL,
+            changed_at DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+            INDEX idx_change_log_changed (changed_at)
+        )
+    """)
+
+
+def record(cursor, entity, ids, op='upsert'):
+    cursor.executemany("INSERT INTO change_log (entity, entity_id, op) VALUES (%s, %s, %s)",
+                       [(entity, entity_id, op) for entity_id in ids])
+
+
+# Stock loads upsert product_entries without learning the row ids, so they
+# are looked up through the (category, product, purchase_day) unique key.
+def record_entries(cursor, entity, day, keys):
+    cursor.executemany("""
+        INSERT INTO change_log (entity, entity_id, op)
+        SELECT %s, id, 'upsert' FROM product_entries
+        WHERE category = %s AND product = %s AND purchase_day = %s
+    """, [(entity, category, product, day) for category, product in keys])
+
+
+def fetch_rows(cursor, entity, ids):
+    select, id_column, _ = ENTITIES[entity]
+    cursor.execute("%s WHERE %s IN (%s)" % (select, id_column, ', '.join(['%s'] * len(ids))), list(ids))
+    return cursor.fetchall()
+
+
+def _snapshot(cursor):
+    day_start, day_end = schema.day_range()
+    changes = {}
+    for entity, (select, _, where) in ENTITIES.items():
+        if where:
+            cursor.execute(select + " WHERE " + where, (day_start, day_end))
+        else:
+            cursor.execute(select)
+        changes[entity] = {'upserted': cursor.fetchall(), 'deleted': []}
+    return changes
+
+
+def _needs_reset(cursor, since):
+    # Clients start over from a snapshot when they have no version, when
+    # their version has been pruned, or on a new day (inventory and sales
+    # are per-day lists, so yesterday's rows must be dropped anyway).
+    if not since:
+        return True, None
+    cursor.execute("SELECT changed_at FROM change_log WHERE version = %s", (since,))
+    row = cursor.fetchone()
+    if row is None or row['changed_at'] < schema.day_range()[0]:
+        return True, None
+    return False, row['changed_at']
+
+
+# Returns {'version', 'reset', 'has_more', 'changes'} where changes maps each
+# touched entity to its current rows ('upserted') and removed ids ('deleted').
+def changes_since(since, limit):
+    with get_db_connection() as conn:
+        conn.start_transaction(consistent_snapshot=True, readonly=True)
+        cursor = conn.cursor(dictionary=True)
+        reset, since_at = _needs_reset(cursor, since)
+
+        if reset:
+            cursor.execute("SELECT COALESCE(MAX(version), 0) AS version FROM change_log")
+            version = cursor.fetchone()['version']
+            changes = _snapshot(cursor)
+            cursor.close()
+            return {'version': version, 'reset': True, 'has_more': False, 'changes': changes}
+
+        cursor.execute("""
+            SELECT version, entity, entity_id, op FROM change_log
+            WHERE version > %s ORDER BY version LIMIT %s
+        """, (since, limit + 1))
+        rows = cursor.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        version = rows[-1]['version'] if rows else since
+
+        cursor.execute("""
+            SELECT version, entity, entity_id, op FROM change_log
+            WHERE changed_at >= %s AND version < %s
+            ORDER BY version
+        """, (since_at - LATE_COMMIT_WINDOW, since))
+        late = cursor.fetchall()
+
+        # The latest operation per row wins, so a product sold a hundred
+        # times since the last sync is sent once.
+        latest = {}
+        for row in late + rows:
+            entity = ENTITY_ALIASES.get(row['entity'], row['entity'])
+            latest[(entity, row['entity_id'])] = row['op']
+
+        changes = {}
+        upserts = {}
+        for (entity, entity_id), op in latest.items():
+            if entity not in ENTITIES:
+                continue
+            change = changes.setdefault(entity, {'upserted': [], 'deleted': []})
+            if op == 'delete':
+                change['deleted'].append(entity_id)
+            else:
+                upserts.setdefault(entity, []).append(entity_id)
+        for entity, ids in upserts.items():
+            found = fetch_rows(cursor, entity, ids)
+            changes[entity]['upserted'] = found
+            # Rows deleted by a change beyond this page count as deleted now
+            present = {row['id'] for row in found}
+            changes[entity]['deleted'].extend(entity_id for entity_id in ids if entity_id not in present)
+        cursor.close()
+    return {'version': version, 'reset': False, 'has_more': has_more, 'changes': changes}
+
+
+# Deletes log rows older than the start of yesterday in small batches, so
+# the log stays a few days' worth of rows without long-held locks. Clients
+# syncing from a pruned version simply get a fresh snapshot.
+def prune(keep_days=1, batch=10000):
+    cutoff = schema.day_range()[0] - timedelta(days=keep_days)
+    deleted = 0
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        while True:
+            cursor.execute("DELETE FROM change_log WHERE changed_at < %s LIMIT %s", (cutoff, batch))
+            conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch:
+                break
+        cursor.close()
+    return deleted
+
+
+if __name__ == '__main__':
+    if len(sys.argv) in (2, 3) and sys.argv[1] == 'prune':
+        print("Deleted %d change log rows" % prune(int(sys.argv[2]) if len(sys.argv) == 3 else 1))
+    else:
+        print("usage: python changelog.py prune [KEEP_DAYS]")
+        sys.exit(2)
@@ -0,0 +1,100 @@
+import zlib
+
+from flask import request
+
+import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {'application/json', 'text/csv', 'text/plain', 'text/html'}
+
+
+class GzipEncoder:
+    name = 'gzip'
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(config.COMPRESSION_CONFIG['gzip_level'], zlib.DEFLATED, 31)
+
+    def chunk(self, data):
+        # Sync-flush so each streamed batch reaches the client right away
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data=b''):
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class BrotliEncoder:
+    name = 'br'
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=config.COMPRESSION_CONFIG['brotli_quality'])
+
+    def chunk(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data=b''):
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+def choose_encoder(accept_encodings):
+    gzip_q = accept_encodings.quality('gzip')
+    if brotli is not None:
+        br_q = accept_encodings.quality('br')
+        if br_q > 0 and br_q >= gzip_q:
+            return BrotliEncoder
+    if gzip_q > 0:
+        return GzipEncoder
+    return None
+
+
+def _compress_stream(chunks, encoder):
+    try:
+        for data in chunks:
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            if data:
+                yield encoder.chunk(data)
+        yield encoder.finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def _compress_response(response):
+    if (request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    # Small bodies cost more to compress than they save on the wire;
+    # streamed bodies have no known length and are always worth it.
+    if not response.is_streamed and response.content_length < config.COMPRESSION_CONFIG['min_size']:
+        return response
+    encoder_class = choose_encoder(request.accept_encodings)
+    if encoder_class is None:
+        return response
+
+    encoder = encoder_class()
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoder)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(encoder.finish(response.get_data()))
+    response.headers['Content-Encoding'] = encoder.name
+
+    # The body bytes changed, so a strong ETag no longer applies; a weak
+    # one still lets If-None-Match revalidate the catalog endpoints.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    if config.COMPRESSION_CONFIG['enabled']:
+        app.after_request(_compress_response)
@@ -1,10 +1,217 @@
-import mysql.connector
+import os
+import threading
 
+from pool import ConnectionPool
+
+# Everything is read from the environment so credentials stay out of the
+# repository. The defaults suit a local development database.
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+def env_float(name, default):
+    return float(os.environ.get(name, default))
+
+DEBUG = os.environ.get('GIRI_DEBUG', '0') == '1'
+
+DB_CONFIG = {
+    'host': os.environ.get('DB_HOST', 'localhost'),
+    'port': env_int('DB_PORT', 3306),
+    'user': os.environ.get('DB_USER', 'root'),
+    'password': os.environ.get('DB_PASSWORD', ''),
+    'database': os.environ.get('DB_NAME', 'giri_bazar'),
+}
+
+# 'mysql', or 'sqlite' for the embedded engine (see storage.py): no server
+# to run, the whole database is the file at SQLITE_PATH
+DB_ENGINE = os.environ.get('DB_ENGINE', 'mysql')
+
+SQLITE_CONFIG = {
+    'database': os.environ.get('SQLITE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'giri_bazar.db')),
+    # How long a write waits for another connection's transaction, in ms
+    'busy_timeout': env_int('SQLITE_BUSY_TIMEOUT', 5000),
+    # Page cache per connection; negative values are KiB
+    'cache_size': env_int('SQLITE_CACHE_SIZE', -65536),
+    'mmap_size': env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+}
+
+POOL_CONFIG = {
+    'size': env_int('DB_POOL_SIZE', 5),
+    'max_overflow': env_int('DB_POOL_MAX_OVERFLOW', 10),
+    'timeout': env_float('DB_POOL_TIMEOUT', 10.0),
+    'max_lifetime': env_float('DB_POOL_MAX_LIFETIME', 3600.0),
+    'ping_interval': env_float('DB_POOL_PING_INTERVAL', 30.0),
+}
+
+METRICS_CONFIG = {
+    'slow_query_ms': env_float('SLOW_QUERY_MS', 200.0),
+    'log_level': os.environ.get('LOG_LEVEL', 'INFO'),
+}
+
+# How stale another worker's inventory writes may be in this worker's
+# in-memory index (see inventory_index.py)
+INVENTORY_REFRESH_SECONDS = env_float('INVENTORY_REFRESH_SECONDS', 1.0)
+
+# Response compression, negotiated from Accept-Encoding (see compression.py)
+COMPRESSION_CONFIG = {
+    'enabled': os.environ.get('COMPRESSION', '1') == '1',
+    'min_size': env_int('COMPRESS_MIN_SIZE', 1024),
+    'gzip_level': env_int('COMPRESS_GZIP_LEVEL', 6),
+    'brotli_quality': env_int('COMPRESS_BROTLI_QUALITY', 5),
+}
+
+AUTH_CONFIG = {
+    # Without AUTH_SECRET every process start invalidates issued tokens
+    'secret': os.environ.get('AUTH_SECRET', '').encode('utf-8') or os.urandom(32),
+    'token_ttl': env_int('AUTH_TOKEN_TTL', 12 * 3600),
+    # Off until every client sends tokens; tokens are still verified when sent
+    'required': os.environ.get('AUTH_REQUIRED', '0') == '1',
+    'hash_iterations': env_int('AUTH_HASH_ITERATIONS', 200000),
+    'hash_workers': env_int('AUTH_HASH_WORKERS', 2),
+    'hash_queue': env_int('AUTH_HASH_QUEUE', 32),
+    'hash_timeout': env_float('AUTH_HASH_TIMEOUT', 10.0),
+    'user_cache_size': env_int('AUTH_USER_CACHE_SIZE', 256),
+}
+
+# Read replicas for the report and history routes (see routing.py): a comma
+# separated list of host[:port], e.g. DB_REPLICAS=127.0.0.1:3307. They use
+# the primary's user, password and database.
+REPLICA_CONFIG = {
+    'hosts': [host.strip() for host in os.environ.get('DB_REPLICAS', '').split(',') if host.strip()],
+    'size': env_int('DB_REPLICA_POOL_SIZE', 5),
+    'max_overflow': env_int('DB_REPLICA_POOL_MAX_OVERFLOW', 10),
+    # Short, so a saturated replica sends reads to the primary instead of queueing them
+    'timeout': env_float('DB_REPLICA_POOL_TIMEOUT', 1.0),
+    # How long a replica that refused a connection is left alone
+    'retry_after': env_float('DB_REPLICA_RETRY_AFTER', 30.0),
+    # Reads go to the primary for this long after the same client wrote
+    'pin_seconds': env_float('DB_REPLICA_PIN_SECONDS', 5.0),
+}
+
+# Set by metrics.init_app(); wraps every cursor the pool hands out
+CURSOR_WRAPPER = None
+
+# Set by admission.init_app(); called with every connection the pool hands out
+CHECKOUT_HOOK = None
+
+SERVER_CONFIG = {
+    'bind': os.environ.get('WEB_BIND', '0.0.0.0:5000'),
+    'workers': env_int('WEB_WORKERS', (os.cpu_count() or 1) * 2 + 1),
+    'threads': env_int('WEB_THREADS', 4),
+    'keepalive': env_int('WEB_KEEPALIVE', 5),
+    'timeout': env_int('WEB_TIMEOUT', 60),
+    'graceful_timeout': env_int('WEB_GRACEFUL_TIMEOUT', 30),
+    'max_requests': env_int('WEB_MAX_REQUESTS', 0),
+}
+
+# /events push stream (see events.py). Every open stream holds one of the
+# worker's WEB_THREADS, so only part of them may be taken by subscribers.
+EVENTS_CONFIG = {
+    'poll_interval': env_float('EVENTS_POLL_INTERVAL', 0.5),
+    'keepalive': env_float('EVENTS_KEEPALIVE', 15.0),
+    'queue_size': env_int('EVENTS_QUEUE_SIZE', 256),
+    'max_subscribers': env_int('EVENTS_MAX_SUBSCRIBERS', max(1, SERVER_CONFIG['threads'] // 2)),
+}
+
+# Admission control (see admission.py), per worker process. A request
+# waiting in one of these queues still holds one of the worker's
+# WEB_THREADS, so the queues are short and anything past them gets a 503.
+def admission_class(name, limit, queue, wait, statement_ms):
+    prefix = 'ADMISSION_%s_' % name.upper()
+    return {
+        # Requests of the class running at once, and waiting for a slot
+        'limit': env_int(prefix + 'LIMIT', limit),
+        'queue': env_int(prefix + 'QUEUE', queue),
+        # Longest wait in the queue, in seconds
+        'wait': env_float(prefix + 'WAIT', wait),
+        # MySQL max_execution_time for the class's SELECTs; 0 for none
+        'statement_ms': env_int(prefix + 'STATEMENT_MS', statement_ms),
+    }
+
+# One slot per thread. Open /events streams take threads outside admission
+# control, but they are capped on their own and a request that finds every
+# thread busy only waits in the server's backlog, so the slots aren't cut
+# down for them; that would leave standard routes a single slot.
+ADMISSION_MAX_ACTIVE = max(1, SERVER_CONFIG['threads'])
+
+ADMISSION_CONFIG = {
+    'enabled': os.environ.get('ADMISSION', '1') == '1',
+    'max_active': env_int('ADMISSION_MAX_ACTIVE', ADMISSION_MAX_ACTIVE),
+    # Slots only the sell path may use, so reports and everything else
+    # together never hold every thread
+    'reserved': env_int('ADMISSION_RESERVED', min(max(1, ADMISSION_MAX_ACTIVE // 4), ADMISSION_MAX_ACTIVE - 1)),
+    'retry_after': env_int('ADMISSION_RETRY_AFTER', 5),
+    'classes': {
+        'critical': admission_class('critical', SERVER_CONFIG['threads'], SERVER_CONFIG['threads'], 5.0, 5000),
+        'standard': admission_class('standard', SERVER_CONFIG['threads'], SERVER_CONFIG['threads'], 2.0, 10000),
+        'reporting': admission_class('reporting', max(1, SERVER_CONFIG['threads'] // 4),
+                                     max(1, SERVER_CONFIG['threads'] // 4), 1.0, 30000),
+    },
+    # Caps for single routes on top of their class's, as a comma separated
+    # list of endpoint=limit, e.g. ADMISSION_ROUTE_LIMITS=api.sales_export=1
+    'route_limits': {name.strip(): int(limit) for name, _, limit in
+                     (part.partition('=') for part in os.environ.get('ADMISSION_ROUTE_LIMITS', '').split(','))
+                     if name.strip()},
+}
+
+# Background end-of-day close (see dayclose.py)
+DAY_CLOSE_CONFIG = {
+    'enabled': os.environ.get('DAY_CLOSE_ENABLED', '1') == '1',
+    'run_at': os.environ.get('DAY_CLOSE_AT', '00:01'),
+    'keep_days': env_int('DAY_CLOSE_KEEP_DAYS', 30),
+}
+
+# Cold storage for old months of sales and product_entry_history (see archive.py)
+ARCHIVE_CONFIG = {
+    'dir': os.environ.get('ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive')),
+    'keep_months': env_int('ARCHIVE_KEEP_MONTHS', 12),
+    'months_ahead': env_int('ARCHIVE_MONTHS_AHEAD', 3),
+}
+
+# Per-product margin analytics (see analytics.py). Each cached chunk is one
+# month of one table held as NumPy columns, about 24 bytes per row.
+ANALYTICS_CONFIG = {
+    'cache_chunks': env_int('ANALYTICS_CACHE_CHUNKS', 28),
+}
+
+# Offline queue replay (POST /replay) and its idempotency keys
+REPLAY_CONFIG = {
+    'max_ops': env_int('REPLAY_MAX_OPS', 1000),
+    # Bounds how long one replay holds today's stock rows locked
+    'ops_per_transaction': env_int('REPLAY_OPS_PER_TRANSACTION', 200),
+    'key_ttl_hours': env_int('REPLAY_KEY_TTL_HOURS', 7 * 24),
+    'max_keys': env_int('REPLAY_MAX_KEYS', 500000),
+}
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool, _pool_pid
+    # Sockets must never be shared across a fork, so a child process that
+    # inherited the parent's pool quietly builds its own.
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                if DB_ENGINE == 'sqlite':
+                    import storage
+                    _pool = ConnectionPool(SQLITE_CONFIG, connect=storage.connect_sqlite, cursor_wrapper=CURSOR_WRAPPER,
+                                           checkout_hook=CHECKOUT_HOOK, **POOL_CONFIG)
+                else:
+                    _pool = ConnectionPool(DB_CONFIG, cursor_wrapper=CURSOR_WRAPPER, checkout_hook=CHECKOUT_HOOK,
+                                           **POOL_CONFIG)
+                _pool_pid = os.getpid()
+    return _pool
+
+# Drops the current pool; the next get_pool() call builds a fresh one.
+# Called by serve.py in each worker right after fork.
+def reset_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        _pool, _pool_pid = None, None
+
+# Returns a pooled connection. Use it as a context manager so it always goes
+# back to the pool:  with get_db_connection() as conn: ...
 def get_db_connection():
-    connection = mysql.connector.connect(
-        host='localhost',
-        user='root',
-        password='Jaya@2002',
-        database='giri_bazar'
-    )
-    return connection
+    return get_pool().connection()
@@ -0,0 +1,268 @@
+import json
+import os
+import sys
+import threading
+from datetime import date, datetime, time, timedelta
+
+import archive
+import changelog
+import config
+import idempotency
+import inventory_index
+import schema
+from config import get_db_connection
+from metrics import log
+
+# Closing a day, in one background job instead of on anyone's request:
+#   1. the next day's opening stock is the remaining stock, carried forward
+#   2. the profit_loss row is computed from the rollups and inventory
+#   3. product_entries rows, change log entries and replay keys past
+#      retention are dropped, and months past the archive window move to
+#      archive files
+# Every worker runs the scheduler; a MySQL named lock makes sure only one of
+# them does the work, and day_close_jobs records what happened.
+LOCK_NAME = 'giri_bazar_day_close'
+
+# How far back a worker starting up will close days that were missed while
+# the backend was down
+CATCH_UP_DAYS = 7
+
+
+# Same formula as the Profit & Loss screen, so saved rows match what the
+# shop has always seen there
+def profit_or_loss(total_sale, loaded_stock, daily_expense, remaining_stock):
+    return total_sale - (loaded_stock + daily_expense + remaining_stock)
+
+
+# Computes a day's totals and upserts its profit_loss row. The expense is
+# the only figure the server can't know: it is updated when given and kept
+# from the existing row otherwise.
+def save_profit_loss(cursor, day, daily_expense=None):
+    day_start, day_end = schema.day_range(day)
+    cursor.execute("""
+        SELECT
+            (SELECT COALESCE(SUM(total_price), 0) FROM daily_sales_rollup WHERE day = %s) AS total_sale,
+            (SELECT COALESCE(SUM(loaded_value), 0) FROM daily_stock_rollup WHERE day = %s) AS loaded_stock,
+            (SELECT COALESCE(SUM(price), 0) FROM product_entries
+             WHERE purchase_date >= %s AND purchase_date < %s) AS remaining_stock,
+            (SELECT daily_expense FROM profit_loss WHERE date = %s) AS daily_expense
+    """, (day, day, day_start, day_end, day))
+    totals = cursor.fetchone()
+    row = {
+        'date': day.isoformat(),
+        'total_sale': float(totals[0]),
+        'loaded_stock': float(totals[1]),
+        'remaining_stock': float(totals[2]),
+        'daily_expense': float(daily_expense if daily_expense is not None else totals[3] or 0),
+    }
+    row['profit_or_loss'] = profit_or_loss(row['total_sale'], row['loaded_stock'], row['daily_expense'],
+                                           row['remaining_stock'])
+    cursor.execute("""
+        INSERT INTO profit_loss (date, total_sale, loaded_stock, remaining_stock, daily_expense, profit_or_loss)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            total_sale = VALUES(total_sale),
+            loaded_stock = VALUES(loaded_stock),
+            remaining_stock = VALUES(remaining_stock),
+            daily_expense = VALUES(daily_expense),
+            profit_or_loss = VALUES(profit_or_loss)
+    """, (day, row['total_sale'], row['loaded_stock'], row['remaining_stock'], row['daily_expense'],
+          row['profit_or_loss']))
+    return row
+
+
+# Adds the day's unsold stock to the next day's rows (merging with anything
+# already loaded). It is opening stock, not a truck load, so it doesn't go
+# into product_entry_history or the loaded-stock rollup.
+def carry_forward(cursor, day):
+    day_start, day_end = schema.day_range(day)
+    cursor.execute("""
+        SELECT category, product, quantity, price FROM product_entries
+        WHERE purchase_date >= %s AND purchase_date < %s AND quantity > 0
+    """, (day_start, day_end))
+    rows = cursor.fetchall()
+    if not rows:
+        return 0
+    cursor.executemany("""
+        INSERT INTO product_entries (category, product, quantity, price, price_per_unit, purchase_date)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            price_per_unit = IF(quantity + VALUES(quantity) = 0, 0,
+                                (price + VALUES(price)) / (quantity + VALUES(quantity))),
+            quantity = quantity + VALUES(quantity),
+            price = price + VALUES(price)
+    """, [(category, product, quantity, price, price / quantity, day_end)
+          for category, product, quantity, price in rows])
+    changelog.record_entries(cursor, 'inventory', day_end.date(), {row[:2] for row in rows})
+    return len(rows)
+
+
+def compact_entries(cursor, conn, before_day, batch=10000):
+    deleted = 0
+    while True:
+        cursor.execute("DELETE FROM product_entries WHERE purchase_date < %s LIMIT %s",
+                       (schema.day_range(before_day)[0], batch))
+        conn.commit()
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch:
+            return deleted
+
+
+def _set_status(cursor, conn, day, status, details=None, error=None):
+    if status == 'running':
+        cursor.execute("""
+            INSERT INTO day_close_jobs (day, status, started_at) VALUES (%s, 'running', NOW())
+            ON DUPLICATE KEY UPDATE status = 'running', started_at = NOW(), finished_at = NULL,
+                details = NULL, error = NULL
+        """, (day,))
+    else:
+        cursor.execute("""
+            UPDATE day_close_jobs SET status = %s, finished_at = NOW(), details = %s, error = %s
+            WHERE day = %s
+        """, (status, json.dumps(details) if details is not None else None, error, day))
+    conn.commit()
+
+
+def close_day(day):
+    with get_db_connection() as conn:
+        cursor = conn.cursor(buffered=True)
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (LOCK_NAME,))
+        if not cursor.fetchone()[0]:
+            cursor.close()
+            return None
+        try:
+            _set_status(cursor, conn, day, 'running')
+            try:
+                # Days closed late while catching up have already traded
+                # without the stock, so only the latest day carries it over.
+                # carried_at is set in the same transaction, so closing a day
+                # again never carries its stock twice.
+                cursor.execute("SELECT carried_at FROM day_close_jobs WHERE day = %s", (day,))
+                carried = 0
+                if cursor.fetchone()[0] is None and day >= date.today() - timedelta(days=1):
+                    carried = carry_forward(cursor, day)
+                    cursor.execute("UPDATE day_close_jobs SET carried_at = NOW() WHERE day = %s", (day,))
+                totals = save_profit_loss(cursor, day)
+                conn.commit()
+                keep_days = config.DAY_CLOSE_CONFIG['keep_days']
+                details = {
+                    'carried_forward': carried,
+                    'profit_loss': totals,
+                    'entries_deleted': compact_entries(cursor, conn, day - timedelta(days=keep_days)),
+                    'change_log_deleted': changelog.prune(),
+                    'idempotency_keys_deleted': idempotency.prune(),
+                    'partitions': archive.maintain(),
+                }
+            except Exception as e:
+                conn.rollback()
+                _set_status(cursor, conn, day, 'failed', error=str(e))
+                raise
+            _set_status(cursor, conn, day, 'done', details)
+            return details
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cursor.close()
+
+
+def _open_days(today):
+    first = today - timedelta(days=CATCH_UP_DAYS)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT day FROM day_close_jobs WHERE day >= %s AND status = 'done'", (first,))
+        closed = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+    return [first + timedelta(days=offset) for offset in range(CATCH_UP_DAYS)
+            if first + timedelta(days=offset) not in closed]
+
+
+def recent_jobs(limit=14):
+    with get_db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM day_close_jobs ORDER BY day DESC LIMIT %s", (limit,))
+        rows = cursor.fetchall()
+        cursor.close()
+    for row in rows:
+        row['day'] = row['day'].isoformat()
+        row['details'] = json.loads(row['details']) if row['details'] else None
+    return rows
+
+
+class DayCloseScheduler:
+    # A daemon thread per worker. Shortly after midnight it closes every day
+    # that isn't closed yet (normally just yesterday) and warms this
+    # worker's inventory index for the new day.
+    def __init__(self, run_at):
+        self.run_at = run_at
+        self.next_run = None
+        self.last_run = None
+        self.last_error = None
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+
+    def start(self):
+        if self._thread is None or self._thread_pid != os.getpid():
+            self._thread = threading.Thread(target=self._loop, name='day-close', daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    # Runs the close now instead of waiting for the schedule. With
+    # DAY_CLOSE_ENABLED=0 no thread is started and nothing runs.
+    def trigger(self):
+        if not config.DAY_CLOSE_CONFIG['enabled']:
+            return False
+        self.start()
+        self._wake.set()
+        return True
+
+    def _next_run(self, now):
+        run = datetime.combine(now.date(), self.run_at)
+        return run if run > now else run + timedelta(days=1)
+
+    def _loop(self):
+        # Catch up first, in case the backend was down over a midnight
+        self._run_once()
+        while True:
+            self.next_run = self._next_run(datetime.now())
+            self._wake.wait(max((self.next_run - datetime.now()).total_seconds(), 0))
+            self._wake.clear()
+            self._run_once()
+            inventory_index.warm_quietly()
+
+    def _run_once(self):
+        try:
+            for day in _open_days(date.today()):
+                details = close_day(day)
+                if details is None:
+                    # Another worker holds the lock and is doing the work
+                    break
+                log.info("Closed day", extra={'day': day.isoformat(), **details})
+            self.last_run = datetime.now()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            log.exception("Day close failed")
+
+    def status(self):
+        def iso(value):
+            return value.isoformat(sep=' ', timespec='seconds') if value else None
+        return {'pid': os.getpid(), 'run_at': self.run_at.isoformat(), 'next_run': iso(self.next_run),
+                'last_run': iso(self.last_run), 'last_error': self.last_error}
+
+
+scheduler = DayCloseScheduler(time.fromisoformat(config.DAY_CLOSE_CONFIG['run_at']))
+
+
+def start_quietly():
+    if config.DAY_CLOSE_CONFIG['enabled']:
+        scheduler.start()
+
+
+if __name__ == '__main__':
+    # python dayclose.py [DAY]  -- close one day now (default: yesterday)
+    day = date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else date.today() - timedelta(days=1)
+    details = close_day(day)
+    if details is None:
+        print("Another process is closing a day right now; try again shortly")
+        sys.exit(1)
+    print(json.dumps(details, indent=2))
@@ -0,0 +1,136 @@
+import os
+import queue
+import threading
+import time
+
+from flask import json
+
+import changelog
+import config
+from config import get_db_connection
+from metrics import log
+
+# Change log entries pushed to /events subscribers, and the event name each
+# one is sent as. Every worker polls the shared change log, so a sale made
+# through any worker reaches the subscribers of all of them.
+EVENT_TYPES = {
+    'inventory': 'stock',
+    'low_stock': 'low_stock',
+    'loads': 'load',
+}
+
+# Same late-commit allowance as /sync: versions near the newest one seen are
+# read again, and the ones already sent are skipped.
+LATE_COMMIT_WINDOW = changelog.LATE_COMMIT_WINDOW
+
+
+class Subscription:
+    def __init__(self, queue_size):
+        self.events = queue.Queue(queue_size)
+        # Set when the client fell too far behind; its stream is closed and
+        # the app catches up through /sync when it reconnects.
+        self.overflowed = False
+
+    def get(self, timeout):
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventHub:
+    # One poller thread per worker process reads new change log rows and
+    # fans them out to this worker's subscribers. It only queries while
+    # someone is subscribed.
+    def __init__(self, poll_interval, queue_size, max_subscribers):
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._thread = None
+        self._thread_pid = None
+        self._watermark = None
+        self._sent = {}
+
+    def subscribe(self):
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscription = Subscription(self.queue_size)
+            self._subscribers.add(subscription)
+            if self._thread is None or self._thread_pid != os.getpid():
+                self._thread = threading.Thread(target=self._run, name='event-hub', daemon=True)
+                self._thread_pid = os.getpid()
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _run(self):
+        while True:
+            if not self.subscriber_count():
+                # Nothing to deliver; start from "now" when someone subscribes
+                self._watermark = None
+                time.sleep(self.poll_interval)
+                continue
+            try:
+                self._poll()
+            except Exception:
+                log.exception("Event poll failed")
+                time.sleep(5)
+            time.sleep(self.poll_interval)
+
+    def _poll(self):
+        with get_db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            if self._watermark is None:
+                cursor.execute("SELECT NOW(6) AS now")
+                self._watermark = cursor.fetchone()['now']
+                self._sent = {}
+            cursor.execute("""
+                SELECT version, entity, entity_id, changed_at FROM change_log
+                WHERE changed_at >= %%s AND entity IN (%s)
+                ORDER BY version
+            """ % ', '.join(['%s'] * len(EVENT_TYPES)), [self._watermark - LATE_COMMIT_WINDOW] + list(EVENT_TYPES))
+            rows = [row for row in cursor.fetchall() if row['version'] not in self._sent]
+            ids = sorted({row['entity_id'] for row in rows})
+            entries = {row['id']: row for row in changelog.fetch_rows(cursor, 'inventory', ids)} if ids else {}
+            cursor.close()
+
+        for row in rows:
+            self._sent[row['version']] = row['changed_at']
+            if row['changed_at'] > self._watermark:
+                self._watermark = row['changed_at']
+            entry = entries.get(row['entity_id'])
+            if entry is not None:
+                self._publish(row['version'], EVENT_TYPES[row['entity']], entry)
+
+        horizon = self._watermark - LATE_COMMIT_WINDOW
+        self._sent = {version: at for version, at in self._sent.items() if at >= horizon}
+
+    def _publish(self, version, event_type, data):
+        event = (version, event_type, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.events.put_nowait(event)
+            except queue.Full:
+                subscription.overflowed = True
+
+
+event_hub = EventHub(config.EVENTS_CONFIG['poll_interval'], config.EVENTS_CONFIG['queue_size'],
+                     config.EVENTS_CONFIG['max_subscribers'])
+
+
+# The id of each event is its change log version, so a reconnecting client
+# can fetch whatever it missed with /sync?since=<last event id>.
+def format_event(version, event_type, data):
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (version, event_type, json.dumps(data))
@@ -0,0 +1,89 @@
+import json
+import sys
+from datetime import datetime, timedelta
+
+from mysql.connector import errors
+
+import config
+from config import get_db_connection
+
+# Results of replayed operations by their client-generated key. A key is
+# claimed in the same transaction as the operation it guards, so an
+# operation and its key are committed together or not at all, whichever
+# worker handles the retry. A second claim of a committed key fails on the
+# primary key; one still in flight elsewhere waits for that transaction.
+#
+# Keys are kept for REPLAY_KEY_TTL_HOURS and at most REPLAY_MAX_KEYS of
+# them; the day close job drops the rest. Devices are expected to have
+# flushed their queue well within that time.
+
+MAX_KEY_LENGTH = 64
+
+
+def create_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            idem_key VARCHAR(64) PRIMARY KEY,
+            status_code SMALLINT NOT NULL,
+            result TEXT NOT NULL,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_idempotency_created (created_at)
+        )
+    """)
+
+
+# False when the key already exists
+def claim(cursor, key):
+    try:
+        cursor.execute("INSERT INTO idempotency_keys (idem_key, status_code, result) VALUES (%s, 0, '')", (key,))
+    except errors.IntegrityError:
+        return False
+    return True
+
+
+def finish(cursor, key, status_code, result):
+    cursor.execute("UPDATE idempotency_keys SET status_code = %s, result = %s WHERE idem_key = %s",
+                   (status_code, json.dumps(result), key))
+
+
+# {key: (status_code, result)} for the keys that have a stored result
+def stored_results(cursor, keys):
+    if not keys:
+        return {}
+    cursor.execute("SELECT idem_key, status_code, result FROM idempotency_keys WHERE idem_key IN (%s)"
+                   % ', '.join(['%s'] * len(keys)), list(keys))
+    return {key: (status_code, json.loads(result)) for key, status_code, result in cursor.fetchall()}
+
+
+# Deletes expired keys, then the oldest ones beyond the cap, in small
+# batches like the change log prune
+def prune(batch=10000):
+    cutoff = datetime.now() - timedelta(hours=config.REPLAY_CONFIG['key_ttl_hours'])
+    deleted = 0
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        while True:
+            cursor.execute("DELETE FROM idempotency_keys WHERE created_at < %s LIMIT %s", (cutoff, batch))
+            conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch:
+                break
+        cursor.execute("SELECT COUNT(*) FROM idempotency_keys")
+        excess = cursor.fetchone()[0] - config.REPLAY_CONFIG['max_keys']
+        while excess > 0:
+            cursor.execute("DELETE FROM idempotency_keys ORDER BY created_at LIMIT %s", (min(excess, batch),))
+            conn.commit()
+            deleted += cursor.rowcount
+            excess -= cursor.rowcount
+            if not cursor.rowcount:
+                break
+        cursor.close()
+    return deleted
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['prune']:
+        print("Deleted %d idempotency keys" % prune())
+    else:
+        print("usage: python idempotency.py prune")
+        sys.exit(2)
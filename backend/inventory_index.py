@@ -0,0 +1,135 @@
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+import config
+from config import get_db_connection
+from metrics import log
+from schema import day_range
+
+# Rows committed by other workers are picked up by re-reading everything
+# whose updated_at falls after the last row we saw, minus this overlap.
+# Timestamps are assigned before commit, so a slow transaction can commit a
+# row "in the past"; the overlap covers any transaction shorter than it.
+REFRESH_OVERLAP = timedelta(seconds=5)
+
+
+# Rows from the database hold Decimals at their column's scale; write-through
+# values are rounded the way MySQL stores them, so a row looks the same
+# whether it was last loaded or last written here
+def _column(value, places):
+    return Decimal(str(value)).quantize(Decimal(1).scaleb(-places), ROUND_HALF_UP)
+
+
+class InventoryIndex:
+    # Today's product_entries rows keyed by (category, product). Reads are
+    # served from memory; this worker's own writes are applied straight
+    # after commit, and other workers' writes are pulled in by a cheap
+    # incremental query at most every `refresh_interval` seconds.
+    def __init__(self, refresh_interval):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._rows = {}
+        self._day = None
+        self._last_seen = None
+        self._checked_at = 0.0
+        self._stale = True
+
+    def warm(self):
+        day_start, day_end = day_range()
+        with get_db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM product_entries WHERE purchase_date >= %s AND purchase_date < %s",
+                           (day_start, day_end))
+            rows = cursor.fetchall()
+            cursor.close()
+        with self._lock:
+            self._rows = {(row['category'], row['product']): row for row in rows}
+            self._day = day_start.date()
+            self._last_seen = max((row['updated_at'] for row in rows), default=day_start)
+            self._checked_at = time.monotonic()
+            self._stale = False
+
+    def _refresh(self):
+        day_start, day_end = day_range()
+        with get_db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT * FROM product_entries
+                WHERE updated_at >= %s AND purchase_date >= %s AND purchase_date < %s
+            """, (self._last_seen - REFRESH_OVERLAP, day_start, day_end))
+            rows = cursor.fetchall()
+            cursor.close()
+        with self._lock:
+            for row in rows:
+                self._rows[(row['category'], row['product'])] = row
+                if row['updated_at'] > self._last_seen:
+                    self._last_seen = row['updated_at']
+            self._checked_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self._day != date.today() or self._stale:
+            # Day rollover or a write we couldn't apply locally: reload
+            with self._refresh_lock:
+                if self._day != date.today() or self._stale:
+                    self.warm()
+            return
+        if time.monotonic() - self._checked_at < self.refresh_interval:
+            return
+        # One thread refreshes; the others keep serving the current rows
+        if self._refresh_lock.acquire(blocking=False):
+            try:
+                if time.monotonic() - self._checked_at >= self.refresh_interval:
+                    self._refresh()
+            finally:
+                self._refresh_lock.release()
+
+    def rows(self):
+        self._ensure_fresh()
+        with self._lock:
+            return [dict(row) for row in self._rows.values()]
+
+    # Write-through hooks, called by the routes after their commit
+
+    # Takes what the sale left in the row it locked, not the cached row
+    # minus the sale, so a stale entry can't publish a wrong price
+    def apply_sale(self, category, product, remaining_quantity, remaining_price):
+        with self._lock:
+            row = self._rows.get((category, product))
+            if row is None:
+                self._stale = True
+                return
+            row['quantity'] = _column(remaining_quantity, 3)
+            row['price'] = _column(remaining_price, 2)
+            row['price_per_unit'] = _column(remaining_price / remaining_quantity if remaining_quantity > 0 else 0, 4)
+            row['updated_at'] = datetime.now()
+
+    def apply_load(self, category, product, quantity, price):
+        with self._lock:
+            row = self._rows.get((category, product))
+            if row is None:
+                # A brand new row; its id and timestamps come from the database
+                self._stale = True
+                return
+            quantity = float(row['quantity']) + quantity
+            price = float(row['price']) + price
+            row['quantity'] = _column(quantity, 3)
+            row['price'] = _column(price, 2)
+            row['price_per_unit'] = _column(price / quantity if quantity != 0 else 0, 4)
+            row['updated_at'] = datetime.now()
+
+    def invalidate(self):
+        with self._lock:
+            self._stale = True
+
+
+inventory_index = InventoryIndex(config.INVENTORY_REFRESH_SECONDS)
+
+
+def warm_quietly():
+    try:
+        inventory_index.warm()
+    except Exception:
+        log.exception("Could not warm the inventory index; it will load on first use")
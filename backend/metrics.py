@@ -0,0 +1,291 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from flask import Blueprint, Response, request
+
+import config
+
+log = logging.getLogger('giri_bazar')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BACKGROUND_ROUTE = '(background)'
+
+_local = threading.local()
+
+
+# Logging -------------------------------------------------------------------
+# Request threads only put records on an in-memory queue; a listener thread
+# formats them and does the actual write to stderr.
+
+_STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+_listener = None
+_listener_pid = None
+
+
+# Idempotent per process; serve.py calls it again in every forked worker
+# because the listener thread does not survive fork.
+def start_logging():
+    global _listener, _listener_pid
+    if _listener is not None and _listener_pid == os.getpid():
+        return
+    log_queue = queue.SimpleQueue()
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+    _listener_pid = os.getpid()
+
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+    log.addHandler(logging.handlers.QueueHandler(log_queue))
+    log.setLevel(config.METRICS_CONFIG['log_level'])
+    log.propagate = False
+
+
+# Metrics -------------------------------------------------------------------
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class RouteStats:
+    def __init__(self):
+        self.statuses = defaultdict(int)
+        self.latency = Histogram()
+        self.db_seconds = 0.0
+        self.python_seconds = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.slow_queries = 0
+
+
+_lock = threading.Lock()
+_routes = defaultdict(RouteStats)
+
+
+class _RequestStats:
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.slow_queries = 0
+
+
+def _record_query(statement, seconds, rows, executed):
+    current = getattr(_local, 'request', None)
+    slow = executed and seconds * 1000 >= config.METRICS_CONFIG['slow_query_ms']
+    if current is not None:
+        current.db_seconds += seconds
+        current.rows += rows
+        current.queries += executed
+        current.slow_queries += slow
+    else:
+        with _lock:
+            stats = _routes[BACKGROUND_ROUTE]
+            stats.db_seconds += seconds
+            stats.rows += rows
+            stats.queries += executed
+            stats.slow_queries += slow
+    if slow:
+        log.warning('slow query', extra={
+            'route': current.route if current else BACKGROUND_ROUTE,
+            'duration_ms': round(seconds * 1000, 2),
+            'statement': ' '.join(str(statement).split())[:500],
+        })
+
+
+class TimedCursor:
+    # Proxies a mysql cursor, charging execute and fetch time (fetches pull
+    # rows off the socket for unbuffered cursors) to the current request.
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def _timed_execute(self, method, operation, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(operation, *args, **kwargs)
+        finally:
+            rows = 0
+            if not getattr(self._cursor, 'with_rows', False):
+                rows = max(self._cursor.rowcount or 0, 0)
+            _record_query(operation, time.perf_counter() - started, rows, True)
+
+    def execute(self, operation, *args, **kwargs):
+        return self._timed_execute(self._cursor.execute, operation, *args, **kwargs)
+
+    def executemany(self, operation, *args, **kwargs):
+        return self._timed_execute(self._cursor.executemany, operation, *args, **kwargs)
+
+    def _timed_fetch(self, method, *args):
+        started = time.perf_counter()
+        result = method(*args)
+        if result is None:
+            rows = 0
+        elif isinstance(result, list):
+            rows = len(result)
+        else:
+            rows = 1
+        _record_query(None, time.perf_counter() - started, rows, False)
+        return result
+
+    def fetchone(self):
+        return self._timed_fetch(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed_fetch(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed_fetch(self._cursor.fetchall)
+
+
+def _begin_request():
+    rule = request.url_rule
+    _local.request = _RequestStats(rule.rule if rule is not None else '(unmatched)')
+
+
+def _finish_request(current, status):
+    _local.request = None
+    elapsed = time.perf_counter() - current.started
+    with _lock:
+        stats = _routes[current.route]
+        stats.statuses[status] += 1
+        stats.latency.observe(elapsed)
+        stats.db_seconds += current.db_seconds
+        stats.python_seconds += max(elapsed - current.db_seconds, 0.0)
+        stats.queries += current.queries
+        stats.rows += current.rows
+        stats.slow_queries += current.slow_queries
+
+
+def _after_request(response):
+    current = getattr(_local, 'request', None)
+    if current is not None:
+        # Finish once the body has been sent, so streamed responses are
+        # measured end to end rather than up to their first byte.
+        status = response.status_code
+        response.call_on_close(lambda: _finish_request(current, status))
+    return response
+
+
+def _format_labels(**labels):
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('"', '\\"')) for key, value in labels.items())
+
+
+def render():
+    lines = []
+    pid = os.getpid()
+
+    def metric(name, kind, help_text):
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+
+    with _lock:
+        routes = sorted(_routes.items())
+
+        metric('http_requests_total', 'counter', 'Requests served, by route and status.')
+        for route, stats in routes:
+            for status, count in sorted(stats.statuses.items()):
+                lines.append('http_requests_total%s %d' % (_format_labels(route=route, status=status, pid=pid), count))
+
+        metric('http_request_duration_seconds', 'histogram', 'End-to-end request latency.')
+        for route, stats in routes:
+            histogram = stats.latency
+            if not histogram.count:
+                continue
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append('http_request_duration_seconds_bucket%s %d' % (
+                    _format_labels(route=route, le=bound, pid=pid), cumulative))
+            lines.append('http_request_duration_seconds_bucket%s %d' % (
+                _format_labels(route=route, le='+Inf', pid=pid), histogram.count))
+            lines.append('http_request_duration_seconds_sum%s %.6f' % (_format_labels(route=route, pid=pid), histogram.sum))
+            lines.append('http_request_duration_seconds_count%s %d' % (_format_labels(route=route, pid=pid), histogram.count))
+
+        for name, attr, kind, help_text in (
+                ('http_request_db_seconds_total', 'db_seconds', 'counter', 'Time spent in database calls.'),
+                ('http_request_python_seconds_total', 'python_seconds', 'counter', 'Request time outside database calls.'),
+                ('db_queries_total', 'queries', 'counter', 'Statements executed.'),
+                ('db_rows_total', 'rows', 'counter', 'Rows fetched or affected.'),
+                ('db_slow_queries_total', 'slow_queries', 'counter', 'Statements slower than SLOW_QUERY_MS.')):
+            metric(name, kind, help_text)
+            for route, stats in routes:
+                value = getattr(stats, attr)
+                lines.append('%s%s %s' % (name, _format_labels(route=route, pid=pid),
+                                          ('%.6f' % value) if isinstance(value, float) else value))
+
+    pool_stats = config.get_pool().stats()
+    for key in ('open', 'in_use', 'idle', 'size', 'max_overflow'):
+        metric('db_pool_%s' % key, 'gauge', 'Connection pool %s.' % key.replace('_', ' '))
+        lines.append('db_pool_%s%s %d' % (key, _format_labels(pid=pid), pool_stats[key]))
+    for key in ('checkouts', 'waits', 'timeouts', 'created', 'discarded'):
+        metric('db_pool_%s_total' % key, 'counter', 'Connection pool %s.' % key)
+        lines.append('db_pool_%s_total%s %d' % (key, _format_labels(pid=pid), pool_stats[key]))
+    metric('db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a pooled connection.')
+    lines.append('db_pool_wait_seconds_total%s %.6f' % (_format_labels(pid=pid), pool_stats['wait_time_seconds']))
+
+    return '\n'.join(lines) + '\n'
+
+
+# Each worker process keeps its own counters, labelled with its pid; sum
+# over pid when scraping a multi-worker server.
+metrics_api = Blueprint('metrics', __name__)
+
+
+@metrics_api.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    start_logging()
+    config.CURSOR_WRAPPER = TimedCursor
+    config.get_pool().cursor_wrapper = TimedCursor
+    app.before_request(_begin_request)
+    app.after_request(_after_request)
+    app.register_blueprint(metrics_api)
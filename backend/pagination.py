@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+
+MAX_PAGE_SIZE = 1000
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def parse_limit(args):
+    limit = args.get('limit')
+    if limit is None:
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise PaginationError('limit must be an integer')
+    if limit <= 0:
+        raise PaginationError('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+# Cursors look like "<timestamp>,<id>", e.g. "2025-06-01 09:30:00,1532"
+def parse_cursor(value):
+    if not value:
+        return None
+    ts, sep, row_id = value.rpartition(',')
+    try:
+        return datetime.fromisoformat(ts.strip()), int(row_id)
+    except ValueError:
+        raise PaginationError('before must look like "<YYYY-MM-DD HH:MM:SS>,<id>"')
+
+
+def encode_cursor(ts, row_id):
+    return '%s,%d' % (ts.isoformat(sep=' '), row_id)
+
+
+# True for ?format=columnar, False for the default list of row objects
+def parse_format(args):
+    value = args.get('format', 'rows')
+    if value not in ('rows', 'columnar'):
+        raise PaginationError('format must be rows or columnar')
+    return value == 'columnar'
+
+
+def parse_day(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise PaginationError('%s must be YYYY-MM-DD' % name)
+
+
+# The filters shared by the history endpoints: a half-open [from, to)
+# range, optional category/product and the keyset cursor.
+def parse_history_args(args):
+    from_date = args.get('from_date')
+    to_date = args.get('to_date')
+    return {
+        'from': parse_day(from_date, 'from_date') if from_date else None,
+        'to': parse_day(to_date, 'to_date') + timedelta(days=1) if to_date else None,
+        'category': args.get('category') or None,
+        'product': args.get('product') or None,
+        'before': parse_cursor(args.get('before')),
+    }
+
+
+# Builds the WHERE clause for parse_history_args() filters. Dates become
+# half-open ranges and the cursor an expanded row comparison so MySQL can
+# walk the (ts_column, id) index instead of sorting the table.
+def history_filters(filters, ts_column, id_column='id'):
+    clauses = []
+    params = []
+
+    if filters['from']:
+        clauses.append('%s >= %%s' % ts_column)
+        params.append(filters['from'])
+
+    if filters['to']:
+        clauses.append('%s < %%s' % ts_column)
+        params.append(filters['to'])
+
+    for column in ('category', 'product'):
+        if filters[column]:
+            clauses.append('%s = %%s' % column)
+            params.append(filters[column])
+
+    if filters['before']:
+        ts, row_id = filters['before']
+        clauses.append('(%s < %%s OR (%s = %%s AND %s < %%s))' % (ts_column, ts_column, id_column))
+        params.extend([ts, ts, row_id])
+
+    where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+    return where, params
@@ -0,0 +1,231 @@
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+from mysql.connector import Error
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _Slot:
+    # A physical connection plus the bookkeeping the pool needs for it
+    def __init__(self, raw):
+        self.raw = raw
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        # Prepared-statement cursors by name; they live as long as the socket
+        self.prepared = {}
+        # Session variables set through set_session()
+        self.session = {}
+
+
+class PooledConnection:
+    # What callers get from the pool. Behaves like a mysql connection, but
+    # close() hands it back to the pool instead of tearing down the socket.
+    def __init__(self, pool, slot):
+        self._pool = pool
+        self._slot = slot
+
+    def __getattr__(self, name):
+        if self._slot is None:
+            raise Error("Connection already returned to the pool")
+        return getattr(self._slot.raw, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self.__getattr__('cursor')(*args, **kwargs)
+        wrapper = self._pool.cursor_wrapper
+        return wrapper(cursor) if wrapper else cursor
+
+    # A cursor for `name` that prepares its statement on the server the first
+    # time it runs on this physical connection and reuses it afterwards.
+    # Results must be read in full before the next execute.
+    def prepared(self, name):
+        if self._slot is None:
+            raise Error("Connection already returned to the pool")
+        cursor = self._slot.prepared.get(name)
+        if cursor is None:
+            cursor = self.cursor(prepared=True)
+            self._slot.prepared[name] = cursor
+        return cursor
+
+    # SET SESSION name = value, skipped when this physical connection
+    # already has that value
+    def set_session(self, name, value):
+        if self._slot is None:
+            raise Error("Connection already returned to the pool")
+        if self._slot.session.get(name) != value:
+            cursor = self._slot.raw.cursor()
+            cursor.execute("SET SESSION %s = %%s" % name, (value,))
+            cursor.close()
+            self._slot.session[name] = value
+
+    def close(self):
+        slot, self._slot = self._slot, None
+        if slot is not None:
+            self._pool._release(slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self._slot is not None:
+            try:
+                self._slot.raw.rollback()
+            except Error:
+                pass
+        self.close()
+        return False
+
+
+class ConnectionPool:
+    def __init__(self, db_config, size=5, max_overflow=10, timeout=10.0,
+                 max_lifetime=3600.0, ping_interval=30.0, cursor_wrapper=None, connect=None, checkout_hook=None):
+        self.db_config = dict(db_config)
+        # Opens a physical connection from db_config; mysql.connector by default
+        self.connect = connect
+        # Optional callable applied to every cursor handed out, e.g. for timing
+        self.cursor_wrapper = cursor_wrapper
+        # Optional callable run on every connection handed out, e.g. to set
+        # session variables
+        self.checkout_hook = checkout_hook
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self._open = 0
+        self._in_use = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+
+    def connection(self):
+        started = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise Error("Connection pool is closed")
+                if self._idle:
+                    slot = self._idle.pop()
+                    break
+                if self._open < self.size + self.max_overflow:
+                    slot = None
+                    self._open += 1
+                    break
+                if started is None:
+                    started = time.monotonic()
+                    self._waits += 1
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    self._wait_time += time.monotonic() - started
+                    raise PoolTimeout(
+                        "Timed out after %.1fs waiting for a database connection" % self.timeout)
+                self._cond.wait(remaining)
+            if started is not None:
+                self._wait_time += time.monotonic() - started
+            self._in_use += 1
+            self._checkouts += 1
+
+        # Connecting and pinging happen outside the lock so a slow server
+        # doesn't stall every other thread waiting on the pool.
+        try:
+            slot = self._checkout(slot)
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        conn = PooledConnection(self, slot)
+        if self.checkout_hook is not None:
+            try:
+                self.checkout_hook(conn)
+            except Exception:
+                conn.close()
+                raise
+        return conn
+
+    def _checkout(self, slot):
+        now = time.monotonic()
+        if slot is not None and now - slot.created_at > self.max_lifetime:
+            self._discard(slot)
+            slot = None
+        if slot is not None and now - slot.last_used > self.ping_interval:
+            try:
+                slot.raw.ping(reconnect=False)
+            except Error:
+                self._discard(slot)
+                slot = None
+        if slot is None:
+            slot = _Slot((self.connect or mysql.connector.connect)(**self.db_config))
+            with self._cond:
+                self._created += 1
+        return slot
+
+    def _discard(self, slot):
+        try:
+            slot.raw.close()
+        except Error:
+            pass
+        with self._cond:
+            self._discarded += 1
+
+    def _release(self, slot):
+        # Always end the transaction: an open snapshot would otherwise leak
+        # stale REPEATABLE READ data into whichever request gets it next.
+        healthy = True
+        try:
+            if slot.raw.in_transaction:
+                slot.raw.rollback()
+        except Error:
+            healthy = False
+
+        slot.last_used = time.monotonic()
+        expired = slot.last_used - slot.created_at > self.max_lifetime
+        with self._cond:
+            self._in_use -= 1
+            keep = healthy and not expired and not self._closed and len(self._idle) < self.size
+            if keep:
+                self._idle.append(slot)
+            else:
+                self._open -= 1
+            self._cond.notify()
+        if not keep:
+            self._discard(slot)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for slot in idle:
+            self._discard(slot)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_seconds': round(self._wait_time, 6),
+                'timeouts': self._timeouts,
+                'created': self._created,
+                'discarded': self._discarded,
+            }
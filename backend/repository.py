@@ -0,0 +1,114 @@
+import threading
+from collections import OrderedDict
+
+# Catalog queries shared by the routes, run as server-side prepared
+# statements (see PooledConnection.prepared), plus an in-process cache of
+# the ids they look up.
+#
+# Only ids that exist are cached. Categories and products are never renamed
+# or deleted, so a cached id can't go stale in another worker; a name that
+# isn't cached is simply looked up. The write routes clear the cache all
+# the same, so an edit made directly in the database is picked up on the
+# next catalog write.
+
+STATEMENTS = {
+    'category_id': "SELECT id FROM categories WHERE name = %s",
+    # Category and product in one round trip; the product id is NULL when
+    # the category exists without it, and there is no row at all when the
+    # category doesn't exist
+    'catalog_ids': """
+        SELECT c.id, p.id FROM categories c
+        LEFT JOIN products p ON p.category_id = c.id AND p.product_name = %s
+        WHERE c.name = %s
+        ORDER BY p.id LIMIT 1
+    """,
+    'insert_category': "INSERT INTO categories (name) VALUES (%s)",
+    'insert_product': "INSERT INTO products (product_name, category_id, name) VALUES (%s, %s, %s)",
+    'set_price': "UPDATE products SET price_per_kg = %s WHERE id = %s",
+}
+
+LOOKUP_CACHE_SIZE = 4096
+
+
+class LookupCache:
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# ('category', name) -> id and ('product', category, product) -> id
+ids = LookupCache(LOOKUP_CACHE_SIZE)
+
+
+def invalidate():
+    ids.clear()
+
+
+def execute(conn, name, params=()):
+    cursor = conn.prepared(name)
+    cursor.execute(STATEMENTS[name], params)
+    return cursor
+
+
+def category_id(conn, category):
+    cached = ids.get(('category', category))
+    if cached is not None:
+        return cached
+    row = execute(conn, 'category_id', (category,)).fetchall()
+    if not row:
+        return None
+    ids.put(('category', category), row[0][0])
+    return row[0][0]
+
+
+# (category id, product id), either of them None when it doesn't exist
+def catalog_ids(conn, category, product):
+    product_id = ids.get(('product', category, product))
+    if product_id is not None:
+        return ids.get(('category', category)) or category_id(conn, category), product_id
+    rows = execute(conn, 'catalog_ids', (product, category)).fetchall()
+    if not rows:
+        return None, None
+    found_category, product_id = rows[0]
+    ids.put(('category', category), found_category)
+    if product_id is not None:
+        ids.put(('product', category, product), product_id)
+    return found_category, product_id
+
+
+def insert_category(conn, category):
+    cursor = execute(conn, 'insert_category', (category,))
+    return cursor.lastrowid
+
+
+def insert_product(conn, category, category_id, product):
+    cursor = execute(conn, 'insert_product', (product, category_id, category))
+    return cursor.lastrowid
+
+
+def set_price(conn, product_id, price):
+    execute(conn, 'set_price', (price, product_id))
@@ -0,0 +1,151 @@
+import csv
+import dataclasses
+import decimal
+import io
+import uuid
+import zlib
+from datetime import date
+
+from flask import Response, json, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FETCH_SIZE = 500
+
+
+def _json_default(value):
+    # Same representations as Flask's own encoder, so clients see no change
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if dataclasses.is_dataclass(value):
+        return dataclasses.asdict(value)
+    raise TypeError('Object of type %s is not JSON serializable' % type(value).__name__)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    # Encodes with orjson when it is installed. Decimal and datetime columns
+    # go through the same conversions as before, so only the speed changes;
+    # pretty-printed (debug) output still uses the standard library.
+    def dumps(self, obj, **kwargs):
+        if orjson is None or 'indent' in kwargs:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=_json_default, option=option).decode('utf-8')
+
+
+# ?format=columnar sends the column names once and each row as a plain
+# array, e.g. {"columns": ["category", "product"], "rows": [["Veg", "Okra"]]}.
+# Nested objects (the driver/vehicle of /get-entries) become dotted column
+# names such as "driver.driverName".
+def _flatten(row, prefix=''):
+    for key, value in row.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, prefix + key + '.')
+        else:
+            yield prefix + key, value
+
+
+def column_names(row):
+    return [name for name, _ in _flatten(row)]
+
+
+# Returns a function turning rows shaped like `row` into value lists; flat
+# rows (the common case) skip the per-value walk.
+def values_reader(row):
+    if any(isinstance(value, dict) for value in row.values()):
+        return lambda row: [value for _, value in _flatten(row)]
+    return lambda row: list(row.values())
+
+
+def to_columnar(rows):
+    if not rows:
+        return {'columns': [], 'rows': []}
+    read = values_reader(rows[0])
+    return {'columns': column_names(rows[0]), 'rows': [read(row) for row in rows]}
+
+
+def list_response(rows, columnar=False):
+    return jsonify(to_columnar(rows) if columnar else rows)
+
+
+def fetch_in_batches(cursor, size=FETCH_SIZE):
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        yield rows
+
+
+# Streams a JSON array one fetchmany() batch at a time, so the response
+# body is never held in memory as a whole. `batches` is an iterator of row
+# lists; it owns its connection and is closed if the client goes away.
+def stream_json_array(batches, transform=None, columnar=False):
+    def generate():
+        first = True
+        for rows in batches:
+            if transform is not None:
+                rows = [transform(row) for row in rows]
+            if columnar:
+                if first:
+                    read = values_reader(rows[0])
+                    yield '{"columns":%s,"rows":[' % json.dumps(column_names(rows[0]))
+                rows = [read(row) for row in rows]
+            elif first:
+                yield '['
+            # One encoder call per batch, minus the list's own brackets
+            chunk = json.dumps(rows)[1:-1]
+            if not first:
+                chunk = ',' + chunk
+            first = False
+            yield chunk
+        if first:
+            yield '{"columns":[],"rows":[]}' if columnar else '[]'
+        else:
+            yield ']}' if columnar else ']'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+# Streams rows as CSV (optionally gzip-compressed) for download. Like
+# stream_json_array, each fetchmany() batch is encoded and sent as it
+# arrives, so the first bytes go out before the query has finished.
+def stream_csv(header, batches, filename, transform=None, compress=False):
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+        def flush():
+            data = buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            if compressor is None:
+                return data
+            # Sync-flush so every batch reaches the client right away
+            return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        writer.writerow(header)
+        yield flush()
+        for rows in batches:
+            if transform is not None:
+                rows = [transform(row) for row in rows]
+            writer.writerows(rows)
+            yield flush()
+        if compressor is not None:
+            yield compressor.flush()
+
+    if compress:
+        filename += '.gz'
+    response = Response(stream_with_context(generate()),
+                        mimetype='application/gzip' if compress else 'text/csv')
+    response.headers['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
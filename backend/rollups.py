@@ -0,0 +1,130 @@
+import sys
+from datetime import date, datetime, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+import archive
+from config import get_db_connection
+
+# Per-day, per-product totals kept next to the raw tables. They are updated
+# in the same transaction as the sale or stock load that changes them, so
+# reports can sum a few hundred rollup rows instead of every sale line.
+# The totals are DECIMALs at the scale of the sales and product_entries
+# columns they add up, so money sums stay exact.
+
+
+def create_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_sales_rollup (
+            day DATE NOT NULL,
+            category VARCHAR(100) NOT NULL,
+            product VARCHAR(100) NOT NULL,
+            quantity DECIMAL(12, 3) NOT NULL DEFAULT 0,
+            total_price DECIMAL(12, 2) NOT NULL DEFAULT 0,
+            sale_count INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, category, product)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_stock_rollup (
+            day DATE NOT NULL,
+            category VARCHAR(100) NOT NULL,
+            product VARCHAR(100) NOT NULL,
+            loaded_quantity DECIMAL(12, 3) NOT NULL DEFAULT 0,
+            loaded_value DECIMAL(12, 2) NOT NULL DEFAULT 0,
+            load_count INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, category, product)
+        )
+    """)
+
+
+# The routes work in floats; the rollups get them as Decimals at the
+# column's scale
+def _column(value, places):
+    return Decimal(str(value)).quantize(Decimal(1).scaleb(-places), ROUND_HALF_UP)
+
+
+def record_sale(cursor, day, category, product, quantity, total_price):
+    cursor.execute("""
+        INSERT INTO daily_sales_rollup (day, category, product, quantity, total_price, sale_count)
+        VALUES (%s, %s, %s, %s, %s, 1)
+        ON DUPLICATE KEY UPDATE
+            quantity = quantity + VALUES(quantity),
+            total_price = total_price + VALUES(total_price),
+            sale_count = sale_count + 1
+    """, (day, category, product, _column(quantity, 3), _column(total_price, 2)))
+
+
+# rows are (category, product, quantity, value) tuples
+def record_loads(cursor, day, rows):
+    cursor.executemany("""
+        INSERT INTO daily_stock_rollup (day, category, product, loaded_quantity, loaded_value, load_count)
+        VALUES (%s, %s, %s, %s, %s, 1)
+        ON DUPLICATE KEY UPDATE
+            loaded_quantity = loaded_quantity + VALUES(loaded_quantity),
+            loaded_value = loaded_value + VALUES(loaded_value),
+            load_count = load_count + 1
+    """, [(day, category, product, _column(quantity, 3), _column(value, 2))
+          for category, product, quantity, value in rows])
+
+
+# Recomputes the rollups for [from_day, to_day] from sales and
+# product_entry_history. Safe to run while the shop is trading: the range is
+# replaced in one transaction.
+def rebuild(from_day, to_day):
+    # Archived months are gone from the raw tables; their rollups stay as-is
+    first_live = archive.first_live_day()
+    if first_live and from_day < first_live:
+        from_day = first_live
+    if from_day > to_day:
+        return 0, 0
+    start = datetime.combine(from_day, datetime.min.time())
+    end = datetime.combine(to_day + timedelta(days=1), datetime.min.time())
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM daily_sales_rollup WHERE day >= %s AND day <= %s", (from_day, to_day))
+        cursor.execute("""
+            INSERT INTO daily_sales_rollup (day, category, product, quantity, total_price, sale_count)
+            SELECT DATE(sale_date), category, product, SUM(quantity), SUM(total_price), COUNT(*)
+            FROM sales
+            WHERE sale_date >= %s AND sale_date < %s
+            GROUP BY DATE(sale_date), category, product
+        """, (start, end))
+        sales_rows = cursor.rowcount
+        cursor.execute("DELETE FROM daily_stock_rollup WHERE day >= %s AND day <= %s", (from_day, to_day))
+        cursor.execute("""
+            INSERT INTO daily_stock_rollup (day, category, product, loaded_quantity, loaded_value, load_count)
+            SELECT DATE(created_at), category, product, SUM(quantity), SUM(price), COUNT(*)
+            FROM product_entry_history
+            WHERE created_at >= %s AND created_at < %s
+            GROUP BY DATE(created_at), category, product
+        """, (start, end))
+        stock_rows = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    return sales_rows, stock_rows
+
+
+def rebuild_all():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT LEAST(COALESCE((SELECT MIN(sale_date) FROM sales), NOW()),
+                         COALESCE((SELECT MIN(created_at) FROM product_entry_history), NOW()))
+        """)
+        first = cursor.fetchone()[0]
+        cursor.close()
+    # SQLite returns computed timestamps as text
+    if isinstance(first, str):
+        first = datetime.fromisoformat(first)
+    return rebuild(first.date(), date.today())
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == 'rebuild':
+        sales_rows, stock_rows = rebuild(date.fromisoformat(sys.argv[2]), date.fromisoformat(sys.argv[3]))
+    elif len(sys.argv) == 2 and sys.argv[1] == 'rebuild':
+        sales_rows, stock_rows = rebuild_all()
+    else:
+        print("usage: python rollups.py rebuild [FROM_DAY TO_DAY]")
+        sys.exit(2)
+    print("Rebuilt %d sales and %d stock rollup rows" % (sales_rows, stock_rows))
@@ -0,0 +1,140 @@
+import itertools
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+from mysql.connector import Error
+
+import config
+from config import get_db_connection
+from metrics import log
+from pool import ConnectionPool, PoolTimeout
+
+# Read-only routes (reports, history, exports, analytics) take their
+# connection from get_read_connection(), which round-robins over the
+# replicas in DB_REPLICAS, each with its own pool. Writes, /sync and the
+# inventory index always use the primary.
+#
+# - A replica that refuses a connection is skipped for DB_REPLICA_RETRY_AFTER
+#   seconds; one whose pool is exhausted is skipped for that request only.
+#   With no replica available the read goes to the primary.
+# - Read-your-writes: a successful write sets the X-Last-Write cookie (and
+#   header, for clients without cookies) to its time, and for
+#   DB_REPLICA_PIN_SECONDS afterwards that client's reads use the primary,
+#   so a sale shows up on the next history fetch despite replication lag.
+#
+# To try it locally, run a second MySQL instance replicating from the first
+# (or just a copy of it) on another port and start the backend with
+# DB_REPLICAS=127.0.0.1:3307; /api/pool/stats shows where reads went.
+LAST_WRITE = 'X-Last-Write'
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class ReplicaTarget:
+    def __init__(self, host):
+        self.host = host
+        self.down_until = 0.0
+        self.failures = 0
+        hostname, _, port = host.partition(':')
+        db_config = dict(config.DB_CONFIG, host=hostname, port=int(port or 3306))
+        settings = config.REPLICA_CONFIG
+        self.pool = ConnectionPool(db_config, size=settings['size'], max_overflow=settings['max_overflow'],
+                                   timeout=settings['timeout'], max_lifetime=config.POOL_CONFIG['max_lifetime'],
+                                   ping_interval=config.POOL_CONFIG['ping_interval'],
+                                   cursor_wrapper=config.CURSOR_WRAPPER, checkout_hook=config.CHECKOUT_HOOK)
+
+
+class ReadRouter:
+    def __init__(self, hosts):
+        self.hosts = list(hosts)
+        self._lock = threading.Lock()
+        self._targets = None
+        self._targets_pid = None
+        self._next = itertools.count()
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.pinned_reads = 0
+
+    def targets(self):
+        # Built lazily per process, like the primary pool
+        if self._targets is None or self._targets_pid != os.getpid():
+            with self._lock:
+                if self._targets is None or self._targets_pid != os.getpid():
+                    self._targets = [ReplicaTarget(host) for host in self.hosts]
+                    self._targets_pid = os.getpid()
+        return self._targets
+
+    def connection(self, pinned=False):
+        targets = self.targets() if self.hosts else []
+        if pinned and targets:
+            self.pinned_reads += 1
+            return get_db_connection()
+        start = next(self._next)
+        for offset in range(len(targets)):
+            target = targets[(start + offset) % len(targets)]
+            if target.down_until > time.monotonic():
+                continue
+            try:
+                conn = target.pool.connection()
+            except PoolTimeout:
+                continue
+            except Error as e:
+                target.failures += 1
+                target.down_until = time.monotonic() + config.REPLICA_CONFIG['retry_after']
+                log.warning("Replica unavailable, reading from the primary",
+                            extra={'replica': target.host, 'error': str(e)})
+                continue
+            self.replica_reads += 1
+            return conn
+        self.primary_reads += 1
+        return get_db_connection()
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'replica_reads': self.replica_reads,
+            'primary_reads': self.primary_reads,
+            'pinned_reads': self.pinned_reads,
+            'replicas': [{'host': target.host, 'up': target.down_until <= now, 'failures': target.failures,
+                          **target.pool.stats()} for target in (self.targets() if self.hosts else [])],
+        }
+
+
+router = ReadRouter(config.REPLICA_CONFIG['hosts'])
+
+
+def _last_write():
+    value = request.headers.get(LAST_WRITE) or request.cookies.get(LAST_WRITE)
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def pinned():
+    if not has_request_context():
+        return False
+    if 'read_pinned' not in g:
+        last_write = _last_write()
+        g.read_pinned = last_write is not None and time.time() - last_write < config.REPLICA_CONFIG['pin_seconds']
+    return g.read_pinned
+
+
+# A connection for a read-only query: a replica when one is configured and
+# up, otherwise the primary
+def get_read_connection():
+    return router.connection(pinned())
+
+
+def _mark_write(response):
+    if request.method in WRITE_METHODS and response.status_code < 400 and router.hosts:
+        value = '%.3f' % time.time()
+        response.headers[LAST_WRITE] = value
+        response.set_cookie(LAST_WRITE, value, max_age=int(config.REPLICA_CONFIG['pin_seconds']) + 1,
+                            httponly=True, samesite='Lax')
+    return response
+
+
+def init_app(app):
+    app.after_request(_mark_write)
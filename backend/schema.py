@@ -0,0 +1,393 @@
+import sys
+from datetime import date, datetime, time, timedelta
+
+import archive
+import changelog
+import config
+import idempotency
+import rollups
+import storage
+from config import get_db_connection
+
+
+# Half-open [start, end) bounds for a calendar day. Comparing the raw column
+# against these keeps the predicate sargable, unlike DATE(column) = day.
+def day_range(day=None):
+    day = day or date.today()
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+
+def _v1_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(100) NOT NULL UNIQUE,
+            password VARCHAR(255) NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS categories (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL UNIQUE
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            product_name VARCHAR(100) NOT NULL,
+            category_id INT NOT NULL,
+            name VARCHAR(100) NOT NULL,
+            price_per_kg DECIMAL(10, 2) NULL,
+            FOREIGN KEY (category_id) REFERENCES categories(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product_entries (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            category VARCHAR(100) NOT NULL,
+            product VARCHAR(100) NOT NULL,
+            quantity DECIMAL(12, 3) NOT NULL,
+            price DECIMAL(12, 2) NOT NULL,
+            price_per_unit DECIMAL(12, 4) NOT NULL,
+            purchase_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product_entry_history (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            category VARCHAR(100) NOT NULL,
+            product VARCHAR(100) NOT NULL,
+            quantity DECIMAL(12, 3) NOT NULL,
+            price DECIMAL(12, 2) NOT NULL,
+            price_per_unit DECIMAL(12, 4) NOT NULL,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sales (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            category VARCHAR(100) NOT NULL,
+            product VARCHAR(100) NOT NULL,
+            quantity DECIMAL(12, 3) NOT NULL,
+            total_price DECIMAL(12, 2) NOT NULL,
+            sale_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS profit_loss (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            date DATE NOT NULL,
+            total_sale DECIMAL(12, 2) NOT NULL,
+            loaded_stock DECIMAL(12, 2) NOT NULL,
+            remaining_stock DECIMAL(12, 2) NOT NULL,
+            daily_expense DECIMAL(12, 2) NOT NULL,
+            profit_or_loss DECIMAL(12, 2) NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS seller_details (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            sellerName VARCHAR(100) NOT NULL,
+            phoneNumber VARCHAR(20) NOT NULL,
+            vehicleId VARCHAR(50) NOT NULL,
+            driverName VARCHAR(100) NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS vehicle_driver (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            vehicleID VARCHAR(50) NOT NULL,
+            vehicleName VARCHAR(100),
+            vehicleCapacity INT,
+            driverName VARCHAR(100),
+            driverPhone VARCHAR(20),
+            driverLicense VARCHAR(50),
+            dailyWages DECIMAL(10, 2)
+        )
+    """)
+
+
+def _ensure_index(cursor, table, name, columns, unique=False):
+    # MySQL has no CREATE INDEX IF NOT EXISTS, and databases created before
+    # this module existed may already carry some of these by hand.
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, name))
+    if cursor.fetchone():
+        return
+    cursor.execute("CREATE %sINDEX %s ON %s (%s)" % ('UNIQUE ' if unique else '', name, table, ', '.join(columns)))
+
+
+def _v2_indexes(cursor):
+    # InnoDB secondary indexes carry the primary key, so (sale_date) also
+    # serves the (sale_date, id) keyset order used by the history endpoints.
+    _ensure_index(cursor, 'product_entries', 'idx_entries_cat_prod_date', ['category', 'product', 'purchase_date'])
+    _ensure_index(cursor, 'product_entries', 'idx_entries_date', ['purchase_date'])
+    _ensure_index(cursor, 'product_entry_history', 'idx_history_created', ['created_at'])
+    _ensure_index(cursor, 'sales', 'idx_sales_date', ['sale_date'])
+    _ensure_index(cursor, 'products', 'idx_products_cat_name', ['category_id', 'product_name'])
+
+
+def _column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+    """, (table, column))
+    return cursor.fetchone() is not None
+
+
+def _v3_entry_day_key(cursor):
+    # One inventory row per product per day, enforced by the database so
+    # stock loads can upsert with ON DUPLICATE KEY UPDATE.
+    if not _column_exists(cursor, 'product_entries', 'purchase_day'):
+        cursor.execute("""
+            ALTER TABLE product_entries
+            ADD COLUMN purchase_day DATE AS (DATE(purchase_date)) STORED
+        """)
+
+    # Fold any duplicates left by concurrent loads into the oldest row first
+    cursor.execute("""
+        UPDATE product_entries keep
+        JOIN (
+            SELECT MIN(id) AS id, SUM(quantity) AS quantity, SUM(price) AS price
+            FROM product_entries
+            GROUP BY category, product, purchase_day
+            HAVING COUNT(*) > 1
+        ) merged ON keep.id = merged.id
+        SET keep.quantity = merged.quantity,
+            keep.price = merged.price,
+            keep.price_per_unit = IF(merged.quantity = 0, 0, merged.price / merged.quantity)
+    """)
+    cursor.execute("""
+        DELETE extra FROM product_entries extra
+        JOIN (
+            SELECT MIN(id) AS id, category, product, purchase_day
+            FROM product_entries
+            GROUP BY category, product, purchase_day
+            HAVING COUNT(*) > 1
+        ) merged ON extra.category = merged.category
+            AND extra.product = merged.product
+            AND extra.purchase_day = merged.purchase_day
+            AND extra.id <> merged.id
+    """)
+    _ensure_index(cursor, 'product_entries', 'uq_entries_cat_prod_day', ['category', 'product', 'purchase_day'],
+                  unique=True)
+
+
+def _v4_daily_rollups(cursor):
+    rollups.create_tables(cursor)
+    rollups.rebuild_all()
+
+
+def _v5_entry_updated_at(cursor):
+    # Lets each worker's inventory index fetch only the rows other workers
+    # changed since it last looked.
+    if not _column_exists(cursor, 'product_entries', 'updated_at'):
+        cursor.execute("""
+            ALTER TABLE product_entries
+            ADD COLUMN updated_at DATETIME(6) NOT NULL
+                DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)
+        """)
+    _ensure_index(cursor, 'product_entries', 'idx_entries_updated', ['updated_at'])
+
+
+def _v6_change_log(cursor):
+    changelog.create_tables(cursor)
+
+
+def _v7_day_close(cursor):
+    # Written by dayclose.py; carried_at guards against carrying a day's
+    # stock forward twice
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS day_close_jobs (
+            day DATE PRIMARY KEY,
+            status VARCHAR(16) NOT NULL,
+            started_at DATETIME NOT NULL,
+            finished_at DATETIME NULL,
+            carried_at DATETIME NULL,
+            details TEXT NULL,
+            error TEXT NULL
+        )
+    """)
+    # The app used to insert a new profit_loss row on every save; keep the
+    # latest per day so the day close job can upsert by date.
+    cursor.execute("""
+        DELETE older FROM profit_loss older
+        JOIN profit_loss newer ON newer.date = older.date AND newer.id > older.id
+    """)
+    _ensure_index(cursor, 'profit_loss', 'uq_profit_loss_date', ['date'], unique=True)
+
+
+def _v8_monthly_partitions(cursor):
+    # Rebuilds both tables once; run it outside trading hours
+    archive.create_tables(cursor)
+    for table in archive.TABLES:
+        archive.partition_table(cursor, table)
+
+
+def _v9_idempotency_keys(cursor):
+    idempotency.create_tables(cursor)
+
+
+def _v10_decimal_rollups(cursor):
+    # The totals were DOUBLE. Rounding them to the columns' scale drops the
+    # float drift, which is far below the columns' last digit.
+    if config.DB_ENGINE == 'sqlite':
+        # SQLite can't change a column's type, so the tables are rebuilt
+        for table in ('daily_sales_rollup', 'daily_stock_rollup'):
+            cursor.execute("ALTER TABLE %s RENAME TO %s_old" % (table, table))
+        storage.create_schema(cursor)
+        cursor.execute("""
+            INSERT INTO daily_sales_rollup (day, category, product, quantity, total_price, sale_count)
+            SELECT day, category, product, ROUND(quantity, 3), ROUND(total_price, 2), sale_count
+            FROM daily_sales_rollup_old
+        """)
+        cursor.execute("""
+            INSERT INTO daily_stock_rollup (day, category, product, loaded_quantity, loaded_value, load_count)
+            SELECT day, category, product, ROUND(loaded_quantity, 3), ROUND(loaded_value, 2), load_count
+            FROM daily_stock_rollup_old
+        """)
+        for table in ('daily_sales_rollup', 'daily_stock_rollup'):
+            cursor.execute("DROP TABLE %s_old" % table)
+        return
+    cursor.execute("""
+        ALTER TABLE daily_sales_rollup
+        MODIFY quantity DECIMAL(12, 3) NOT NULL DEFAULT 0,
+        MODIFY total_price DECIMAL(12, 2) NOT NULL DEFAULT 0
+    """)
+    cursor.execute("""
+        ALTER TABLE daily_stock_rollup
+        MODIFY loaded_quantity DECIMAL(12, 3) NOT NULL DEFAULT 0,
+        MODIFY loaded_value DECIMAL(12, 2) NOT NULL DEFAULT 0
+    """)
+
+
+MIGRATIONS = [
+    (1, 'create tables', _v1_tables),
+    (2, 'date and lookup indexes', _v2_indexes),
+    (3, 'unique product_entries per product and day', _v3_entry_day_key),
+    (4, 'daily sales and stock rollups', _v4_daily_rollups),
+    (5, 'product_entries change timestamp', _v5_entry_updated_at),
+    (6, 'change log for /sync', _v6_change_log),
+    (7, 'day close jobs and one profit_loss row per day', _v7_day_close),
+    (8, 'monthly partitions for sales and product_entry_history', _v8_monthly_partitions),
+    (9, 'idempotency keys for /replay', _v9_idempotency_keys),
+    (10, 'DECIMAL rollup totals', _v10_decimal_rollups),
+]
+
+# Steps that also change SQLite tables; they run on SQLite databases that
+# were created before them
+SQLITE_STEPS = {10}
+
+
+def current_version(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cursor.fetchone()[0]
+
+
+def migrate():
+    applied = []
+    with get_db_connection() as conn:
+        cursor = conn.cursor(buffered=True)
+        version = current_version(cursor)
+        for number, description, step in MIGRATIONS:
+            if number <= version:
+                continue
+            # The steps are MySQL DDL; SQLite gets the schema they add up to
+            # in one go, and every migration is recorded as applied
+            if config.DB_ENGINE == 'sqlite':
+                if not applied:
+                    storage.create_schema(cursor)
+                if version and number in SQLITE_STEPS:
+                    step(cursor)
+            else:
+                step(cursor)
+            cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                           (number, description))
+            conn.commit()
+            applied.append(number)
+        cursor.close()
+    return applied
+
+
+# Mirrors of the date-filtered queries in app.py, checked by explain_hot_queries()
+def _hot_queries():
+    start, end = day_range()
+    return {
+        'inventory_today': (
+            "SELECT * FROM product_entries WHERE purchase_date >= %s AND purchase_date < %s",
+            (start, end)),
+        'inventory_refresh': (
+            "SELECT * FROM product_entries"
+            " WHERE updated_at >= %s AND purchase_date >= %s AND purchase_date < %s",
+            (datetime.now() - timedelta(seconds=5), start, end)),
+        'entry_lookup': (
+            "SELECT id, quantity, price FROM product_entries"
+            " WHERE category = %s AND product = %s AND purchase_date >= %s AND purchase_date < %s",
+            ('x', 'x', start, end)),
+        'sales_range': (
+            "SELECT id, product, category, quantity, total_price, sale_date FROM sales"
+            " WHERE sale_date >= %s AND sale_date < %s ORDER BY sale_date DESC, id DESC LIMIT 100",
+            (start, end)),
+        'history_range': (
+            "SELECT * FROM product_entry_history"
+            " WHERE created_at >= %s AND created_at < %s ORDER BY created_at DESC, id DESC LIMIT 100",
+            (start, end)),
+        'sales_report': (
+            "SELECT product, category, SUM(quantity), SUM(total_price) FROM daily_sales_rollup"
+            " WHERE day >= %s AND day <= %s GROUP BY category, product",
+            (start.date() - timedelta(days=30), start.date())),
+        'sync_delta': (
+            "SELECT version, entity, entity_id, op FROM change_log WHERE version > %s ORDER BY version LIMIT 1000",
+            (0,)),
+        'loaded_today': (
+            "SELECT COALESCE(SUM(loaded_value), 0) FROM daily_stock_rollup WHERE day = %s",
+            (start.date(),)),
+    }
+
+
+# Runs EXPLAIN on every hot query and returns {name: [problems]} for the
+# ones that would scan a whole table instead of using an index.
+def explain_hot_queries():
+    problems = {}
+    with get_db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        for name, (query, params) in _hot_queries().items():
+            if config.DB_ENGINE == 'sqlite':
+                cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+                for row in cursor.fetchall():
+                    if row['detail'].startswith('SCAN ') and 'INDEX' not in row['detail']:
+                        problems.setdefault(name, []).append(row['detail'])
+                continue
+            cursor.execute("EXPLAIN " + query, params)
+            for row in cursor.fetchall():
+                if row.get('type') == 'ALL' or not row.get('key'):
+                    problems.setdefault(name, []).append(
+                        "%s: type=%s key=%s" % (row.get('table'), row.get('type'), row.get('key')))
+        cursor.close()
+    return problems
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'migrate'
+    if command == 'migrate':
+        print("Applied migrations:", migrate() or "none, schema is up to date")
+    elif command == 'explain':
+        problems = explain_hot_queries()
+        for name, issues in problems.items():
+            print("%s does not use an index: %s" % (name, '; '.join(issues)))
+        sys.exit(1 if problems else 0)
+    else:
+        print("usage: python schema.py [migrate|explain]")
+        sys.exit(2)
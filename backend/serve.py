@@ -0,0 +1,62 @@
+# Production entry point: a pre-forking gunicorn server with threaded
+# workers. Settings come from the WEB_* environment variables in config.py.
+#
+#   python serve.py
+#
+# SIGTERM to the master process shuts down gracefully. The app is preloaded
+# in the master, so SIGHUP only replaces the workers with copies of the
+# code already loaded; deploying new code needs a full restart.
+from gunicorn.app.base import BaseApplication
+
+import config
+import dayclose
+import inventory_index
+import metrics
+
+
+def post_fork(server, worker):
+    # The app is preloaded in the master, so each worker starts with a copy
+    # of the master's module state; give it its own connection pool.
+    config.reset_pool()
+    metrics.start_logging()
+    inventory_index.warm_quietly()
+    dayclose.start_quietly()
+
+
+class GiriBazarServer(BaseApplication):
+    def __init__(self, options=None):
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    # Importing app already built the application
+    def load(self):
+        from app import app
+        return app
+
+
+def options_from_config():
+    server = config.SERVER_CONFIG
+    return {
+        'bind': server['bind'],
+        # The embedded engine's GET_LOCK only locks within one process
+        'workers': 1 if config.DB_ENGINE == 'sqlite' else server['workers'],
+        'threads': server['threads'],
+        'worker_class': 'gthread',
+        'keepalive': server['keepalive'],
+        'timeout': server['timeout'],
+        'graceful_timeout': server['graceful_timeout'],
+        'max_requests': server['max_requests'],
+        'max_requests_jitter': server['max_requests'] // 10,
+        'preload_app': True,
+        'post_fork': post_fork,
+        'accesslog': '-',
+    }
+
+
+if __name__ == '__main__':
+    GiriBazarServer(options_from_config()).run()
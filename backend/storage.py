@@ -0,0 +1,431 @@
+import re
+import sqlite3
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+from mysql.connector import errors
+
+import config
+
+# The embedded engine, for a shop that runs the backend on one machine
+# without a MySQL server: DB_ENGINE=sqlite keeps everything in the file at
+# SQLITE_PATH. connect_sqlite() returns a connection that behaves like a
+# mysql.connector one as far as this code base is concerned, so the routes
+# and modules run on it unchanged:
+#
+# - %s placeholders and the few MySQL-only constructs the queries use
+#   (ON DUPLICATE KEY UPDATE, VALUES(col), IF(), FOR UPDATE, DELETE ... LIMIT)
+#   are translated once per distinct statement, and NOW(), CURDATE(),
+#   DATEDIFF(), LEAST() and GET_LOCK()/RELEASE_LOCK() are provided as
+#   functions.
+# - cursor(dictionary=True) returns dicts; DECIMAL, DATE and DATETIME
+#   columns come back as Decimal, date and datetime.
+# - sqlite3 errors are raised as their mysql.connector counterparts, so
+#   `except errors.IntegrityError` and friends keep working.
+# - Reads run outside a transaction and see the latest commit. The first
+#   write, or a SELECT ... FOR UPDATE, opens the transaction with
+#   BEGIN IMMEDIATE, which takes the database's single write lock up front;
+#   that is what FOR UPDATE row locks become. Other writers queue on
+#   busy_timeout, readers are never blocked (WAL).
+#
+# GET_LOCK only locks within the process, so the server runs one worker
+# (see serve.py). Partitions and the month archive are MySQL-only.
+
+_READ_ONLY = re.compile(r'^\s*(SELECT|WITH|EXPLAIN|PRAGMA)\b', re.IGNORECASE)
+_FOR_UPDATE = re.compile(r'\s+FOR\s+UPDATE\b', re.IGNORECASE)
+_ON_DUPLICATE = re.compile(r'\bON\s+DUPLICATE\s+KEY\s+UPDATE\b', re.IGNORECASE)
+_VALUES_OF = re.compile(r'\bVALUES\((\w+)\)', re.IGNORECASE)
+_IF = re.compile(r'\bIF\(', re.IGNORECASE)
+_DELETE_LIMIT = re.compile(r'^\s*DELETE\s+FROM\s+(\w+)(.*?)\s+LIMIT\s+(%s|\d+)\s*$', re.IGNORECASE | re.DOTALL)
+# Gives SELECT NOW() AS x a declared type, so it comes back as a datetime
+_NOW_ALIAS = re.compile(r'(\bNOW\(\d*\))\s+AS\s+(\w+)', re.IGNORECASE)
+
+_LOCAL_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"
+
+# The schema all the migrations in schema.py add up to, in SQLite's dialect.
+# Partitioned tables keep their plain primary key.
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username VARCHAR(100) NOT NULL UNIQUE,
+        password VARCHAR(255) NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS categories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(100) NOT NULL UNIQUE
+    )""",
+    """CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_name VARCHAR(100) NOT NULL,
+        category_id INT NOT NULL REFERENCES categories(id),
+        name VARCHAR(100) NOT NULL,
+        price_per_kg DECIMAL(10, 2) NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS product_entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        category VARCHAR(100) NOT NULL,
+        product VARCHAR(100) NOT NULL,
+        quantity DECIMAL(12, 3) NOT NULL,
+        price DECIMAL(12, 2) NOT NULL,
+        price_per_unit DECIMAL(12, 4) NOT NULL,
+        purchase_date DATETIME NOT NULL DEFAULT (%s),
+        updated_at DATETIME NOT NULL DEFAULT (%s),
+        purchase_day DATE GENERATED ALWAYS AS (date(purchase_date)) STORED
+    )""" % (_LOCAL_NOW, _LOCAL_NOW),
+    # MySQL's ON UPDATE CURRENT_TIMESTAMP(6)
+    """CREATE TRIGGER IF NOT EXISTS trg_entries_updated_at
+    AFTER UPDATE OF category, product, quantity, price, price_per_unit, purchase_date ON product_entries
+    BEGIN
+        UPDATE product_entries SET updated_at = %s WHERE id = NEW.id;
+    END""" % _LOCAL_NOW,
+    """CREATE TABLE IF NOT EXISTS product_entry_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        category VARCHAR(100) NOT NULL,
+        product VARCHAR(100) NOT NULL,
+        quantity DECIMAL(12, 3) NOT NULL,
+        price DECIMAL(12, 2) NOT NULL,
+        price_per_unit DECIMAL(12, 4) NOT NULL,
+        created_at DATETIME NOT NULL DEFAULT (%s)
+    )""" % _LOCAL_NOW,
+    """CREATE TABLE IF NOT EXISTS sales (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        category VARCHAR(100) NOT NULL,
+        product VARCHAR(100) NOT NULL,
+        quantity DECIMAL(12, 3) NOT NULL,
+        total_price DECIMAL(12, 2) NOT NULL,
+        sale_date DATETIME NOT NULL DEFAULT (%s)
+    )""" % _LOCAL_NOW,
+    """CREATE TABLE IF NOT EXISTS profit_loss (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date DATE NOT NULL,
+        total_sale DECIMAL(12, 2) NOT NULL,
+        loaded_stock DECIMAL(12, 2) NOT NULL,
+        remaining_stock DECIMAL(12, 2) NOT NULL,
+        daily_expense DECIMAL(12, 2) NOT NULL,
+        profit_or_loss DECIMAL(12, 2) NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS seller_details (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sellerName VARCHAR(100) NOT NULL,
+        phoneNumber VARCHAR(20) NOT NULL,
+        vehicleId VARCHAR(50) NOT NULL,
+        driverName VARCHAR(100) NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS vehicle_driver (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        vehicleID VARCHAR(50) NOT NULL,
+        vehicleName VARCHAR(100),
+        vehicleCapacity INT,
+        driverName VARCHAR(100),
+        driverPhone VARCHAR(20),
+        driverLicense VARCHAR(50),
+        dailyWages DECIMAL(10, 2)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_entries_cat_prod_date ON product_entries (category, product, purchase_date)",
+    "CREATE INDEX IF NOT EXISTS idx_entries_date ON product_entries (purchase_date)",
+    "CREATE INDEX IF NOT EXISTS idx_entries_updated ON product_entries (updated_at)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_entries_cat_prod_day ON product_entries (category, product, purchase_day)",
+    "CREATE INDEX IF NOT EXISTS idx_history_created ON product_entry_history (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_sales_date ON sales (sale_date)",
+    "CREATE INDEX IF NOT EXISTS idx_products_cat_name ON products (category_id, product_name)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_profit_loss_date ON profit_loss (date)",
+    """CREATE TABLE IF NOT EXISTS daily_sales_rollup (
+        day DATE NOT NULL,
+        category VARCHAR(100) NOT NULL,
+        product VARCHAR(100) NOT NULL,
+        quantity DECIMAL(12, 3) NOT NULL DEFAULT 0,
+        total_price DECIMAL(12, 2) NOT NULL DEFAULT 0,
+        sale_count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, category, product)
+    )""",
+    """CREATE TABLE IF NOT EXISTS daily_stock_rollup (
+        day DATE NOT NULL,
+        category VARCHAR(100) NOT NULL,
+        product VARCHAR(100) NOT NULL,
+        loaded_quantity DECIMAL(12, 3) NOT NULL DEFAULT 0,
+        loaded_value DECIMAL(12, 2) NOT NULL DEFAULT 0,
+        load_count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, category, product)
+    )""",
+    """CREATE TABLE IF NOT EXISTS change_log (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity VARCHAR(32) NOT NULL,
+        entity_id INT NOT NULL,
+        op VARCHAR(8) NOT NULL CHECK (op IN ('upsert', 'delete')),
+        changed_at DATETIME NOT NULL DEFAULT (%s)
+    )""" % _LOCAL_NOW,
+    "CREATE INDEX IF NOT EXISTS idx_change_log_changed ON change_log (changed_at)",
+    """CREATE TABLE IF NOT EXISTS day_close_jobs (
+        day DATE PRIMARY KEY,
+        status VARCHAR(16) NOT NULL,
+        started_at DATETIME NOT NULL,
+        finished_at DATETIME NULL,
+        carried_at DATETIME NULL,
+        details TEXT NULL,
+        error TEXT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS archived_months (
+        table_name VARCHAR(64) NOT NULL,
+        month DATE NOT NULL,
+        status VARCHAR(16) NOT NULL,
+        row_count INT NOT NULL,
+        path VARCHAR(255) NOT NULL,
+        archived_at DATETIME NOT NULL DEFAULT (%s),
+        PRIMARY KEY (table_name, month)
+    )""" % _LOCAL_NOW,
+    """CREATE TABLE IF NOT EXISTS idempotency_keys (
+        idem_key VARCHAR(64) PRIMARY KEY,
+        status_code SMALLINT NOT NULL,
+        result TEXT NOT NULL,
+        created_at DATETIME NOT NULL DEFAULT (%s)
+    )""" % _LOCAL_NOW,
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys (created_at)",
+]
+
+
+def _to_decimal(value):
+    return Decimal(value.decode())
+
+
+def _to_date(value):
+    return date.fromisoformat(value.decode()[:10])
+
+
+def _to_datetime(value):
+    return datetime.fromisoformat(value.decode())
+
+
+sqlite3.register_converter('DECIMAL', _to_decimal)
+sqlite3.register_converter('DATE', _to_date)
+sqlite3.register_converter('DATETIME', _to_datetime)
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+
+
+@lru_cache(maxsize=1024)
+def translate(sql):
+    sql = _FOR_UPDATE.sub('', sql)
+    sql = _ON_DUPLICATE.sub('ON CONFLICT DO UPDATE SET', sql)
+    sql = _VALUES_OF.sub(r'excluded.\1', sql)
+    sql = _IF.sub('IIF(', sql)
+    sql = _NOW_ALIAS.sub(r'\1 AS "\2 [DATETIME]"', sql)
+    match = _DELETE_LIMIT.match(sql)
+    if match:
+        table, rest, limit = match.groups()
+        sql = "DELETE FROM %s WHERE rowid IN (SELECT rowid FROM %s%s LIMIT %s)" % (table, table, rest, limit)
+    return sql.replace('%%', '\0').replace('%s', '?').replace('\0', '%')
+
+
+@lru_cache(maxsize=1024)
+def _writes(sql):
+    return not _READ_ONLY.match(sql) or _FOR_UPDATE.search(sql) is not None
+
+
+# SQL functions ---------------------------------------------------------------
+
+def _now(precision=0):
+    return datetime.now().isoformat(' ', 'microseconds' if precision else 'seconds')
+
+
+def _curdate():
+    return date.today().isoformat()
+
+
+def _datediff(first, second):
+    if first is None or second is None:
+        return None
+    return (date.fromisoformat(str(first)[:10]) - date.fromisoformat(str(second)[:10])).days
+
+
+def _least(*values):
+    return None if None in values else min(values)
+
+
+# Named locks for GET_LOCK(); process-wide, like MySQL's are server-wide
+_named_locks = {}
+_named_locks_lock = threading.Lock()
+
+
+def _named_lock(name):
+    with _named_locks_lock:
+        return _named_locks.setdefault(name, threading.Lock())
+
+
+# Errors ----------------------------------------------------------------------
+
+class _MySQLErrors:
+    # Re-raises sqlite3 errors as the mysql.connector error callers expect
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None or not issubclass(exc_type, sqlite3.Error):
+            return False
+        if issubclass(exc_type, sqlite3.IntegrityError):
+            raise errors.IntegrityError(msg=str(exc)) from exc
+        if issubclass(exc_type, sqlite3.OperationalError):
+            raise errors.OperationalError(msg=str(exc)) from exc
+        if issubclass(exc_type, sqlite3.ProgrammingError):
+            raise errors.ProgrammingError(msg=str(exc)) from exc
+        raise errors.DatabaseError(msg=str(exc)) from exc
+
+
+_mysql_errors = _MySQLErrors()
+
+
+# Connection ------------------------------------------------------------------
+
+class SQLiteCursor:
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._cursor = connection.raw.cursor()
+        self._dictionary = dictionary
+        self._columns = None
+
+    def execute(self, operation, params=()):
+        with _mysql_errors:
+            self._connection.begin_for(operation)
+            self._cursor.execute(translate(operation), params or ())
+        self._columns = [column[0] for column in self._cursor.description or ()]
+
+    def executemany(self, operation, seq_params):
+        with _mysql_errors:
+            self._connection.begin_for(operation)
+            self._cursor.executemany(translate(operation), seq_params)
+        self._columns = None
+
+    def _row(self, row):
+        return dict(zip(self._columns, row)) if self._dictionary and row is not None else row
+
+    def fetchone(self):
+        with _mysql_errors:
+            return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        with _mysql_errors:
+            rows = self._cursor.fetchmany(size)
+        return [self._row(row) for row in rows] if self._dictionary else rows
+
+    def fetchall(self):
+        with _mysql_errors:
+            rows = self._cursor.fetchall()
+        return [self._row(row) for row in rows] if self._dictionary else rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def with_rows(self):
+        return self._cursor.description is not None
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    def __init__(self, path, busy_timeout=5000, cache_size=-65536, mmap_size=268435456):
+        self.raw = sqlite3.connect(path, isolation_level=None, check_same_thread=False,
+                                   detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+        self.raw.execute("PRAGMA journal_mode = WAL")
+        # Durable across application crashes; a power cut may lose the last
+        # commits but never corrupts the file
+        self.raw.execute("PRAGMA synchronous = NORMAL")
+        self.raw.execute("PRAGMA busy_timeout = %d" % busy_timeout)
+        self.raw.execute("PRAGMA foreign_keys = ON")
+        self.raw.execute("PRAGMA cache_size = %d" % cache_size)
+        self.raw.execute("PRAGMA mmap_size = %d" % mmap_size)
+        self.raw.execute("PRAGMA temp_store = MEMORY")
+        self.raw.create_function('NOW', -1, _now)
+        self.raw.create_function('CURDATE', 0, _curdate)
+        self.raw.create_function('DATEDIFF', 2, _datediff, deterministic=True)
+        self.raw.create_function('LEAST', -1, _least, deterministic=True)
+        self.raw.create_function('GET_LOCK', 2, self._get_lock)
+        self.raw.create_function('RELEASE_LOCK', 1, self._release_lock)
+        self._locks = {}
+
+    def begin_for(self, operation):
+        if not self.raw.in_transaction and _writes(operation):
+            self.raw.execute("BEGIN IMMEDIATE")
+
+    def _get_lock(self, name, timeout):
+        if name in self._locks:
+            return 1
+        lock = _named_lock(name)
+        if not lock.acquire(timeout=timeout if timeout is not None and timeout >= 0 else -1):
+            return 0
+        self._locks[name] = lock
+        return 1
+
+    def _release_lock(self, name):
+        lock = self._locks.pop(name, None)
+        if lock is None:
+            return None
+        lock.release()
+        return 1
+
+    def cursor(self, dictionary=False, buffered=None, prepared=None):
+        return SQLiteCursor(self, dictionary=dictionary)
+
+    # A snapshot for several reads (REPEATABLE READ in MySQL)
+    def start_transaction(self, consistent_snapshot=False, isolation_level=None, readonly=None):
+        with _mysql_errors:
+            self.raw.execute("BEGIN")
+
+    @property
+    def in_transaction(self):
+        return self.raw.in_transaction
+
+    def commit(self):
+        with _mysql_errors:
+            self.raw.commit()
+
+    def rollback(self):
+        with _mysql_errors:
+            self.raw.rollback()
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        for name in list(self._locks):
+            self._release_lock(name)
+        with _mysql_errors:
+            self.raw.close()
+
+
+def connect_sqlite(database, busy_timeout=5000, cache_size=-65536, mmap_size=268435456):
+    with _mysql_errors:
+        return SQLiteConnection(database, busy_timeout=busy_timeout, cache_size=cache_size, mmap_size=mmap_size)
+
+
+# Schema ----------------------------------------------------------------------
+
+def create_schema(cursor):
+    for statement in SCHEMA:
+        cursor.execute(statement)
+
+
+def table_exists(cursor, table):
+    if config.DB_ENGINE == 'sqlite':
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", (table,))
+    else:
+        cursor.execute("""
+            SELECT 1 FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = %s
+        """, (table,))
+    return bool(cursor.fetchall())
@@ -0,0 +1,123 @@
+# Hammers /sellProduct from many threads against a real database and checks
+# that the stock never goes negative and every sale is accounted for.
+#
+#   python stress_sell.py [--stock 500] [--threads 32] [--sells 40]
+import argparse
+import os
+import sys
+import threading
+from collections import Counter
+
+import config
+from schema import day_range, migrate
+
+CATEGORY = '__stress__'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stock', type=float, default=500)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--sells', type=int, default=40, help='sells per thread')
+    parser.add_argument('--quantity', type=float, default=1)
+    args = parser.parse_args()
+
+    config.POOL_CONFIG['size'] = args.threads
+    config.POOL_CONFIG['max_overflow'] = 0
+    # Every thread is a counter, so admission must let all of them in at once
+    config.ADMISSION_CONFIG['max_active'] = args.threads
+    config.ADMISSION_CONFIG['classes']['critical'].update(limit=args.threads, queue=args.threads)
+    from app import app
+
+    migrate()
+    product = 'stock-%d' % os.getpid()
+    with config.get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO product_entries (category, product, quantity, price, price_per_unit)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (CATEGORY, product, args.stock, args.stock * 2, 2))
+        conn.commit()
+
+    statuses = Counter()
+    lock = threading.Lock()
+    start = threading.Barrier(args.threads)
+
+    def worker():
+        client = app.test_client()
+        start.wait()
+        for _ in range(args.sells):
+            response = client.post('/sellProduct', json={
+                'category': CATEGORY, 'product': product, 'quantity': args.quantity})
+            # Closing runs the app's on-close callbacks, which release the
+            # request's admission slot, as a real server does
+            response.close()
+            with lock:
+                statuses[response.status_code] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    day_start, day_end = day_range()
+    with config.get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT quantity FROM product_entries
+            WHERE category = %s AND product = %s AND purchase_date >= %s AND purchase_date < %s
+        """, (CATEGORY, product, day_start, day_end))
+        remaining = float(cursor.fetchone()[0])
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(quantity), 0) FROM sales WHERE category = %s AND product = %s",
+                       (CATEGORY, product))
+        sale_rows, sold = cursor.fetchone()
+        sold = float(sold)
+        # Every sale must reach /sync under its own id
+        cursor.execute("""
+            SELECT COUNT(*) FROM sales s
+            WHERE s.category = %s AND s.product = %s AND NOT EXISTS (
+                SELECT 1 FROM change_log c WHERE c.entity = 'sales' AND c.entity_id = s.id)
+        """, (CATEGORY, product))
+        unlogged = cursor.fetchone()[0]
+
+        # Leave nothing behind for reports, P&L or /sync to pick up
+        cursor.execute("""
+            DELETE FROM change_log
+            WHERE entity = 'sales' AND entity_id IN (SELECT id FROM sales WHERE category = %s AND product = %s)
+        """, (CATEGORY, product))
+        cursor.execute("""
+            DELETE FROM change_log
+            WHERE entity IN ('inventory', 'low_stock', 'loads')
+            AND entity_id IN (SELECT id FROM product_entries WHERE category = %s AND product = %s)
+        """, (CATEGORY, product))
+        cursor.execute("DELETE FROM sales WHERE category = %s AND product = %s", (CATEGORY, product))
+        cursor.execute("DELETE FROM product_entries WHERE category = %s AND product = %s", (CATEGORY, product))
+        cursor.execute("DELETE FROM daily_sales_rollup WHERE category = %s AND product = %s", (CATEGORY, product))
+        cursor.execute("DELETE FROM daily_stock_rollup WHERE category = %s AND product = %s", (CATEGORY, product))
+        conn.commit()
+
+    print("responses:", dict(statuses))
+    print("stock %.3f, sold %.3f in %d rows, remaining %.3f" % (args.stock, sold, sale_rows, remaining))
+
+    failures = []
+    if remaining < 0:
+        failures.append("stock went negative")
+    if sold > args.stock:
+        failures.append("oversold by %.3f" % (sold - args.stock))
+    if abs(args.stock - sold - remaining) > 1e-6:
+        failures.append("lost update: stock - sold != remaining")
+    if sale_rows != statuses[200]:
+        failures.append("%d successful responses but %d sales rows" % (statuses[200], sale_rows))
+    unexpected = {status: count for status, count in statuses.items() if status not in (200, 400)}
+    if unexpected:
+        failures.append("unexpected responses: %s" % unexpected)
+    if unlogged:
+        failures.append("%d sales rows missing from the change log" % unlogged)
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# python -m pytest test_admission.py  -- needs no database
+import threading
+
+from flask import Flask, jsonify
+
+import admission
+import config
+
+
+def make_app():
+    app = Flask(__name__)
+    both_in = threading.Barrier(2)
+
+    # Returns only once two requests are inside it at the same time
+    @app.route('/standard')
+    def standard():
+        both_in.wait(timeout=5)
+        return jsonify({'ok': True}), 200
+
+    app.before_request(admission._admit)
+    app.after_request(admission._release_on_close)
+    app.teardown_request(admission._release)
+    return app
+
+
+def test_two_concurrent_standard_requests(monkeypatch):
+    monkeypatch.setattr(admission, 'controller', admission.AdmissionController(config.ADMISSION_CONFIG))
+    app = make_app()
+    statuses = []
+
+    def request():
+        response = app.test_client().get('/standard')
+        response.close()
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=request) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert statuses == [200, 200]
+    assert admission.controller.stats()['classes']['standard']['shed'] == 0
+
+
+def test_queued_request_waits_for_a_slot():
+    controller = admission.AdmissionController(dict(config.ADMISSION_CONFIG, max_active=2, reserved=1))
+    controller.acquire('standard', 'api.a')
+    released = threading.Timer(0.1, controller.release, ('standard', 'api.a'))
+    released.start()
+    # Queues behind the first one instead of being turned away
+    controller.acquire('standard', 'api.b')
+    released.join()
+    assert controller.stats()['classes']['standard']['queued'] == 1